@@ -2,6 +2,7 @@ from idzip.compressor import MAX_MEMBER_SIZE, compress_member
 from idzip.api import (
     IdzipFile, compress, decompress, open as dzopen,
     IdzipWriter as Writer)
+from idzip.logwriter import IdzipLogWriter as LogWriter
 
 # get a copy of the open standard file open before overwriting
 fopen = open
@@ -11,5 +12,5 @@ open = dzopen
 __all__ = [
     "MAX_MEMBER_SIZE", "compress_member",
     "IdzipFile", "compress", "decompress",
-    "Writer", "open"
+    "Writer", "LogWriter", "open"
 ]
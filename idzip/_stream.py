@@ -19,7 +19,12 @@ class IOStreamWrapperMixin(object):
         return self.stream.fileno()
 
     def __del__(self):
-        if not self.closed:
+        try:
+            closed = self.closed
+        except AttributeError:
+            # The constructor failed before opening the stream.
+            return
+        if not closed:
             self.close()
 
 
@@ -0,0 +1,220 @@
+"""
+Per-chunk Bloom filters of byte trigrams.
+
+The filters are stored in a sidecar file next to the compressed file.
+A substring search decompresses only the chunks whose filters admit
+every trigram of the needle.
+
+The sidecar starts with:
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+|     MAGIC     |  VER  | HASHES| FILTER_SIZE   |    CHCNT      |          ISIZE (8 bytes)      |
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+followed by CHCNT filters of FILTER_SIZE bytes.
+The filter of a chunk includes the trigrams starting in the chunk,
+also the ones ending in the next chunk.
+"""
+
+import bisect
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SUFFIX = ".bloom"
+MAGIC = b"IDZB"
+VERSION = 1
+HEADER_FORMAT = "<4sHHIIQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+NUM_HASHES = 2
+# The filter of a chunk has chunk_length / FILTER_RATIO bytes.
+FILTER_RATIO = 8
+MIN_FILTER_SIZE = 64
+
+# Odd multipliers of the trigram hashes.
+_MULTIPLIERS = (0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F,
+        0x165667B1, 0xD3A2646D, 0xFD7046C5, 0xB55A4F09)
+MAX_HASHES = len(_MULTIPLIERS)
+
+
+def filter_size_for(chunk_length):
+    return max(MIN_FILTER_SIZE, chunk_length // FILTER_RATIO)
+
+
+def sidecar_name(filename):
+    return filename + SUFFIX
+
+
+class ChunkFilters(object):
+    def __init__(self, filter_size, num_hashes=NUM_HASHES):
+        """Creates empty filters of filter_size bytes per chunk.
+        """
+        if filter_size <= 0:
+            raise ValueError("Invalid filter size: %r" % filter_size)
+        if not 0 < num_hashes <= MAX_HASHES:
+            raise ValueError("Invalid number of hashes: %r" % num_hashes)
+        self.filter_size = filter_size
+        self.num_hashes = num_hashes
+        # The uncompressed size of the added chunks.
+        self.size = 0
+        self._filters = bytearray()
+        self._last_chunk = None
+
+    def add_chunk(self, chunk):
+        """Adds the next chunk.
+        Its filter is built when the start of the next chunk is known.
+        """
+        if self._last_chunk is not None:
+            self._add_filter(self._last_chunk + bytes(chunk[:2]))
+        self._last_chunk = bytes(chunk)
+        self.size += len(chunk)
+
+    def finish(self):
+        """Builds the filter of the last chunk.
+        """
+        if self._last_chunk is not None:
+            self._add_filter(self._last_chunk)
+            self._last_chunk = None
+
+    def _add_filter(self, data):
+        self._filters += build_filter(data, self.filter_size,
+                self.num_hashes)
+
+    def __len__(self):
+        return len(self._filters) // self.filter_size
+
+    def save(self, filename):
+        self.finish()
+        with open(filename, "wb") as output:
+            output.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION,
+                self.num_hashes, self.filter_size, len(self), self.size))
+            output.write(self._filters)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as input:
+            header = input.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise IOError("Truncated bloom filters: %r" % filename)
+            magic, version, num_hashes, filter_size, count, size = (
+                    struct.unpack(HEADER_FORMAT, header))
+            if magic != MAGIC or version != VERSION:
+                raise IOError("Not idzip bloom filters: %r" % filename)
+            filters = cls(filter_size, num_hashes)
+            filters._filters = bytearray(input.read(filter_size * count))
+            if len(filters) != count:
+                raise IOError("Truncated bloom filters: %r" % filename)
+            filters.size = size
+        return filters
+
+    def candidates(self, needle, offsets):
+        """Returns the indices of the chunks where the needle can start.
+
+        The offsets are the uncompressed offsets of the chunks.
+        The first trigrams of the needle have to be in the filter
+        of the chunk and the other ones in the filters of the next
+        chunks. A needle shorter than a trigram can start anywhere.
+        """
+        count = len(self)
+        if len(needle) < 3:
+            return list(range(count))
+        # The last chunk with a trigram of a needle starting in each chunk.
+        ends = [bisect.bisect_right(offsets, end + len(needle) - 4) - 1
+                for end in offsets[1:] + [self.size]]
+        table = None
+        if numpy is not None:
+            table = numpy.frombuffer(bytes(self._filters), numpy.uint8)
+            table = table.reshape(count, self.filter_size)
+        admitted = None
+        in_chunk = None
+        for i in range(len(needle) - 2):
+            present = self._present(int.from_bytes(needle[i:i + 3], "big"),
+                    table)
+            if admitted is None:
+                admitted = in_chunk = present
+                continue
+            sums = [0]
+            for value in present:
+                sums.append(sums[-1] + value)
+            # The trigram is in the chunks i + 1..ends[i].
+            in_next = [sums[end + 1] > sums[i + 1]
+                    for i, end in enumerate(ends)]
+            in_chunk = [a and b for a, b in zip(in_chunk, present)]
+            admitted = [a and (b or c)
+                    for a, b, c in zip(admitted, in_chunk, in_next)]
+        return [i for i, value in enumerate(admitted) if value]
+
+    def _present(self, trigram, table=None):
+        """Returns a list with True for the chunks admitting the trigram.
+        The table is a NumPy array of the filters.
+        """
+        count = len(self)
+        positions = _positions(trigram, self.filter_size * 8, self.num_hashes)
+        if table is not None:
+            present = numpy.ones(count, bool)
+            for pos in positions:
+                present &= (table[:, pos >> 3] & (1 << (pos & 7))) != 0
+            return present.tolist()
+
+        filters = self._filters
+        size = self.filter_size
+        present = []
+        for start in range(0, count * size, size):
+            present.append(all(filters[start + (pos >> 3)] & (1 << (pos & 7))
+                for pos in positions))
+        return present
+
+
+def _positions(trigram, num_bits, num_hashes):
+    return [((trigram * multiplier) >> 24) % num_bits
+            for multiplier in _MULTIPLIERS[:num_hashes]]
+
+
+def build_filter(data, filter_size, num_hashes=NUM_HASHES):
+    """Returns the filter of the trigrams of the data.
+    """
+    num_bits = filter_size * 8
+    if numpy is not None and len(data) >= 3:
+        values = numpy.frombuffer(data, numpy.uint8).astype(numpy.uint64)
+        trigrams = numpy.unique(
+                (values[:-2] << 16) | (values[1:-1] << 8) | values[2:])
+        bits = numpy.zeros(num_bits, bool)
+        for multiplier in _MULTIPLIERS[:num_hashes]:
+            bits[((trigrams * numpy.uint64(multiplier)) >> numpy.uint64(24))
+                    % numpy.uint64(num_bits)] = True
+        return numpy.packbits(bits, bitorder="little").tobytes()
+
+    result = bytearray(filter_size)
+    trigrams = set(data[i:i + 3] for i in range(len(data) - 2))
+    for trigram in trigrams:
+        for pos in _positions(int.from_bytes(trigram, "big"), num_bits,
+                num_hashes):
+            result[pos >> 3] |= 1 << (pos & 7)
+    return bytes(result)
+
+
+def build(reader, filter_size=None, num_hashes=NUM_HASHES):
+    """Returns the filters of the chunks of an existing file.
+    """
+    if filter_size is None:
+        filter_size = filter_size_for(reader._members[0].chlen)
+    filters = ChunkFilters(filter_size, num_hashes)
+    for offset, chunk in reader.iter_chunks():
+        filters.add_chunk(chunk)
+    filters.finish()
+    return filters
+
+
+def load_for(reader):
+    """Returns the filters from the sidecar of the reader file
+    or None if there is no sidecar.
+    """
+    if not reader.name or not isinstance(reader.name, str):
+        return None
+    filename = sidecar_name(reader.name)
+    if not os.path.exists(filename):
+        return None
+    return ChunkFilters.load(filename)
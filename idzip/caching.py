@@ -1,6 +1,8 @@
 """
 sample caches to use
 """
+import threading
+from collections import OrderedDict
 from random import randint
 
 LUCKY_SIZE = 32
@@ -34,6 +36,9 @@ class OneItemCache(object):
         self.key = key
         self.value = value
 
+    def __contains__(self, key):
+        return self.key == key and self.value is not None
+
 
 class ZeroCache(object):
     """
@@ -60,6 +65,9 @@ class ZeroCache(object):
     def put(self, key, value):
         return None
 
+    def __contains__(self, key):
+        return False
+
 
 class LuckyCache(object):
     """
@@ -71,11 +79,16 @@ class LuckyCache(object):
     only useful if you intend to thrash about the file.
 
     sequential reads should use OneItemCache
+
+    size defaults to LUCKY_SIZE
     """
-    def __init__(self):
+    def __init__(self, size=None):
+        if size is None:
+            size = LUCKY_SIZE
+        self._size = size
         self._cache = {}
         self._cache_index = {}
-        for x in range(-LUCKY_SIZE, 0):  # negative because caches positive ints
+        for x in range(-size, 0):  # negative because caches positive ints
             self._cache[x] = None
             self._cache_index[x] = x
         return None
@@ -85,9 +98,226 @@ class LuckyCache(object):
 
     def put(self, key, value):
         if key not in self._cache:
-            unlucky_index = randint(-LUCKY_SIZE, -1)
+            unlucky_index = randint(-self._size, -1)
             unlucky_key = self._cache_index[unlucky_index]
             self._cache.pop(unlucky_key)
             self._cache[key] = value
             self._cache_index[unlucky_index] = key
         return None
+
+    def __contains__(self, key):
+        return self._cache.get(key) is not None
+
+
+class LRUCache(object):
+    """
+    A least recently used cache holding up to max_items values.
+
+    used by the writer to remember the compressed bytes
+    of recently seen chunks.
+    """
+    def __init__(self, max_items=LUCKY_SIZE):
+        self.max_items = max_items
+        self._cache = OrderedDict()
+
+    def get(self, key):
+        value = self._cache.get(key)
+        if value is not None:
+            self._cache.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_items:
+            self._cache.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class SharedLRUCache(object):
+    """
+    A thread-safe LRU cache bounded by the total length of the values.
+
+    shared by many readers, each using its own view().
+    good for servers decompressing the same chunks for many clients.
+
+    sizeof returns the length of a value, len() by default.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        sizeof = self.sizeof
+        if sizeof(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._size -= sizeof(old)
+            self._cache[key] = value
+            self._size += sizeof(value)
+            while self._size > self.max_bytes:
+                key, old = self._cache.popitem(last=False)
+                self._size -= sizeof(old)
+
+    @property
+    def size(self):
+        return self._size
+
+    def __contains__(self, key):
+        """Checks the key without counting a hit or a miss.
+        """
+        with self._lock:
+            return key in self._cache
+
+    def __len__(self):
+        return len(self._cache)
+
+    def view(self, namespace):
+        """Returns a cache for one reader.
+        Its keys are prefixed by the namespace.
+        """
+        return CacheView(self, namespace)
+
+
+class TwoQueueCache(object):
+    """
+    A scan-resistant cache bounded by the total length of the values.
+    It implements the 2Q policy.
+
+    A new chunk enters a FIFO queue of the recent chunks.
+    Its key is remembered for a while after leaving the queue.
+    A chunk used again in that time goes to the LRU queue of the
+    frequent chunks. A sequential sweep through the file passes only
+    through the FIFO queue and leaves the frequent chunks cached.
+
+    good for services mixing hot point lookups with full-file scans.
+
+    in_ratio is the share of max_bytes kept for the recent chunks.
+    out_ratio is the number of the remembered keys
+    relative to the number of the cached chunks.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, sizeof=len,
+            in_ratio=0.25, out_ratio=0.5):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.in_ratio = in_ratio
+        self.out_ratio = out_ratio
+        self.hits = 0
+        self.misses = 0
+        self._recent = OrderedDict()
+        self._recent_size = 0
+        self._frequent = OrderedDict()
+        self._frequent_size = 0
+        # The keys evicted from the recent chunks.
+        self._ghosts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._frequent.get(key)
+            if value is not None:
+                self._frequent.move_to_end(key)
+            else:
+                # The recent chunks stay in the FIFO order.
+                value = self._recent.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        sizeof = self.sizeof
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._frequent:
+                self._frequent_size += size - sizeof(self._frequent[key])
+                self._frequent[key] = value
+                self._frequent.move_to_end(key)
+            elif key in self._recent:
+                self._recent_size += size - sizeof(self._recent[key])
+                self._recent[key] = value
+            elif self._ghosts.pop(key, None) is not None:
+                self._frequent[key] = value
+                self._frequent_size += size
+            else:
+                self._recent[key] = value
+                self._recent_size += size
+            self._reclaim()
+
+    def _reclaim(self):
+        sizeof = self.sizeof
+        max_recent = self.in_ratio * self.max_bytes
+        while self._recent_size + self._frequent_size > self.max_bytes:
+            if self._recent and (self._recent_size > max_recent or
+                    not self._frequent):
+                key, old = self._recent.popitem(last=False)
+                self._recent_size -= sizeof(old)
+                self._ghosts[key] = True
+            else:
+                key, old = self._frequent.popitem(last=False)
+                self._frequent_size -= sizeof(old)
+        max_ghosts = max(1, int(self.out_ratio * len(self)))
+        while len(self._ghosts) > max_ghosts:
+            self._ghosts.popitem(last=False)
+
+    @property
+    def size(self):
+        return self._recent_size + self._frequent_size
+
+    def __contains__(self, key):
+        """Checks the key without counting a hit or a miss.
+        """
+        with self._lock:
+            return key in self._frequent or key in self._recent
+
+    def __len__(self):
+        return len(self._recent) + len(self._frequent)
+
+    def view(self, namespace):
+        """Returns a cache for one reader.
+        Its keys are prefixed by the namespace.
+        """
+        return CacheView(self, namespace)
+
+
+class CacheView(object):
+    """
+    A part of a shared cache used by one reader.
+    """
+    def __init__(self, cache, namespace):
+        self.cache = cache
+        self.namespace = namespace
+
+    def get(self, key):
+        return self.cache.get((self.namespace, key))
+
+    def put(self, key, value):
+        self.cache.put((self.namespace, key), value)
+
+    def __contains__(self, key):
+        return (self.namespace, key) in self.cache
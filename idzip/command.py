@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 """Usage: %prog [OPTION]... FILE...
+       %prog tune [OPTION]... FILE...
+       %prog serve [OPTION]... DIRECTORY
+       %prog grep [OPTION]... PATTERN FILE...
+       %prog index [--bloom] [--tar] FILE...
+       %prog cache-sim [OPTION]... [TRACE]...
 Compresses the given files.
 """
 
@@ -11,7 +16,8 @@ import logging
 parent_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.insert(0, parent_dir)
 import idzip
-from idzip import compressor
+from idzip import bloom, compressor, searching, tarindex, tracing, tuning
+from idzip.decompressor import IdzipReader
 
 DEFAULT_SUFFIX = ".dz"
 
@@ -25,12 +31,19 @@ def _parse_args():
             help="don't unlink the processed files")
     parser.add_option("-v", "--verbose", action="count",
             help="increase verbosity")
-    parser.set_defaults(verbose=0, suffix=DEFAULT_SUFFIX, keep=False)
+    parser.add_option("-c", "--chunk-length", type="int",
+            help="length of uncompressed chunks (default=%s)"
+            % compressor.CHUNK_LENGTH)
+    parser.set_defaults(verbose=0, suffix=DEFAULT_SUFFIX, keep=False,
+            chunk_length=compressor.CHUNK_LENGTH)
 
     options, args = parser.parse_args()
     if not options.suffix or "/" in options.suffix:
         parser.error("Incorrect suffix: %r" % options.suffix)
 
+    if not 0 < options.chunk_length <= compressor.MAX_CHUNK_LENGTH:
+        parser.error("Incorrect chunk length: %r" % options.chunk_length)
+
     if len(args) == 0:
         parser.error("An input file is required.")
 
@@ -46,7 +59,7 @@ def _compress(filename, options):
     logging.info("compressing %r to %r", filename, target)
     output = open(target, "wb")
     compressor.compress(input, inputinfo.st_size, output,
-            basename, int(inputinfo.st_mtime))
+            basename, int(inputinfo.st_mtime), options.chunk_length)
 
     _finish_output(output, options)
     input.close()
@@ -88,7 +101,327 @@ def _finish_output(output, options):
     output.close()
 
 
+def _parse_tune_args(argv):
+    parser = optparse.OptionParser("""Usage: %prog tune [OPTION]... FILE...
+Reports the compression ratio, the compression speed and the random read
+latency of a sample of each file for several chunk lengths.""")
+    parser.add_option("-c", "--chunk-lengths",
+            help="comma separated chunk lengths (default=%s)"
+            % ",".join(str(length) for length in tuning.CHUNK_LENGTHS))
+    parser.add_option("-s", "--sample-size", type="int",
+            help="bytes sampled from each file (default=%s)"
+            % tuning.SAMPLE_SIZE)
+    parser.add_option("-n", "--reads", type="int",
+            help="number of random reads (default=%s)" % tuning.NUM_READS)
+    parser.add_option("-r", "--read-size", type="int",
+            help="bytes per random read (default=%s)" % tuning.READ_SIZE)
+    parser.set_defaults(sample_size=tuning.SAMPLE_SIZE,
+            reads=tuning.NUM_READS, read_size=tuning.READ_SIZE)
+
+    options, args = parser.parse_args(argv)
+    chunk_lengths = tuning.CHUNK_LENGTHS
+    if options.chunk_lengths:
+        try:
+            chunk_lengths = [int(length)
+                    for length in options.chunk_lengths.split(",")]
+        except ValueError:
+            parser.error("Incorrect chunk lengths: %r" % options.chunk_lengths)
+    for length in chunk_lengths:
+        if not 0 < length <= compressor.MAX_CHUNK_LENGTH:
+            parser.error("Incorrect chunk length: %r" % length)
+    options.chunk_lengths = chunk_lengths
+
+    if len(args) == 0:
+        parser.error("An input file is required.")
+
+    return options, args
+
+
+def tune_main(argv):
+    options, args = _parse_tune_args(argv)
+    for filename in args:
+        with open(filename, "rb") as input:
+            sample = tuning.read_sample(input, options.sample_size)
+        print("%s: %s bytes sampled" % (filename, len(sample)))
+        print("%12s %8s %13s %15s" % (
+            "chunk_length", "ratio", "compress MB/s", "read latency ms"))
+        results = tuning.tune(sample, options.chunk_lengths,
+                options.reads, options.read_size)
+        for result in results:
+            print("%12s %8.3f %13.1f %15.3f" % (
+                result.chunk_length, result.ratio, result.compress_mbps,
+                result.read_latency * 1000))
+
+
+def _parse_memo_bench_args(argv):
+    parser = optparse.OptionParser("""Usage: %prog memo-bench [OPTION]... FILE...
+Compresses a sample of each file without and with the memo of compressed
+chunks and reports the memo hits and the speedup.""")
+    parser.add_option("-m", "--chunk-cache-size", type="int",
+            help="memoized chunks (default=%s)" % tuning.MEMO_SIZE)
+    parser.add_option("-c", "--chunk-length", type="int",
+            help="chunk length (default=%s)" % compressor.CHUNK_LENGTH)
+    parser.add_option("-s", "--sample-size", type="int",
+            help="bytes sampled from each file (default=%s)"
+            % tuning.SAMPLE_SIZE)
+    parser.set_defaults(chunk_cache_size=tuning.MEMO_SIZE,
+            chunk_length=compressor.CHUNK_LENGTH,
+            sample_size=tuning.SAMPLE_SIZE)
+
+    options, args = parser.parse_args(argv)
+    if options.chunk_cache_size <= 0:
+        parser.error("Incorrect chunk cache size: %r"
+                % options.chunk_cache_size)
+    if not 0 < options.chunk_length <= compressor.MAX_CHUNK_LENGTH:
+        parser.error("Incorrect chunk length: %r" % options.chunk_length)
+    if len(args) == 0:
+        parser.error("An input file is required.")
+
+    return options, args
+
+
+def memo_bench_main(argv):
+    options, args = _parse_memo_bench_args(argv)
+    for filename in args:
+        with open(filename, "rb") as input:
+            sample = tuning.read_sample(input, options.sample_size)
+        print("%s: %s bytes sampled" % (filename, len(sample)))
+        print("%16s %8s %13s %8s %8s" % (
+            "chunk_cache_size", "seconds", "compress MB/s", "hits", "misses"))
+        results = tuning.measure_memo(sample, options.chunk_cache_size,
+                options.chunk_length)
+        for result in results:
+            print("%16s %8.3f %13.1f %8s %8s" % (
+                result.chunk_cache_size, result.seconds,
+                result.compress_mbps, result.hits, result.misses))
+        print("speedup: %.2fx" % (
+            results[0].seconds / max(results[1].seconds, 1e-9)))
+
+
+def _parse_serve_args(argv):
+    # The server needs asyncio, so it is imported only when serving.
+    from idzip import server
+    parser = optparse.OptionParser("""Usage: %prog serve [OPTION]... DIRECTORY
+Serves the uncompressed byte ranges of the files in the directory.
+GET /FILE with a "Range: bytes=START-END" header returns the uncompressed
+bytes. GET /_metrics returns the cache and latency metrics.""")
+    parser.add_option("-H", "--host",
+            help="address to listen on (default=127.0.0.1)")
+    parser.add_option("-p", "--port", type="int",
+            help="port to listen on (default=%s)" % server.DEFAULT_PORT)
+    parser.add_option("--cache-size", type="int",
+            help="bytes of the shared chunk cache (default=%s)"
+            % server.CACHE_SIZE)
+    parser.add_option("--max-handles", type="int",
+            help="max open files (default=%s)" % server.MAX_HANDLES)
+    parser.add_option("--max-index-bytes", type="int",
+            help="bytes of the cached indexes of closed files (default=%s)"
+            % server.MAX_INDEX_BYTES)
+    parser.add_option("--workers", type="int",
+            help="decompressing threads (default=%s)" % server.WORKERS)
+    parser.set_defaults(host="127.0.0.1", port=server.DEFAULT_PORT,
+            cache_size=server.CACHE_SIZE, max_handles=server.MAX_HANDLES,
+            max_index_bytes=server.MAX_INDEX_BYTES, workers=server.WORKERS)
+
+    options, args = parser.parse_args(argv)
+    if len(args) != 1 or not os.path.isdir(args[0]):
+        parser.error("A directory is required.")
+    for name in ["cache_size", "max_handles", "max_index_bytes", "workers"]:
+        if getattr(options, name) <= 0:
+            parser.error("Incorrect %s: %r" % (name, getattr(options, name)))
+
+    return options, args
+
+
+def serve_main(argv):
+    from idzip import server
+    options, args = _parse_serve_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    logging.info("serving %r on http://%s:%s/", args[0], options.host,
+            options.port)
+    server.serve(args[0], options.host, options.port,
+            cache_size=options.cache_size, max_handles=options.max_handles,
+            max_index_bytes=options.max_index_bytes, workers=options.workers)
+
+
+def _parse_grep_args(argv):
+    parser = optparse.OptionParser("""Usage: %prog grep [OPTION]... PATTERN FILE...
+Prints the lines matching the regular expression. The chunks are searched
+by a pool of processes.""")
+    parser.add_option("-F", "--fixed-strings", action="store_true",
+            help="the pattern is a literal string")
+    parser.add_option("-o", "--only-matching", action="store_true",
+            help="print only the matches, not the whole lines")
+    parser.add_option("-b", "--byte-offset", action="store_true",
+            help="print the uncompressed offset of each line or match")
+    parser.add_option("-j", "--jobs", type="int",
+            help="number of processes (default=number of CPUs)")
+    parser.add_option("--overlap", type="int",
+            help="max length of the matches crossing chunk boundaries"
+            " with -o (default=%s)" % searching.OVERLAP)
+    parser.set_defaults(fixed_strings=False, only_matching=False,
+            byte_offset=False, overlap=searching.OVERLAP)
+
+    options, args = parser.parse_args(argv)
+    if len(args) < 2:
+        parser.error("A pattern and an input file are required.")
+    if options.jobs is not None and options.jobs <= 0:
+        parser.error("Incorrect jobs: %r" % options.jobs)
+    if options.overlap < 0:
+        parser.error("Incorrect overlap: %r" % options.overlap)
+
+    return options, args
+
+
+def grep_main(argv):
+    options, args = _parse_grep_args(argv)
+    filenames = args[1:]
+    output = getattr(sys.stdout, "buffer", sys.stdout)
+    found = False
+    for filename in filenames:
+        input = IdzipReader(filename)
+        try:
+            matches = input.search(args[0], lines=not options.only_matching,
+                    overlap=options.overlap, workers=options.jobs,
+                    fixed=options.fixed_strings)
+            for offset, data in matches:
+                found = True
+                if len(filenames) > 1:
+                    output.write(filename.encode("utf-8") + b":")
+                if options.byte_offset:
+                    output.write(b"%d:" % offset)
+                output.write(data)
+                if not data.endswith(b"\n"):
+                    output.write(b"\n")
+        finally:
+            input.close()
+    output.flush()
+    return 0 if found else 1
+
+
+def _parse_index_args(argv):
+    parser = optparse.OptionParser("""Usage: %prog index [OPTION]... FILE...
+Builds sidecar indexes of the compressed files.""")
+    parser.add_option("--bloom", action="store_true",
+            help="build per-chunk Bloom filters of trigrams to FILE%s"
+            % bloom.SUFFIX)
+    parser.add_option("--filter-size", type="int",
+            help="bytes of a chunk filter (default=chunk length / %s)"
+            % bloom.FILTER_RATIO)
+    parser.add_option("--tar", action="store_true",
+            help="build the index of the tar archive members to FILE%s"
+            % tarindex.SUFFIX)
+    parser.set_defaults(bloom=False, tar=False)
+
+    options, args = parser.parse_args(argv)
+    if not (options.bloom or options.tar):
+        parser.error("An index kind is required.")
+    if options.filter_size is not None and options.filter_size <= 0:
+        parser.error("Incorrect filter size: %r" % options.filter_size)
+    if len(args) == 0:
+        parser.error("An input file is required.")
+
+    return options, args
+
+
+def index_main(argv):
+    options, args = _parse_index_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    for filename in args:
+        input = IdzipReader(filename)
+        try:
+            if options.bloom:
+                target = bloom.sidecar_name(filename)
+                logging.info("indexing %r to %r", filename, target)
+                bloom.build(input, options.filter_size).save(target)
+            if options.tar:
+                target = tarindex.sidecar_name(filename)
+                logging.info("indexing %r to %r", filename, target)
+                tarindex.build(input).save(target)
+        finally:
+            input.close()
+
+
+def _parse_cache_sim_args(argv):
+    parser = optparse.OptionParser("""Usage: %prog cache-sim [OPTION]... [TRACE]...
+Replays the chunk access traces recorded by a tracing.TraceRecorder
+against the cache policies and reports their hit ratios and the estimated
+decompression time saved.""")
+    parser.add_option("-m", "--mixed", action="store_true",
+            help="simulate a generated workload of hot lookups and scans")
+    parser.add_option("--seed", type="int",
+            help="random seed of the generated workload")
+    parser.add_option("-c", "--capacities",
+            help="comma separated cache capacities in chunks (default=%s)"
+            % ",".join(str(capacity) for capacity in tracing.CAPACITIES))
+    parser.add_option("-p", "--policies",
+            help="comma separated cache policies (default=%s)"
+            % ",".join(sorted(tracing.POLICIES)))
+
+    options, args = parser.parse_args(argv)
+    capacities = tracing.CAPACITIES
+    if options.capacities:
+        try:
+            capacities = [int(capacity)
+                    for capacity in options.capacities.split(",")]
+        except ValueError:
+            parser.error("Incorrect capacities: %r" % options.capacities)
+    for capacity in capacities:
+        if capacity <= 0:
+            parser.error("Incorrect capacity: %r" % capacity)
+    options.capacities = capacities
+    policies = sorted(tracing.POLICIES)
+    if options.policies:
+        policies = options.policies.split(",")
+    for policy in policies:
+        if policy not in tracing.POLICIES:
+            parser.error("Unknown policy: %r" % policy)
+    options.policies = policies
+
+    if len(args) == 0 and not options.mixed:
+        parser.error("A trace file is required.")
+
+    return options, args
+
+
+def _print_simulation(accesses, options):
+    print("%8s %8s %9s %13s" % ("policy", "capacity", "hit ratio",
+        "saved seconds"))
+    for result in tracing.simulate(accesses, options.policies,
+            options.capacities):
+        print("%8s %8s %9.3f %13.3f" % (result.policy,
+            "-" if result.capacity is None else result.capacity,
+            result.hit_ratio, result.saved_seconds))
+
+
+def cache_sim_main(argv):
+    options, args = _parse_cache_sim_args(argv)
+    if options.mixed:
+        accesses = tracing.mixed_workload(seed=options.seed)
+        print("mixed workload: %s accesses" % len(accesses))
+        _print_simulation(accesses, options)
+    for filename in args:
+        accesses = list(tracing.read_trace(filename))
+        traced_hits = sum(1 for access in accesses if access.hit)
+        print("%s: %s accesses, traced hit ratio %.3f" % (filename,
+            len(accesses), traced_hits / float(max(1, len(accesses)))))
+        _print_simulation(accesses, options)
+
+
+COMMANDS = {
+    "tune": tune_main,
+    "memo-bench": memo_bench_main,
+    "serve": serve_main,
+    "grep": grep_main,
+    "index": index_main,
+    "cache-sim": cache_sim_main,
+}
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
     options, args = _parse_args()
     logging.basicConfig(level=logging.WARNING - 10*options.verbose)
 
@@ -103,5 +436,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
@@ -14,11 +14,16 @@ import sys
 import zlib
 import struct
 import time
+import hashlib
+import warnings
 
 from io import BytesIO, UnsupportedOperation
-from os import path, SEEK_END, SEEK_SET
+from os import path, SEEK_SET, SEEK_END
 
 from ._stream import IOStreamWrapperMixin, check_file_like_for_writing
+from . import bloom as idzip_bloom
+from .caching import LRUCache
+from .stats import WriterStats
 
 try:
     basestring
@@ -35,35 +40,86 @@ except AttributeError:
 # The chunk length used by dictzip.
 CHUNK_LENGTH = 58315
 
+# The longest chunk whose stored deflate block still fits
+# the 2-byte length of a compressed chunk.
+MAX_CHUNK_LENGTH = 0xffff - 5
+
 # The max number of chunks is given by the max length of the gzip extra field.
 # A new gzip member with a new header is started if hitting that limit.
 MAX_NUM_CHUNKS = (0xffff - 10) // 2
 MAX_MEMBER_SIZE = MAX_NUM_CHUNKS * CHUNK_LENGTH
 
+# Unused. The input is no longer buffered in blocks.
 WRITE_BLOCK_SIZE = MAX_MEMBER_SIZE // (2 ** 5)
 
+# The extended format (VER=2) stores 4-byte chunk lengths
+# and the 8-byte member size. Longer chunks allow bigger members.
+EXTENDED_VERSION = 2
+EXTENDED_INFO_LENGTH = 2 + 2 + 4 + 4 + 8
+MAX_NUM_CHUNKS_EXTENDED = (0xffff - 4 - EXTENDED_INFO_LENGTH) // 4
+MAX_CHUNK_LENGTH_EXTENDED = 0xffffffff
+# The default chunk length of the version 2. The default dictzip
+# chunk length would allow only members smaller than the version 1 ones.
+EXTENDED_CHUNK_LENGTH = 1024 * 1024
+
+# A FLAGS bit of the extended field. The chunks have variable lengths
+# and their 4-byte uncompressed lengths follow the compressed lengths.
+VARIABLE_CHUNKS = 1
+MAX_NUM_CHUNKS_VARIABLE = (0xffff - 4 - EXTENDED_INFO_LENGTH) // 8
+
+# The compressed data of a member is kept in memory up to this many bytes.
+# A longer member is written to a seekable output as it is compressed,
+# its header is written later over a reserved space.
+MAX_BUFFERED_MEMBER = 16 * 1024 * 1024
+
 # Slow compression is OK.
 COMPRESSION_LEVEL = zlib.Z_BEST_COMPRESSION
 
+# A chunk is stored without compression if a sample of it
+# does not compress below this ratio at the fastest level.
+INCOMPRESSIBLE_SAMPLE_SIZE = 4096
+INCOMPRESSIBLE_RATIO = 0.97
+
+# An adaptive writer raises its level only if it deflates
+# faster than the target rate by this factor.
+ADAPTIVE_HEADROOM = 1.25
+
 # Gzip header flags from RFC 1952.
 GZIP_DEFLATE_ID = b"\x1f\x8b\x08"
 FTEXT, FHCRC, FEXTRA, FNAME, FCOMMENT = 1, 2, 4, 8, 16
 FRESERVED = 0xff - (FTEXT | FHCRC | FEXTRA | FNAME | FCOMMENT)
 OS_CODE_UNIX = 3
 
-
-def compress(input, in_size, output, basename=None, mtime=None):
+# A trailer index is a run of empty gzip members at the end of the file.
+# Their "RI" subfields hold the compressed index of all members.
+# The last empty member has a fixed size and its "RL" subfield
+# locates the index.
+INDEX_MAGIC = b"IDZI"
+INDEX_VERSION = 1
+# The index version used when some member has variable chunk lengths.
+INDEX_VERSION_VARIABLE = 2
+INDEX_PIECE_LENGTH = 0xff00
+LOCATOR_MAGIC = b"IDZL"
+LOCATOR_FORMAT = "<4sHQQI"
+# The deflate stream of an empty member: an empty final block.
+EMPTY_ZSTREAM = b"\x03\x00"
+
+
+def compress(input, in_size, output, basename=None, mtime=None,
+        chunk_length=CHUNK_LENGTH):
     """Produces a valid gzip output for the given input.
     A gzip file consists of one or many members.
     Each member would be a valid gzip file.
     """
+    _check_chunk_length(chunk_length)
     if mtime is None:
         mtime = time.time()
     while True:
-        member_size = min(in_size, MAX_MEMBER_SIZE)
+        member_size = min(in_size, max_member_size(chunk_length))
         if basename is not None:
             basename = basename.encode(fsencoding)
-        _compress_member(input, member_size, output, basename, mtime)
+        _compress_member(input, member_size, output, basename, mtime,
+                chunk_length)
         # Only the first member will carry the basename and mtime.
         basename = None
         mtime = 0
@@ -73,19 +129,44 @@ def compress(input, in_size, output, basename=None, mtime=None):
             return
 
 
-def compress_member(input, in_size, output, basename, mtime):
+def compress_member(input, in_size, output, basename, mtime,
+        chunk_length=CHUNK_LENGTH):
     """ Make the 'private' function public for the writer class
     """
-    return _compress_member(input, in_size, output, basename, mtime)
+    _check_chunk_length(chunk_length)
+    return _compress_member(input, in_size, output, basename, mtime,
+            chunk_length)
+
+
+def max_member_size(chunk_length=CHUNK_LENGTH, version=1):
+    """Returns the max input size of a member with the given chunk length.
+    """
+    if version == EXTENDED_VERSION:
+        return MAX_NUM_CHUNKS_EXTENDED * chunk_length
+    return MAX_MEMBER_SIZE * chunk_length // CHUNK_LENGTH
+
 
+def _check_chunk_length(chunk_length, version=1):
+    if version == EXTENDED_VERSION:
+        max_length = MAX_CHUNK_LENGTH_EXTENDED
+    elif version == 1:
+        max_length = MAX_CHUNK_LENGTH
+    else:
+        raise ValueError("Unsupported dictzip version: %r" % version)
+    if not 0 < chunk_length <= max_length:
+        raise ValueError("The chunk length must be from 1 to %s, not %r"
+                % (max_length, chunk_length))
 
-def _compress_member(input, in_size, output, basename, mtime):
+
+def _compress_member(input, in_size, output, basename, mtime,
+        chunk_length=CHUNK_LENGTH):
     """A gzip member contains:
     1) The header.
     2) The compressed data.
     """
-    zlengths_pos = _prepare_header(output, in_size, basename, mtime)
-    zlengths = _compress_data(input, in_size, output)
+    zlengths_pos = _prepare_header(output, in_size, basename, mtime,
+            chunk_length)
+    zlengths = _compress_data(input, in_size, output, chunk_length)
 
     # Writes the lengths of compressed chunks to the header.
     end_pos = output.tell()
@@ -96,7 +177,7 @@ def _compress_member(input, in_size, output, basename, mtime):
     output.seek(end_pos)
 
 
-def _compress_data(input, in_size, output):
+def _compress_data(input, in_size, output, chunk_length=CHUNK_LENGTH):
     """Compresses the given number of input bytes to the output.
     The output consists of:
     1) The compressed data.
@@ -111,7 +192,7 @@ def _compress_data(input, in_size, output):
 
     need = in_size
     while need > 0:
-        read_size = min(need, CHUNK_LENGTH)
+        read_size = min(need, chunk_length)
         chunk = input.read(read_size)
         if len(chunk) != read_size:
             raise IOError("Need %s bytes, got %s" % (read_size, len(chunk)))
@@ -130,16 +211,16 @@ def _compress_data(input, in_size, output):
 
 def _compress_chunk(compobj, chunk, output):
     data = compobj.compress(chunk)
-    zlen = len(data)
+    data += compobj.flush(zlib.Z_FULL_FLUSH)
+    if len(data) > 0xffff:
+        # The stored blocks of a chunk up to MAX_CHUNK_LENGTH always fit.
+        data = _stored_blocks(chunk)
     output.write(data)
+    return len(data)
 
-    data = compobj.flush(zlib.Z_FULL_FLUSH)
-    zlen += len(data)
-    output.write(data)
-    return zlen
 
-
-def _prepare_header(output, in_size, basename, mtime):
+def _prepare_header(output, in_size, basename, mtime,
+        chunk_length=CHUNK_LENGTH):
     """Writes a prepared gzip header to the output.
     The gzip header is defined in RFC 1952.
 
@@ -176,14 +257,14 @@ def _prepare_header(output, in_size, basename, mtime):
     output.write(deflate_flags)
     output.write(bytearray([OS_CODE_UNIX]))
 
-    zlengths_pos = _write_extra_field(output, in_size)
+    zlengths_pos = _write_extra_field(output, in_size, chunk_length)
     if basename:
         output.write(basename + b'\0')  # original basename
 
     return zlengths_pos
 
 
-def _write_extra_field(output, in_size):
+def _write_extra_field(output, in_size, chunk_length=CHUNK_LENGTH):
     """Writes the dictzip extra field.
     It will be initiated with zeros on the place of
     the lengths of compressed chunks.
@@ -217,8 +298,8 @@ def _write_extra_field(output, in_size):
     Idzip does not have that limitation. It starts a new gzip member if needed.
     The new member would be also a valid dictzip file.
     """
-    num_chunks = in_size // CHUNK_LENGTH
-    if in_size % CHUNK_LENGTH != 0:
+    num_chunks = in_size // chunk_length
+    if in_size % chunk_length != 0:
         num_chunks += 1
 
     field_length = 3 * 2 + 2 * num_chunks
@@ -230,7 +311,7 @@ def _write_extra_field(output, in_size):
     output.write(b"RA")
     _write16(output, field_length)
     _write16(output, 1)  # version
-    _write16(output, CHUNK_LENGTH)
+    _write16(output, chunk_length)
     _write16(output, num_chunks)
     zlengths_pos = output.tell()
     output.write(b"\0\0" * num_chunks)
@@ -249,11 +330,132 @@ def _write32(output, value):
     output.write(struct.pack("<I", value & 0xffffffff))
 
 
+def _empty_member(subfields):
+    """Returns a gzip member with no data
+    and with the given (sub_id, data) extra subfields.
+    An empty dictzip field is included, so readers see a valid
+    dictzip member with no chunks.
+    """
+    extra = [b"RA", struct.pack("<HHHH", 6, 1, CHUNK_LENGTH, 0)]
+    for sub_id, data in subfields:
+        extra.append(sub_id + struct.pack("<H", len(data)) + data)
+    extra = b"".join(extra)
+    assert len(extra) <= 0xffff
+    header = GZIP_DEFLATE_ID + struct.pack("<BIBBH", FEXTRA, 0, 0,
+            OS_CODE_UNIX, len(extra))
+    return header + extra + EMPTY_ZSTREAM + struct.pack("<II", 0, 0)
+
+
+LOCATOR_SIZE = len(_empty_member(
+    [(b"RL", b"\0" * struct.calcsize(LOCATOR_FORMAT))]))
+
+
+def _looks_incompressible(chunk):
+    """Compresses a sample from the middle of the chunk
+    with the fastest level.
+    """
+    if len(chunk) < 2 * INCOMPRESSIBLE_SAMPLE_SIZE:
+        return False
+    start = (len(chunk) - INCOMPRESSIBLE_SAMPLE_SIZE) // 2
+    sample = chunk[start:start + INCOMPRESSIBLE_SAMPLE_SIZE]
+    compobj = zlib.compressobj(zlib.Z_BEST_SPEED, zlib.DEFLATED,
+            -zlib.MAX_WBITS)
+    zlen = len(compobj.compress(sample)) + len(compobj.flush())
+    return zlen >= len(sample) * INCOMPRESSIBLE_RATIO
+
+
+def _stored_length(size):
+    """Returns the length of the data stored in deflate stored blocks.
+    """
+    num_blocks = max(1, (size + 0xffff - 1) // 0xffff)
+    return size + 5 * num_blocks
+
+
+def _stored_blocks(chunk):
+    """Returns the chunk as non-final deflate stored blocks.
+    A chunk always starts and ends on a byte boundary,
+    so no bits have to be flushed before the blocks.
+
+    Each stored block consists of:
+    +---+---+---+---+---+==========================+
+    |HDR|  LEN  | NLEN  | LEN bytes of data ...    |
+    +---+---+---+---+---+==========================+
+    where HDR holds the BFINAL=0 and BTYPE=00 bits.
+    """
+    blocks = []
+    chunk = memoryview(chunk)
+    start = 0
+    while True:
+        block = chunk[start:start + 0xffff]
+        blocks.append(struct.pack("<BHH", 0, len(block),
+                len(block) ^ 0xffff))
+        blocks.append(block.tobytes())
+        start += len(block)
+        if start >= len(chunk):
+            return b"".join(blocks)
+
+
 class IdzipWriter(IOStreamWrapperMixin):
     FILE_EXTENSION = 'dz'
     enforce_extension = True
 
-    def __init__(self, output, sync_size=MAX_MEMBER_SIZE, mtime=None):
+    def __init__(self, output, sync_size=None, mtime=None,
+            chunk_cache_size=0, compression_level=None, target_mbps=None,
+            min_level=1, max_level=zlib.Z_BEST_COMPRESSION,
+            store_incompressible=True, chunk_length=None,
+            version=1, trailer_index=False, record_delimiter=None,
+            record_size=None, bloom=False, stats=False):
+        """Creates a writer to the given filename or file-like output.
+
+        The compression level is fixed, unless target_mbps is given.
+        Then the level of each member is moved between min_level
+        and max_level to deflate at least target_mbps MB/s.
+
+        With store_incompressible, chunks which do not compress
+        are written as stored deflate blocks.
+
+        Short chunks are faster to read at random positions,
+        long chunks compress better.
+
+        A member is sealed after sync_size bytes. By default,
+        the members are as big as the chunk length and the version allow.
+
+        The version 2 of the RA field allows longer chunks
+        and bigger members. It needs a reader supporting it.
+        Its default chunk length is EXTENDED_CHUNK_LENGTH,
+        giving members of about 16 GiB, but slower random reads.
+
+        With trailer_index, close() appends an index of all members,
+        so a reader can find them without walking the member headers.
+        The output has to support tell() then.
+
+        Chunks can end on record boundaries, so a record shorter than
+        a chunk is read from one chunk. With record_delimiter, a chunk
+        ends after the last delimiter fitting in chunk_length.
+        Such chunks have variable lengths, stored by the version 2.
+        With record_size, the chunk length is rounded down
+        to a multiple of the record size.
+
+        With bloom, close() writes per-chunk Bloom filters
+        of trigrams to a sidecar, see idzip.bloom. The bloom can be
+        the sidecar filename. True means the output name + ".bloom".
+
+        With stats, the counters returned by stats() are collected.
+        """
+        if chunk_length is None:
+            chunk_length = CHUNK_LENGTH
+            if version == EXTENDED_VERSION and record_delimiter is None:
+                chunk_length = EXTENDED_CHUNK_LENGTH
+        if record_delimiter is not None:
+            if not record_delimiter:
+                raise ValueError("The record delimiter must not be empty")
+            version = EXTENDED_VERSION
+        if record_size is not None:
+            if not 0 < record_size <= chunk_length:
+                raise ValueError("The record size must be from 1 to %s, not %r"
+                        % (chunk_length, record_size))
+            chunk_length -= chunk_length % record_size
+        _check_chunk_length(chunk_length, version)
         if mtime is None:
             mtime = time.time()
         if isinstance(output, basestring):
@@ -267,7 +469,6 @@ class IdzipWriter(IOStreamWrapperMixin):
                     "write, tell, flush, and close!")
             self.output = output
             self._should_close = False
-        self.input_buffer = BytesIO()
         try:
             name = path.abspath(self.output.name)
             basename = path.basename(name)
@@ -278,10 +479,66 @@ class IdzipWriter(IOStreamWrapperMixin):
             self.basename = self.name.encode(fsencoding)
         self.uncompressed_position = 0
         self.sync_size = sync_size
+        self.chunk_length = chunk_length
+        self.record_delimiter = record_delimiter
         self.mtime = int(mtime)
+        if compression_level is None:
+            compression_level = COMPRESSION_LEVEL
+        if target_mbps is not None:
+            if not 0 <= min_level <= max_level <= zlib.Z_BEST_COMPRESSION:
+                raise ValueError("Invalid level range: %r, %r" % (
+                    min_level, max_level))
+            compression_level = max(min_level,
+                    min(compression_level, max_level))
+        self.compression_level = compression_level
+        self.target_mbps = target_mbps
+        self.min_level = min_level
+        self.max_level = max_level
+        # The deflate speed measured on the last member.
+        self.deflate_mbps = None
+        self._deflate_time = 0.0
+        self._deflate_bytes = 0
         self.compressobj = None
         self._reset_compressor()
-        self.version = 1
+        self.version = version
+        self.trailer_index = trailer_index
+        # (header_pos, data_pos, chlen, isize, packed zlengths,
+        # packed uncompressed lengths or None) per member.
+        self._index_members = []
+        self._members_written = 0
+        # Compressed bytes of recently seen chunks, by content hash.
+        # A chunk ends with a full flush, so its compressed bytes
+        # depend only on its content.
+        self._chunk_cache = None
+        if chunk_cache_size > 0:
+            self._chunk_cache = LRUCache(chunk_cache_size)
+        self.chunk_cache_hits = 0
+        self.chunk_cache_misses = 0
+        self.store_incompressible = store_incompressible
+        self.stored_chunks = 0
+        self._stats = WriterStats() if stats else None
+        self._bloom = None
+        if bloom:
+            if bloom is True:
+                if not self.name:
+                    raise ValueError("A bloom sidecar needs a named output")
+                bloom = idzip_bloom.sidecar_name(self.name)
+            self._bloom_filename = bloom
+            self._bloom = idzip_bloom.ChunkFilters(
+                    idzip_bloom.filter_size_for(chunk_length))
+        self._reset_member()
+
+    def stats(self):
+        """Returns a dict of the counters or None if not enabled.
+        The compressed bytes are the deflate data of the members.
+        """
+        if self._stats is None:
+            return None
+        snapshot = self._stats.snapshot()
+        snapshot["stored_chunks"] = self.stored_chunks
+        snapshot["chunk_cache_hits"] = self.chunk_cache_hits
+        snapshot["chunk_cache_misses"] = self.chunk_cache_misses
+        return snapshot
 
     def _prepare_file_stream(self, path):
         if self.enforce_extension and not path.endswith(self.FILE_EXTENSION):
@@ -294,112 +551,150 @@ class IdzipWriter(IOStreamWrapperMixin):
 
     def _make_compressor(self):
         return zlib.compressobj(
-            COMPRESSION_LEVEL, zlib.DEFLATED,
+            self.compression_level, zlib.DEFLATED,
             -zlib.MAX_WBITS)
 
     def _reset_compressor(self):
         self.compressobj = self._make_compressor()
 
+    def _reset_member(self):
+        """Forgets the state of the current member.
+
+        Only the compressed chunks and the trailing partial chunk
+        of the current member are kept in memory. The input is
+        compressed as soon as a complete chunk is available.
+        At most MAX_BUFFERED_MEMBER bytes of the compressed chunks
+        are kept if the output is seekable.
+        """
+        self._member_size = 0
+        self._member_crc = zlib.crc32(b"")
+        self._member_zlengths = []
+        self._member_lengths = []
+        self._member_data = []
+        self._member_zsize = 0
+        # The position of the reserved header of a streamed member.
+        self._member_header_pos = None
+        self._member_reserved = 0
+        self._pending = bytearray()
+
+    def _member_limit(self):
+        if self.record_delimiter is not None:
+            max_size = MAX_NUM_CHUNKS_VARIABLE * self.chunk_length
+        else:
+            max_size = max_member_size(self.chunk_length, self.version)
+        if self.sync_size is None:
+            return max_size
+        return max(1, min(self.sync_size, max_size))
+
     def seek(self, offset, whence=SEEK_SET):
         raise UnsupportedOperation("Cannot seek on a write-only stream")
 
     def reset_buffer(self):
-        # For truncate() to actually help us circumvent memory problems,
-        # we need to seek to the beginning of the buffer, otherwise the
-        # next call to write() will just pad the buffer with null bytes
-        # up to the current position returned by tell()
-        self.input_buffer.seek(0)
-        self.input_buffer.truncate(0)
-
-    def _get_buffer_size(self):
-        curpos = self.input_buffer.tell()
-        self.input_buffer.seek(0, SEEK_END)
-        buffer_len = self.input_buffer.tell()
-        self.input_buffer.seek(curpos)
-        return buffer_len
-
-    def _write_chunked(self, b, chunk_size=WRITE_BLOCK_SIZE):
-        offset = 0
-        total = len(b)
-        i = 0
-        while offset < total:
-            s = b[offset:offset + chunk_size]
-            self.input_buffer.write(s)
-            self.uncompressed_position += len(s)
-            i += 1
-            offset += chunk_size
-            if i % 2 == 0:
-                self.sync()
-                self.reset_buffer()
-        return total
+        """Deprecated, does nothing.
+        The input is compressed as soon as a complete chunk is available.
+        """
+        warnings.warn("IdzipWriter.reset_buffer() does nothing",
+                DeprecationWarning, stacklevel=2)
+
+    @property
+    def input_buffer(self):
+        """Deprecated. Returns a copy of the input
+        not yet compressed, positioned at its end.
+        """
+        warnings.warn("IdzipWriter.input_buffer is a copy of the pending input",
+                DeprecationWarning, stacklevel=2)
+        buffer = BytesIO(bytes(self._pending))
+        buffer.seek(0, SEEK_END)
+        return buffer
 
     def write(self, b):
-        try:
-            self.input_buffer.write(b)
-        except MemoryError:
-            # Attempting to write to the input buffer may cause
-            # it to optimistically request a contiguous allocation
-            # larger than the memory allocator can currently supply,
-            # raising a MemoryError. This can be recovered from by
-            # syncing the current buffer to disk, resetting the
-            # input buffer, and trying to write again
-            self.sync()
-            self.reset_buffer()
-            try:
-                self.input_buffer.write(b)
-            except MemoryError:
-                # If the data to be written are so large that
-                # they cannot be written to the input buffer in
-                # one shot, try writing it in chunks. If *this*
-                # runs out of memory, we're out of options.
-                return self._write_chunked(b)
-        self.uncompressed_position += len(b)
-        buffer_len = self._get_buffer_size()
-        if buffer_len >= self.sync_size:
-            if self._check_member_size_valid(buffer_len):
-                self.sync()
-                self.reset_buffer()
+        if not isinstance(b, (bytes, bytearray)):
+            b = memoryview(b).cast("B")
+        written = len(b)
+        self.uncompressed_position += written
+        limit = self._member_limit()
+        if (len(self._pending) + written < self.chunk_length and
+                self._member_size + written < limit):
+            # The common case of a small write.
+            self._pending += b
+            self._member_size += written
+            return written
+
+        data = memoryview(b)
+        while data:
+            room = limit - self._member_size
+            used = self._feed(data[:room])
+            data = data[used:]
+            if self._member_size >= limit or self._has_max_chunks():
+                self.compress_member()
+        return written
+
+    def _feed(self, data):
+        """Adds the data to the current member.
+        Complete chunks are compressed without copying them.
+        Returns the number of used bytes.
+        """
+        if self.record_delimiter is not None:
+            return self._feed_records(data)
+        used = len(data)
+        self._member_size += used
+        if self._pending:
+            need = self.chunk_length - len(self._pending)
+            self._pending += data[:need]
+            data = data[need:]
+            if len(self._pending) < self.chunk_length:
+                return used
+            self._compress_chunk(self._pending)
+            self._pending = bytearray()
+
+        chunk_length = self.chunk_length
+        end = len(data) - len(data) % chunk_length
+        for start in range(0, end, chunk_length):
+            self._compress_chunk(data[start:start + chunk_length])
+        self._pending += data[end:]
+        return used
+
+    def _feed_records(self, data):
+        """Adds the data to the current member.
+        Each chunk ends after the last record delimiter
+        fitting in the chunk length, if there is any.
+        Stops using the data when the member has the max number of chunks.
+        """
+        delimiter = self.record_delimiter
+        chunk_length = self.chunk_length
+        pending = self._pending
+        used = 0
+        while not self._has_max_chunks():
+            need = chunk_length - len(pending)
+            if used + need > len(data):
+                pending += data[used:]
+                used = len(data)
+                break
+            pending += data[used:used + need]
+            used += need
+            end = pending.rfind(delimiter)
+            if end == -1:
+                # A record longer than a chunk.
+                end = chunk_length
             else:
-                self._sync_chunked()
-        return len(b)
+                end += len(delimiter)
+            self._compress_chunk(pending[:end])
+            del pending[:end]
+        self._member_size += used
+        return used
+
+    def _has_max_chunks(self):
+        """Returns True if the current member has no room for more chunks
+        than the pending one.
+        """
+        return (self.record_delimiter is not None and
+                len(self._member_zlengths) >= MAX_NUM_CHUNKS_VARIABLE - 1)
 
     def sync(self):
-        self.compress_member()
-        self.reset_buffer()
-        return self.output.tell()
-
-    def _sync_chunked(self, flush=False):
-        # accumulate chunks of the input buffer which are at most
-        # `MAX_MEMBER_SIZE` bytes long
-        valid_members = []
-        self.input_buffer.seek(0)
-        chunk = self.input_buffer.read(MAX_MEMBER_SIZE - 1)
-        while chunk:
-            valid_members.append(BytesIO(chunk))
-            chunk = self.input_buffer.read(MAX_MEMBER_SIZE - 1)
-        # if the input buffer was empty, then no valid members were
-        # made so return immediately
-        if not valid_members:
-            return
-        # if there is only one member, chunked syncing should be the same
-        # as normal syncing, leaving the input buffer empty
-        elif len(valid_members) == 1:
-            self.input_buffer = valid_members[0]
+        # An empty member is only needed to make a valid empty file.
+        if self._member_size or not self._members_written:
             self.compress_member()
-            self.reset_buffer()
-        else:
-            # otherwise, for all but the last valid member, sync those buffers
-            # to the output stream, and then set the last valid member as the current
-            # input buffer to avoid having a tiny leftover fragment.
-            for chunk in valid_members[:-1]:
-                self.input_buffer = chunk
-                self.compress_member()
-                self.reset_buffer()
-            self.input_buffer = valid_members[-1]
-            self.input_buffer.seek(0, SEEK_END)
-            if flush:
-                self.compress_member()
-                self.reset_buffer()
+        return self.output.tell()
 
     def tell(self):
         return self.uncompressed_position
@@ -411,54 +706,203 @@ class IdzipWriter(IOStreamWrapperMixin):
     def close(self):
         if not self.closed:
             self.sync()
-            self.reset_buffer()
+            if self.trailer_index and self._index_members is not None:
+                self._write_trailer_index()
+                self._index_members = None
+            if self._bloom is not None:
+                self._bloom.save(self._bloom_filename)
+                self._bloom = None
             if self._should_close:
                 closing = self.output.close()
                 return closing
         return None
 
-    def _calculate_number_of_chunks_for_bytes(self, in_size):
-        num_chunks = in_size // CHUNK_LENGTH
-        if in_size % CHUNK_LENGTH != 0:
-            num_chunks += 1
-        return num_chunks
-
-    def _calculate_extra_field_length(self, in_size):
-        num_chunks = self._calculate_number_of_chunks_for_bytes(in_size)
-        field_length = 3 * 2 + 2 * num_chunks
-        return field_length
-
-    def _calculate_header_extra_size(self, in_size):
-        field_length = self._calculate_extra_field_length(in_size)
-        extra_length = 2 * 2 + field_length
-        return extra_length
-
-    def _check_member_size_valid(self, in_size):
-        extra_length = self._calculate_header_extra_size(in_size)
-        return extra_length <= 0xffff
-
     def compress_member(self):
         """A gzip member contains:
         1) The header.
         2) The compressed data.
+
+        The header of a short member is written when the whole member
+        is known, so the output does not need to be seekable.
+        A long member is streamed and its header is written
+        over the reserved space, see _stream_member().
         """
-        self.input_buffer.seek(0, SEEK_END)
-        member_size = self.input_buffer.tell()
-        self.input_buffer.seek(0)
+        if self._pending:
+            self._compress_chunk(self._pending)
+            self._pending = bytearray()
 
-        zlengths_pos = self._prepare_header(member_size)
-        zlengths = self._compress_data(member_size)
+        # An empty block with BFINAL=1 flag ends the zlib data stream.
+        self._add_member_data(self.compressobj.flush(zlib.Z_FINISH))
+
+        member_size = self._member_size
+        assert member_size <= 0xffffffff or self.version == EXTENDED_VERSION
+        zlengths = self._member_zlengths
+        header_pos = self._member_header_pos
+        if header_pos is None:
+            header_pos = self.output.tell()
+            self._prepare_header(zlengths)
+            data_pos = self.output.tell()
+            for data in self._member_data:
+                self.output.write(data)
+        else:
+            end = self.output.tell()
+            data_pos = header_pos + self._member_reserved
+            self.output.seek(header_pos)
+            self._prepare_header(zlengths,
+                    data_pos - header_pos - self._header_length(len(zlengths)))
+            assert self.output.tell() == data_pos
+            self.output.seek(end)
+        if self.trailer_index:
+            lengths = None
+            if self.record_delimiter is not None:
+                lengths = struct.pack("<%dI" % len(zlengths),
+                        *self._member_lengths)
+            self._index_members.append((header_pos, data_pos,
+                self.chunk_length, member_size,
+                struct.pack("<%dI" % len(zlengths), *zlengths), lengths))
+        _write32(self.output, self._member_crc)
+        # Gzip stores the size modulo 2^32.
+        _write32(self.output, member_size)
+
+        self._members_written += 1
+        if self._stats is not None:
+            self._stats.add_member(member_size, self._member_zsize,
+                    self._deflate_time)
+        self._reset_member()
+        self._adapt_level()
+        self._reset_compressor()
 
-        # Writes the lengths of compressed chunks to the header.
-        end_pos = self.output.tell()
-        self.output.seek(zlengths_pos)
-        for zlen in zlengths:
-            _write16(self.output, zlen)
+    def _add_member_data(self, data):
+        self._member_zsize += len(data)
+        if self._member_header_pos is not None:
+            self.output.write(data)
+            return
+        self._member_data.append(data)
+        if (self._member_zsize > MAX_BUFFERED_MEMBER and
+                self._can_seek_back()):
+            self._stream_member()
+
+    def _can_seek_back(self):
+        if "a" in getattr(self.output, "mode", ""):
+            # Writes to a file in the append mode ignore the seeks.
+            return False
+        try:
+            return self.output.seekable()
+        except AttributeError:
+            return False
+
+    def _stream_member(self):
+        """Writes the buffered data of the current member
+        after a space reserved for its header.
+        The reserved space is zeroed, so a reader following the file
+        sees an incomplete member. The header written later
+        fills the unused space by a gzip comment.
+        """
+        if self.record_delimiter is not None:
+            max_chunks = MAX_NUM_CHUNKS_VARIABLE
+        else:
+            max_chunks = -(-self._member_limit() // self.chunk_length)
+        # At least the zero ending the comment is needed.
+        self._member_reserved = self._header_length(max_chunks) + 1
+        self._member_header_pos = self.output.tell()
+        self.output.write(bytes(self._member_reserved))
+        for data in self._member_data:
+            self.output.write(data)
+        self._member_data = []
+
+    def _header_length(self, num_chunks):
+        """Returns the length of a header without a comment.
+        """
+        if self.version == EXTENDED_VERSION:
+            field_length = EXTENDED_INFO_LENGTH + 4 * num_chunks
+            if self.record_delimiter is not None:
+                field_length += 4 * num_chunks
+        else:
+            field_length = 3 * 2 + 2 * num_chunks
+        length = 10 + 2 + 2 * 2 + field_length
+        if self.basename:
+            length += len(self.basename) + 1
+        return length
 
-        self.output.seek(end_pos)
+    def _write_trailer_index(self):
+        """Appends the index of the written members.
 
-    def _prepare_header(self, in_size):
-        """Writes a prepared gzip header to the output.
+        The index starts with:
+        +---+---+---+---+---+---+---+---+---+---+
+        |     MAGIC     |  VER  |    MEMCNT     |
+        +---+---+---+---+---+---+---+---+---+---+
+        and each member adds:
+        +---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+        |      DATA_BACK (8 bytes)      |     CHLEN     |     CHCNT     |
+        +---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+        +---+---+---+---+---+---+---+---+===============================+
+        |          ISIZE (8 bytes)      | CHCNT 4-byte lengths of ...   |
+        +---+---+---+---+---+---+---+---+===============================+
+        where DATA_BACK is the distance from the compressed data
+        of the member to the start of the index.
+
+        The version 2 of the index adds 2-byte FLAGS after the ISIZE
+        of each member. With the VARIABLE_CHUNKS flag, CHCNT 4-byte
+        uncompressed chunk lengths follow the compressed lengths.
+        The version 2 is only used if some member has variable chunks.
+
+        The zlib compressed index is split to the "RI" subfields
+        of empty members. The final locator member has "RL" subfield:
+        +---+---+---+---+---+---+================+================+---+---+---+---+
+        |     MAGIC     |  VER  | INDEX_LEN (8)  | COVERED (8)    |   INDEX_CRC   |
+        +---+---+---+---+---+---+================+================+---+---+---+---+
+        where INDEX_LEN is the length of the index members
+        and COVERED is the distance from the first member to the index.
+        """
+        index_start = self.output.tell()
+        members = self._index_members
+        version = INDEX_VERSION
+        if any(member[5] is not None for member in members):
+            version = INDEX_VERSION_VARIABLE
+        index = [struct.pack("<4sHI", INDEX_MAGIC, version, len(members))]
+        for header_pos, data_pos, chlen, isize, zlengths, lengths in members:
+            index.append(struct.pack("<QIIQ", index_start - data_pos,
+                chlen, len(zlengths) // 4, isize))
+            if version == INDEX_VERSION_VARIABLE:
+                flags = 0 if lengths is None else VARIABLE_CHUNKS
+                index.append(struct.pack("<H", flags))
+            index.append(zlengths)
+            if lengths is not None:
+                index.append(lengths)
+        index = zlib.compress(b"".join(index), zlib.Z_BEST_COMPRESSION)
+
+        for start in range(0, len(index), INDEX_PIECE_LENGTH):
+            piece = index[start:start + INDEX_PIECE_LENGTH]
+            self.output.write(_empty_member([(b"RI", piece)]))
+        locator = struct.pack(LOCATOR_FORMAT, LOCATOR_MAGIC, version,
+                self.output.tell() - index_start,
+                index_start - members[0][0], zlib.crc32(index))
+        self.output.write(_empty_member([(b"RL", locator)]))
+
+    def _adapt_level(self):
+        """Measures the deflate speed of the finished member
+        and chooses the compression level of the next member.
+        """
+        if self._deflate_time <= 0:
+            return
+        self.deflate_mbps = self._deflate_bytes / self._deflate_time / 1e6
+        self._deflate_time = 0.0
+        self._deflate_bytes = 0
+        if self.target_mbps is None:
+            return
+
+        if self.deflate_mbps < self.target_mbps:
+            level = self.compression_level - 1
+        elif self.deflate_mbps > self.target_mbps * ADAPTIVE_HEADROOM:
+            level = self.compression_level + 1
+        else:
+            return
+        self.compression_level = max(self.min_level,
+                min(level, self.max_level))
+
+    def _prepare_header(self, zlengths, padding=0):
+        """Writes a gzip header to the output.
+        A non-zero padding adds a comment of that length.
         The gzip header is defined in RFC 1952.
 
         The gzip header starts with:
@@ -476,11 +920,14 @@ class IdzipWriter(IOStreamWrapperMixin):
            Its format is described in _write_extra_field().
         2) The original file name, if the FNAME flag is set.
            The file name string is zero-terminated.
+        3) The zero-terminated comment, if the FCOMMENT flag is set.
         """
         self.output.write(GZIP_DEFLATE_ID)
         flags = FEXTRA
         if self.basename:
             flags |= FNAME
+        if padding:
+            flags |= FCOMMENT
         self.output.write(bytearray([flags]))
 
         # The mtime will be undefined if it does not fit.
@@ -491,21 +938,25 @@ class IdzipWriter(IOStreamWrapperMixin):
         _write32(self.output, mtime)
 
         deflate_flags = b"\0"
-        if COMPRESSION_LEVEL == zlib.Z_BEST_COMPRESSION:
+        if self.compression_level == zlib.Z_BEST_COMPRESSION:
             deflate_flags = b"\x02"  # slowest compression algorithm
+        elif self.compression_level == zlib.Z_BEST_SPEED:
+            deflate_flags = b"\x04"  # fastest compression algorithm
         self.output.write(deflate_flags)
         self.output.write(bytearray([OS_CODE_UNIX]))
 
-        zlengths_pos = self._write_extra_field(in_size)
+        if self.version == EXTENDED_VERSION:
+            self._write_extended_field(zlengths)
+        else:
+            self._write_extra_field(zlengths)
         if self.basename:
             self.output.write(self.basename + b'\0')  # original basename
+        if padding:
+            self.output.write(b" " * (padding - 1) + b"\0")
 
-        return zlengths_pos
-
-    def _write_extra_field(self, in_size):
-        """Writes the dictzip extra field.
-        It will be initiated with zeros on the place of
-        the lengths of compressed chunks.
+    def _write_extra_field(self, zlengths):
+        """Writes the dictzip extra field
+        with the lengths of the compressed chunks.
 
         The gzip extra field is present when the FEXTRA flag is set.
         RFC 1952 defines the used bytes:
@@ -536,14 +987,9 @@ class IdzipWriter(IOStreamWrapperMixin):
         Idzip does not have that limitation. It starts a new gzip member if needed.
         The new member would be also a valid dictzip file.
         """
-        # num_chunks = in_size // CHUNK_LENGTH
-        # if in_size % CHUNK_LENGTH != 0:
-        #     num_chunks += 1
-        num_chunks = self._calculate_number_of_chunks_for_bytes(in_size)
-        # field_length = 3 * 2 + 2 * num_chunks
-        field_length = self._calculate_extra_field_length(in_size)
-        # extra_length = 2 * 2 + field_length
-        extra_length = self._calculate_header_extra_size(in_size)
+        num_chunks = len(zlengths)
+        field_length = 3 * 2 + 2 * num_chunks
+        extra_length = 2 * 2 + field_length
         assert extra_length <= 0xffff
         _write16(self.output, extra_length)  # XLEN
 
@@ -551,48 +997,87 @@ class IdzipWriter(IOStreamWrapperMixin):
         self.output.write(b"RA")
         _write16(self.output, field_length)
         _write16(self.output, self.version)  # version
-        _write16(self.output, CHUNK_LENGTH)
+        _write16(self.output, self.chunk_length)
         _write16(self.output, num_chunks)
-        zlengths_pos = self.output.tell()
-        self.output.write(b"\0\0" * num_chunks)
-        return zlengths_pos
-
-    def _compress_data(self, in_size):
-        """Compresses the given number of input bytes to the output.
-        The output consists of:
-        1) The compressed data.
-        2) 4 bytes of CRC.
-        3) 4 bytes of file size.
+        self.output.write(struct.pack("<%dH" % num_chunks, *zlengths))
+
+    def _write_extended_field(self, zlengths):
+        """Writes the extended version of the dictzip extra field.
+        It uses the same "RA" subfield with VER=2:
+        +---+---+---+---+---+---+---+---+---+---+---+---+
+        | VER=2 | FLAGS |     CHLEN     |     CHCNT     |
+        +---+---+---+---+---+---+---+---+---+---+---+---+
+        +---+---+---+---+---+---+---+---+===============================+
+        |             ISIZE             | CHCNT 4-byte lengths of ...   |
+        +---+---+---+---+---+---+---+---+===============================+
+        where:
+        FLAGS ... VARIABLE_CHUNKS or zero.
+        CHLEN ... 4-byte length of uncompressed chunks.
+        CHCNT ... 4-byte number of chunks.
+        ISIZE ... 8-byte size of the uncompressed member.
+                  The gzip trailer has only the size modulo 2^32.
+
+        With the VARIABLE_CHUNKS flag, CHLEN is the max length
+        of the chunks and CHCNT 4-byte uncompressed lengths of the chunks
+        follow the compressed lengths.
+
+        Gunzip ignores the extra field. Dictzip refuses the version.
         """
-        assert in_size <= 0xffffffff
-        zlengths = []
-        crcval = zlib.crc32(b"")
-
-        need = in_size
-        while need > 0:
-            read_size = min(need, CHUNK_LENGTH)
-            chunk = self.input_buffer.read(read_size)
-            if len(chunk) != read_size:
-                raise IOError("Need %s bytes, got %s" % (read_size, len(chunk)))
-
-            need -= len(chunk)
-            crcval = zlib.crc32(chunk, crcval)
-            zlen = self._compress_chunk(chunk)
-            zlengths.append(zlen)
+        num_chunks = len(zlengths)
+        flags = 0
+        field_length = EXTENDED_INFO_LENGTH + 4 * num_chunks
+        if self.record_delimiter is not None:
+            flags = VARIABLE_CHUNKS
+            field_length += 4 * num_chunks
+        extra_length = 2 * 2 + field_length
+        assert extra_length <= 0xffff
+        _write16(self.output, extra_length)  # XLEN
 
-        # An empty block with BFINAL=1 flag ends the zlib data stream.
-        self.output.write(self.compressobj.flush(zlib.Z_FINISH))
-        self._reset_compressor()
-        _write32(self.output, crcval)
-        _write32(self.output, in_size)
-        return zlengths
+        self.output.write(b"RA")
+        _write16(self.output, field_length)
+        self.output.write(struct.pack("<HHIIQ", EXTENDED_VERSION, flags,
+            self.chunk_length, num_chunks, self._member_size))
+        self.output.write(struct.pack("<%dI" % num_chunks, *zlengths))
+        if flags & VARIABLE_CHUNKS:
+            self.output.write(struct.pack("<%dI" % num_chunks,
+                *self._member_lengths))
 
     def _compress_chunk(self, chunk):
-        data = self.compressobj.compress(chunk)
-        zlen = len(data)
-        self.output.write(data)
-
-        data = self.compressobj.flush(zlib.Z_FULL_FLUSH)
-        zlen += len(data)
-        self.output.write(data)
-        return zlen
+        self._member_crc = zlib.crc32(chunk, self._member_crc)
+        if self._bloom is not None:
+            self._bloom.add_chunk(chunk)
+        if self._chunk_cache is None:
+            data = self._deflate_chunk(chunk)
+        else:
+            key = (self.compression_level,
+                   hashlib.blake2b(chunk, digest_size=16).digest())
+            data = self._chunk_cache.get(key)
+            if data is None:
+                self.chunk_cache_misses += 1
+                data = self._deflate_chunk(chunk)
+                self._chunk_cache.put(key, data)
+            else:
+                self.chunk_cache_hits += 1
+
+        self._add_member_data(data)
+        self._member_zlengths.append(len(data))
+        self._member_lengths.append(len(chunk))
+        return len(data)
+
+    def _deflate_chunk(self, chunk):
+        start = time.perf_counter()
+        if self.store_incompressible and _looks_incompressible(chunk):
+            data = None
+        else:
+            data = self.compressobj.compress(chunk)
+            data += self.compressobj.flush(zlib.Z_FULL_FLUSH)
+
+        if data is None or (len(data) > 0xffff and self.version == 1) or (
+                self.store_incompressible and
+                len(data) >= _stored_length(len(chunk))):
+            data = _stored_blocks(chunk)
+            self.stored_chunks += 1
+        self._deflate_time += time.perf_counter() - start
+        self._deflate_bytes += len(chunk)
+        return data
+
@@ -1,21 +1,64 @@
 
 import os
 from math import inf
+import asyncio
+import bisect
 import struct
+import time
 import zlib
 import itertools
+import random
 from io import BytesIO, open
 
-from idzip import compressor, caching
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from idzip import compressor, caching, diskcache, parallel, searching, sources
 from idzip._stream import IOStreamWrapperMixin
+from idzip.stats import ReaderStats
 
 GZIP_CRC32_LEN = 4
 
+# The max compressed bytes fetched by one coalesced read.
+MAX_PREFETCH_SIZE = 16 * 1024 * 1024
+
+# The max bytes yielded at once by tail().
+TAIL_READ_SIZE = 1024 * 1024
+# Seconds to wait before checking for new members again.
+TAIL_POLL_INTERVAL = 0.5
+
+# The max rounds of drawing more offsets by sample_lines().
+SAMPLE_ROUNDS = 64
+# The max offsets drawn in a round per missing line.
+MAX_DRAWS_FACTOR = 16
+
 SELECTED_CACHE = caching.OneItemCache
 
 class IdzipReader(IOStreamWrapperMixin):
-    def __init__(self, filename=None, fileobj=None):
-        if filename is None:
+    def __init__(self, filename=None, fileobj=None, cache=None,
+            use_trailer_index=True, source=None, index=None, stats=False,
+            trace=None, disk_cache=None):
+        """Opens a filename, a seekable fileobj or a byte source.
+        See idzip.sources for the byte sources.
+
+        The index from export_index() of a reader of the same file
+        can be given to skip the parsing of the headers.
+
+        With stats, the counters returned by stats() are collected.
+        The chunk accesses are recorded to a tracing.TraceRecorder
+        given as trace.
+
+        A diskcache.DiskCache given as disk_cache keeps
+        the decompressed chunks for other processes and restarts.
+        It is not used if the file identity is unknown.
+        """
+        if source is not None:
+            self.name = source.name
+            self._should_close = True
+            self._fileobj = sources.SourceStream(source)
+        elif filename is None:
             if fileobj:
                 self._fileobj = fileobj
                 self._should_close = False
@@ -29,14 +72,62 @@ class IdzipReader(IOStreamWrapperMixin):
             self.name = filename
             self._should_close = True
             self._fileobj = open(filename, "rb")
+        if source is None:
+            source = sources.FileSource(fileobj=self._fileobj)
+        # The compressed chunks are read from the source.
+        self._source = source
+        # The first member is parsed from here, when it is complete.
+        self._first_member_offset = self._fileobj.tell()
+        # Compressed chunks fetched ahead by _prefetch().
+        self._prefetched = {}
         # The current position in the decompressed data.
         self._pos = 0
         self._members = []
         self._last_zstream_end = None
+        # The file offset after the verified end of the last member.
+        self._member_end = None
         self._chunks = []
-        self._cache = SELECTED_CACHE()
+        if cache is None:
+            cache = SELECTED_CACHE()
+        self._cache = cache
+        # True if all members are known from a trailer index.
+        self._index_complete = False
+        self._stats = ReaderStats() if stats else None
+        self._trace = trace
+        self._disk_cache = None
+        if disk_cache is not None:
+            identity = diskcache.file_identity(self.name, source)
+            if identity is not None:
+                self._disk_cache = disk_cache.view(identity)
+
+        if index is not None:
+            self._first_member_offset = index.first_member_offset
+            self._members = list(index.members)
+            self._chunks = list(index.chunks)
+            self._last_zstream_end = index.last_zstream_end
+            self._index_complete = index.complete
+        elif not (use_trailer_index and self._load_trailer_index()):
+            try:
+                self._parse_next_member()
+            except EOFError:
+                # The first member is still being written,
+                # refresh() will find it later.
+                pass
 
-        self._read_member_header()
+    def stats(self):
+        """Returns a dict of the counters or None if not enabled.
+        See idzip.stats for the export to monitoring.
+        """
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
+
+    def export_index(self):
+        """Returns a snapshot of the members and chunks parsed so far.
+        """
+        return ReaderIndex(list(self._members), list(self._chunks),
+                self._last_zstream_end, self._index_complete,
+                self._first_member_offset)
 
     @property
     def stream(self):
@@ -58,25 +149,77 @@ class IdzipReader(IOStreamWrapperMixin):
 
         dictzip_field = _parse_dictzip_field(header["extra_field"]["RA"])
         num_member_chunks = len(dictzip_field["zlengths"])
+        if self._stats is not None:
+            self._stats.members_parsed += 1
 
         start_chunk_index = len(self._chunks)
         for zlen in dictzip_field["zlengths"]:
             self._chunks.append((offset, zlen))
             offset += zlen
         self._last_zstream_end = offset
+        self._member_end = None
 
         chlen = dictzip_field["chlen"]
-        sure_size = chlen * (num_member_chunks - 1)
-        self._add_member(chlen, start_chunk_index, sure_size)
+        self._add_member(chlen, start_chunk_index, num_member_chunks,
+                dictzip_field["lengths"])
+        if dictzip_field["isize"] is not None:
+            self._members[-1].set_input_size(dictzip_field["isize"])
+
+    def _load_trailer_index(self):
+        """Reads all members and chunks from the trailer index.
+        Returns False if the file does not end with a trailer index
+        covering the whole file.
+        """
+        try:
+            if not self._fileobj.seekable():
+                return False
+        except AttributeError:
+            return False
 
-    def _add_member(self, chlen, start_chunk_index, sure_size):
+        start = self._fileobj.tell()
+        try:
+            self._fileobj.seek(0, os.SEEK_END)
+            index = _read_trailer_index(self._fileobj, self._fileobj.tell())
+        except (IOError, EOFError, ValueError, struct.error, zlib.error):
+            index = None
+        self._fileobj.seek(start)
+        if index is None:
+            return False
+        covered_start, members = index
+        if covered_start != start:
+            return False
+
+        for data_offset, chlen, isize, zlengths, lengths in members:
+            start_chunk_index = len(self._chunks)
+            offset = data_offset
+            for zlen in zlengths:
+                self._chunks.append((offset, zlen))
+                offset += zlen
+            self._last_zstream_end = offset
+            self._add_member(chlen, start_chunk_index, len(zlengths), lengths)
+            self._members[-1].set_input_size(isize)
+        self._index_complete = True
+        return True
+
+    def _add_member(self, chlen, start_chunk_index, num_chunks, lengths=None):
+        """Adds a member with the given number of chunks.
+        The lengths of variable chunks are given by lengths.
+        """
         if len(self._members) > 0:
             prev_member = self._members[-1]
             start_pos = prev_member.start_pos + prev_member.isize
         else:
             start_pos = 0
+        chunk_starts = None
+        if lengths is None:
+            sure_size = chlen * (num_chunks - 1)
+        else:
+            chunk_starts = [0]
+            for length in lengths:
+                chunk_starts.append(chunk_starts[-1] + length)
+            sure_size = chunk_starts[-2] if lengths else 0
         self._members.append(_Member(chlen, start_pos, start_chunk_index,
-            sure_size))
+            num_chunks, sure_size, chunk_starts))
 
     def read(self, size=-1):
         """Reads the given number of bytes.
@@ -93,6 +236,9 @@ class IdzipReader(IOStreamWrapperMixin):
                     chunk_index += 1
             else:
                 need = prefix_size + size
+                if need > 0:
+                    last_index = self._index_pos(self._pos + size - 1)[0]
+                    self._prefetch(chunk_index, last_index)
                 while need > 0:
                     chunk_data = self._readchunk(chunk_index)
                     prefixed_buffer.append(chunk_data[:need])
@@ -103,16 +249,19 @@ class IdzipReader(IOStreamWrapperMixin):
             # PR#16/18 - support identifying EOF
             #         use a read() as a sync from desired position to actual position
             #         read(0) can be used as a synchronization call
-            dec_eof_position = self._members[-1].start_pos + self._members[-1].isize
+            dec_eof_position = self._size()
             self._pos = dec_eof_position
             if prefixed_buffer:
                 # subtracting the data in the EOF Case so the normal path will add it back
                 # before the function return to avoid changing the path
                 # adding up lengths rather than concatenating here to avoid creating new buffers
                 self._pos -= sum([len(x) for x in prefixed_buffer]) - prefix_size
+        self._prefetched.clear()
         prefixed_buffer = b"".join(prefixed_buffer)
         result = prefixed_buffer[prefix_size:]
         self._pos += len(result)
+        if self._stats is not None:
+            self._stats.bytes_read += len(result)
         return result
 
     def readline(self, size=-1):
@@ -138,8 +287,359 @@ class IdzipReader(IOStreamWrapperMixin):
         if size >= 0:
             line = line[:size]
         self._pos += len(line)
+        if self._stats is not None:
+            self._stats.bytes_read += len(line)
         return line
 
+    def read_records(self, record_size, indices, dtype=None):
+        """Reads the fixed-size records with the given indices.
+        The record i starts at the uncompressed offset i * record_size.
+
+        With NumPy, returns an array with one row of record_size bytes
+        per index, or a 1-D array of the given dtype of record_size bytes.
+        Without NumPy, returns a list of bytes.
+        Each needed chunk is decompressed once. The position is not changed.
+        """
+        if record_size <= 0:
+            raise ValueError("Invalid record size: %r" % record_size)
+        if numpy is None:
+            if dtype is not None:
+                raise ImportError("NumPy is needed for the dtype")
+            return self._read_records_list(record_size, list(indices))
+
+        indices = numpy.asarray(indices, dtype=numpy.int64).reshape(-1)
+        if dtype is not None and numpy.dtype(dtype).itemsize != record_size:
+            raise ValueError("The dtype size does not match the record size")
+        if len(indices) and indices.min() < 0:
+            raise ValueError("Negative record index")
+        order = numpy.argsort(indices, kind="stable")
+        starts = indices[order] * record_size
+        records = numpy.empty((len(indices), record_size), dtype=numpy.uint8)
+        columns = numpy.arange(record_size)
+        for first, last, buffer_start, buffer in self._record_buffers(
+                starts, record_size, starts.searchsorted):
+            data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+            rows = (starts[first:last] - buffer_start)[:, None] + columns
+            records[order[first:last]] = data[rows]
+        if dtype is not None:
+            return records.view(dtype).reshape(len(indices))
+        return records
+
+    def _read_records_list(self, record_size, indices):
+        if indices and min(indices) < 0:
+            raise ValueError("Negative record index")
+        order = sorted(range(len(indices)), key=indices.__getitem__)
+        starts = [indices[i] * record_size for i in order]
+
+        def search(value, side):
+            return bisect.bisect_right(starts, value)
+
+        records = [None] * len(indices)
+        for first, last, buffer_start, buffer in self._record_buffers(
+                starts, record_size, search):
+            for i in range(first, last):
+                start = starts[i] - buffer_start
+                records[order[i]] = buffer[start:start + record_size]
+        return records
+
+    def _record_buffers(self, starts, record_size, search):
+        """Yields (first, last, buffer_start, buffer) with decompressed
+        data holding the records starts[first:last].
+        The starts are sorted. search(value, side="right") returns
+        the number of starts not greater than the value.
+        """
+        first = 0
+        while first < len(starts):
+            pos = int(starts[first])
+            chunk_index, prefix_size = self._index_pos(pos)
+            buffer_start = pos - prefix_size
+            pieces = []
+            buffer_end = buffer_start
+            try:
+                # A record can continue in the next chunks.
+                while buffer_end < pos + record_size:
+                    pieces.append(self._readchunk(chunk_index))
+                    buffer_end += len(pieces[-1])
+                    chunk_index += 1
+            except EOFError:
+                raise IndexError("Record index out of range: %s"
+                        % (pos // record_size))
+            last = int(search(buffer_end - record_size, side="right"))
+            buffer = pieces[0] if len(pieces) == 1 else b"".join(pieces)
+            yield first, last, buffer_start, buffer
+            first = last
+
+    def iter_chunks(self):
+        """Yields (uncompressed_offset, memoryview) for each chunk.
+        The position is not changed.
+        """
+        for offset, chunk_index in self._chunk_table():
+            yield offset, memoryview(self._uncached_readchunk(chunk_index))
+
+    def map_chunks(self, fn, workers=None, ordered=True, processes=False,
+            lines=False, max_pending=None):
+        """Yields fn(uncompressed_offset, data) for each chunk.
+
+        The chunks are decompressed and passed to fn by a pool
+        of threads or processes. With processes, fn must be picklable.
+        At most max_pending chunks are in flight.
+        The results are in the chunk order if ordered.
+
+        With lines, fn gets only whole lines. The lines crossing
+        the chunk boundaries are joined and passed to extra fn calls
+        in this process.
+        """
+        if max_pending is None:
+            max_pending = 2 * (workers or os.cpu_count() or 1)
+        stitcher = _LineStitcher(fn) if lines else None
+        tasks = ((fn, offset, compressed, lines)
+                for offset, compressed in self._iter_compressed_chunks())
+        with parallel.make_executor(workers, processes) as executor:
+            if ordered:
+                results = enumerate(parallel.ordered_map(executor,
+                    _map_chunk, tasks, max_pending))
+            else:
+                results = parallel.completed_map(executor, _map_chunk,
+                        tasks, max_pending)
+            for chunk_index, result in results:
+                if stitcher is None:
+                    yield result
+                    continue
+                head, has_middle, middle, tail, tail_offset = result
+                for line_result in stitcher.add(chunk_index, head, tail,
+                        tail_offset):
+                    yield line_result
+                if has_middle:
+                    yield middle
+            if stitcher is not None:
+                for line_result in stitcher.finish():
+                    yield line_result
+
+    def search(self, pattern, lines=False, overlap=searching.OVERLAP,
+            workers=None, processes=True, max_pending=None, fixed=False,
+            bloom=None):
+        """Yields searching.Match(offset, data) for the matches
+        of a bytes regular expression, in the offset order.
+
+        The chunks are searched by a pool of processes. A match
+        crossing a chunk boundary is found if it is not longer
+        than the overlap. With lines, the whole matching lines
+        are yielded. A literal pattern skips the chunks rejected
+        by the bloom filters, see searching.search().
+        """
+        return searching.search(self, pattern, lines, overlap, workers,
+                processes, max_pending, fixed, bloom)
+
+    def splits(self, n, align="line"):
+        """Returns up to n (start, end) ranges of about equal sizes
+        covering the uncompressed data.
+
+        The ranges start at chunk boundaries, moved back to the line
+        start if align is "line". The chunk before each boundary
+        is decompressed, more if a line is longer than a chunk.
+        Workers can read a range by a reader of their own.
+        """
+        if n <= 0:
+            raise ValueError("Invalid number of splits: %r" % n)
+        if align not in ("line", None):
+            raise ValueError("Unknown align: %r" % align)
+        table = list(self._chunk_table())
+        size = self._size()
+        offsets = [offset for offset, chunk_index in table]
+
+        bounds = [0]
+        for k in range(1, n):
+            target = size * k // n
+            # The nearest chunk boundary.
+            i = bisect.bisect_left(offsets, target)
+            if i == len(offsets) or (i > 0 and
+                    target - offsets[i - 1] <= offsets[i] - target):
+                i -= 1
+            if align == "line":
+                bound = self._next_line_start(table, i, size)
+            else:
+                bound = offsets[i]
+            if bound > bounds[-1]:
+                bounds.append(bound)
+        if size > bounds[-1]:
+            bounds.append(size)
+        return list(zip(bounds, bounds[1:]))
+
+    def _next_line_start(self, table, i, size):
+        """Returns the last line start in the (i-1)-th chunk
+        including the i-th chunk start. The first line start
+        from the i-th chunk or the size at EOF is returned
+        if the (i-1)-th chunk has no newline.
+        """
+        if i <= 0:
+            return 0
+        offset, chunk_index = table[i - 1]
+        eol_pos = self._readchunk(chunk_index).rfind(b"\n")
+        if eol_pos != -1:
+            return offset + eol_pos + 1
+        for offset, chunk_index in table[i:]:
+            eol_pos = self._readchunk(chunk_index).find(b"\n")
+            if eol_pos != -1:
+                return offset + eol_pos + 1
+        return size
+
+    def sample_lines(self, n, seed=None, unbiased=False):
+        """Returns up to n random (offset, line) pairs of distinct lines,
+        in the offset order.
+
+        Random uncompressed offsets are snapped to their whole lines,
+        so a line is picked with a probability proportional
+        to its length. With unbiased, the lines are accepted
+        with a probability inversely proportional to their length,
+        relative to the shortest line seen, to approximate a uniform
+        sample of lines. The needed chunks are decompressed once
+        per round of drawing and one round is usually enough.
+        The drawing stops when a round finds no new line,
+        so asking for more lines than the file has stays cheap.
+        """
+        if n < 0:
+            raise ValueError("Invalid sample size: %r" % n)
+        offsets, size = self._chunk_offsets()
+        rand = random.Random(seed)
+        lines = {}
+        shortest = None
+        accept_ratio = 1.0
+        for _ in range(SAMPLE_ROUNDS):
+            need = n - len(lines)
+            if need <= 0 or size == 0:
+                break
+            # More offsets are drawn to need no other round usually.
+            num_draws = min(int(need / accept_ratio * 1.25),
+                    MAX_DRAWS_FACTOR * need) + 8
+            candidates = self._lines_at(sorted(rand.randrange(size)
+                for _ in range(num_draws)), offsets, size)
+            # The sorted candidates are accepted in a random order.
+            rand.shuffle(candidates)
+            if unbiased:
+                lengths = [len(line) for start, line in candidates]
+                shortest = min([shortest or inf] + lengths)
+            accepted = 0
+            for start, line in candidates:
+                if start in lines:
+                    continue
+                if unbiased and rand.random() * len(line) >= shortest:
+                    continue
+                accepted += 1
+                if len(lines) < n:
+                    lines[start] = line
+            if accepted == 0:
+                # All lines are probably sampled already.
+                break
+            accept_ratio = max(0.01, accepted / float(num_draws))
+        return sorted(lines.items())
+
+    def _chunk_offsets(self):
+        """Returns the uncompressed offsets of all chunks
+        and the uncompressed size.
+        """
+        offsets = [offset for offset, chunk_index in self._chunk_table()]
+        return offsets, self._size()
+
+    def _size(self):
+        """Returns the uncompressed size of the known members.
+        """
+        if not self._members:
+            return 0
+        last = self._members[-1]
+        return last.start_pos + last.isize
+
+    def _lines_at(self, positions, offsets, size):
+        """Returns (start, line) of the whole lines at the sorted
+        uncompressed positions. Each chunk is decompressed once.
+        """
+        chunks = {}
+
+        def readchunk(chunk_index):
+            data = chunks.get(chunk_index)
+            if data is None:
+                data = self._uncached_readchunk(chunk_index)
+                chunks[chunk_index] = data
+            return data
+
+        lines = []
+        for pos in positions:
+            start, line = self._line_at(pos, offsets, size, readchunk)
+            lines.append((start, line))
+            # The next lines do not start before this line.
+            first = bisect.bisect_right(offsets, start) - 1
+            for chunk_index in [i for i in chunks if i < first]:
+                del chunks[chunk_index]
+        return lines
+
+    def _line_at(self, pos, offsets, size, readchunk=None):
+        """Returns (start, line) of the whole line at the uncompressed pos.
+        The chunks are read by readchunk(chunk_index).
+        """
+        if readchunk is None:
+            readchunk = self._readchunk
+        first = last = bisect.bisect_right(offsets, pos) - 1
+        start = None
+        end_limit = pos - offsets[first]
+        while start is None:
+            eol_pos = readchunk(first).rfind(b"\n", 0, end_limit)
+            if eol_pos != -1:
+                start = offsets[first] + eol_pos + 1
+            elif first == 0:
+                start = 0
+            else:
+                first -= 1
+                end_limit = None
+
+        end = None
+        start_limit = pos - offsets[last]
+        while end is None:
+            eol_pos = readchunk(last).find(b"\n", start_limit)
+            if eol_pos != -1:
+                end = offsets[last] + eol_pos + 1
+            elif last + 1 == len(offsets):
+                end = size
+            else:
+                last += 1
+                start_limit = 0
+
+        if first == last:
+            return start, readchunk(first)[start - offsets[first]:
+                    end - offsets[first]]
+        # Only the bytes of the line are joined.
+        pieces = []
+        for i in range(first, last + 1):
+            pieces.append(readchunk(i)[max(0, start - offsets[i]):
+                end - offsets[i]])
+        return start, b"".join(pieces)
+
+    def _iter_compressed_chunks(self):
+        for offset, chunk_index in self._chunk_table():
+            yield offset, self._compressed_chunk(chunk_index)
+
+    def _compressed_chunk(self, chunk_index):
+        chunk_offset, zlen = self._chunks[chunk_index]
+        compressed = self._source.read_at(chunk_offset, zlen)
+        if len(compressed) != zlen:
+            raise EOFError("Reached EOF")
+        return compressed
+
+    def _chunk_table(self):
+        """Yields (uncompressed_offset, chunk_index) for all chunks.
+        The members are parsed when needed.
+        """
+        member_index = 0
+        while True:
+            if member_index >= len(self._members):
+                try:
+                    self._parse_next_member()
+                except EOFError:
+                    return
+            member = self._members[member_index]
+            for i in range(member.num_chunks):
+                yield (member.start_pos + member.chunk_offset(i),
+                        member.start_chunk_index + i)
+            member_index += 1
+
     def flush(self):
         """No-op, but needed by IdzipFile.flush(), which is called
         if wrapped in TextIOWrapper."""
@@ -149,6 +649,7 @@ class IdzipReader(IOStreamWrapperMixin):
         if self._should_close:
             self._fileobj.close()
         self._cache = None
+        self._disk_cache = None
 
     def _index_pos(self, pos):
         """Returns (chunk_index, remainder) index
@@ -157,9 +658,8 @@ class IdzipReader(IOStreamWrapperMixin):
         member = self._select_member(pos)
 
         pos_in_member = (pos - member.start_pos)
-        member_chunk_index = pos_in_member // member.chlen
+        member_chunk_index, remainder = member.locate(pos_in_member)
         chunk_index = member.start_chunk_index + member_chunk_index
-        remainder = pos_in_member % member.chlen
         return (chunk_index, remainder)
 
     def _select_member(self, pos):
@@ -171,7 +671,8 @@ class IdzipReader(IOStreamWrapperMixin):
         try:
             for i in itertools.count():
                 if i >= len(self._members):
-                    return self._members[-1]
+                    # The size of the last member was known from its header.
+                    self._parse_next_member()
 
                 member = self._members[i]
                 if pos < member.start_pos + member.sure_size:
@@ -183,43 +684,209 @@ class IdzipReader(IOStreamWrapperMixin):
                     return member
 
         except EOFError:
+            if not self._members:
+                # No member is complete yet.
+                return _EMPTY_MEMBER
             return self._members[-1]
 
     def _readchunk(self, chunk_index):
         """Reads the specified chunk or throws EOFError.
         """
         chunk = self._cache.get(chunk_index)
+        if self._stats is not None:
+            if chunk is None:
+                self._stats.cache_misses += 1
+            else:
+                self._stats.cache_hits += 1
         if chunk is not None:
+            if self._trace is not None:
+                self._trace.record(chunk_index, True)
             return chunk
 
-        chunk = self._uncached_readchunk(chunk_index)
+        if self._trace is None:
+            chunk = self._fetch_chunk(chunk_index)
+        else:
+            start = time.perf_counter()
+            chunk = self._fetch_chunk(chunk_index)
+            self._trace.record(chunk_index, False,
+                    time.perf_counter() - start)
         self._cache.put(chunk_index, chunk)
         return chunk
 
+    def _fetch_chunk(self, chunk_index):
+        """Reads a chunk missing in the cache
+        from the disk cache or decompresses it.
+        """
+        if self._disk_cache is None:
+            return self._uncached_readchunk(chunk_index)
+        # The EOF is reached without looking for a chunk after it.
+        while chunk_index >= len(self._chunks):
+            self._parse_next_member()
+        chunk = self._disk_cache.get(chunk_index)
+        if self._stats is not None:
+            if chunk is None:
+                self._stats.disk_misses += 1
+            else:
+                self._stats.disk_hits += 1
+        if chunk is None:
+            chunk = self._uncached_readchunk(chunk_index)
+            self._disk_cache.put(chunk_index, chunk)
+        return chunk
+
+    def _prefetch(self, first_index, last_index):
+        """Fetches the known and not cached compressed chunks
+        in the given range. Adjacent chunks are fetched together.
+        """
+        ranges = []
+        indexes = []
+        total = 0
+        # A cache without a membership test is not checked,
+        # get() would count the lookups twice.
+        cached = getattr(self._cache, "__contains__", None)
+        for chunk_index in range(first_index,
+                min(last_index + 1, len(self._chunks))):
+            if cached is not None and cached(chunk_index):
+                continue
+            if (self._disk_cache is not None and
+                    chunk_index in self._disk_cache):
+                continue
+            offset, zlen = self._chunks[chunk_index]
+            total += zlen
+            if total > MAX_PREFETCH_SIZE:
+                break
+            ranges.append((offset, zlen))
+            indexes.append(chunk_index)
+
+        if len(ranges) < 2:
+            return
+        start = time.perf_counter()
+        fetched = self._source.read_many(ranges)
+        if self._stats is not None:
+            self._stats.io_seconds += time.perf_counter() - start
+        for chunk_index, data in zip(indexes, fetched):
+            self._prefetched[chunk_index] = data
+
     def _uncached_readchunk(self, chunk_index):
         while chunk_index >= len(self._chunks):
             self._parse_next_member()
 
         offset, zlen = self._chunks[chunk_index]
-        self._fileobj.seek(offset)
-        compressed = _read_exactly(self._fileobj, zlen)
+        stats = self._stats
+        compressed = self._prefetched.pop(chunk_index, None)
+        if compressed is None:
+            if stats is not None:
+                start = time.perf_counter()
+            compressed = self._source.read_at(offset, zlen)
+            if stats is not None:
+                stats.io_seconds += time.perf_counter() - start
+        if len(compressed) != zlen:
+            raise EOFError("Reached EOF")
         deobj = zlib.decompressobj(-zlib.MAX_WBITS)
-        return deobj.decompress(compressed)
+        if stats is None:
+            return deobj.decompress(compressed)
+
+        start = time.perf_counter()
+        data = deobj.decompress(compressed)
+        stats.zlib_seconds += time.perf_counter() - start
+        stats.chunks_inflated += 1
+        stats.compressed_bytes += zlen
+        stats.inflated_bytes += len(data)
+        return data
 
     def _parse_next_member(self):
-        self._reach_member_end()
-        self._read_member_header()
+        """Parses the member after the last known member.
+
+        A member still being written is ignored
+        and EOFError is raised as at the end of the file.
+        """
+        if self._index_complete:
+            raise EOFError("No member after the indexed members")
+        if self._members:
+            self._reach_member_end()
+        else:
+            self._fileobj.seek(self._first_member_offset)
+        num_members = len(self._members)
+        num_chunks = len(self._chunks)
+        last_zstream_end = self._last_zstream_end
+        member_end = self._member_end
+        try:
+            self._read_member_header()
+            # Checks that the whole member is already written.
+            self._reach_member_end()
+        except EOFError:
+            del self._members[num_members:]
+            del self._chunks[num_chunks:]
+            self._last_zstream_end = last_zstream_end
+            self._member_end = member_end
+            raise
+
+    def refresh(self):
+        """Parses the members appended to a file being written.
+        Returns the number of the new members.
+        """
+        num_members = len(self._members)
+        try:
+            while True:
+                self._parse_next_member()
+        except EOFError:
+            pass
+        return len(self._members) - num_members
+
+    def tail(self, poll_interval=TAIL_POLL_INTERVAL, timeout=None,
+            size=TAIL_READ_SIZE):
+        """Yields the data from the current position, including
+        the data appended later by a writer.
+        Stops when no new member appears for the timeout seconds.
+        The default timeout None waits forever.
+        """
+        last_data = time.time()
+        while True:
+            data = self.read(size)
+            if data:
+                last_data = time.time()
+                yield data
+                continue
+            if self.refresh():
+                continue
+            if timeout is not None and time.time() - last_data >= timeout:
+                return
+            time.sleep(poll_interval)
+
+    async def atail(self, poll_interval=TAIL_POLL_INTERVAL, timeout=None,
+            size=TAIL_READ_SIZE):
+        """An async version of tail().
+        The reads run in the default executor.
+        """
+        loop = asyncio.get_event_loop()
+        last_data = time.time()
+        while True:
+            data = await loop.run_in_executor(None, self.read, size)
+            if data:
+                last_data = time.time()
+                yield data
+                continue
+            if await loop.run_in_executor(None, self.refresh):
+                continue
+            if timeout is not None and time.time() - last_data >= timeout:
+                return
+            await asyncio.sleep(poll_interval)
 
     def _reach_member_end(self):
         """Seeks the _fileobj at the end of the last known member.
         """
+        if self._member_end is not None:
+            self._fileobj.seek(self._member_end)
+            return
         self._fileobj.seek(self._last_zstream_end)
 
         # The zlib stream could end with an empty block.
         deobj = zlib.decompressobj(-zlib.MAX_WBITS)
         extra = b""
         while deobj.unused_data == b"" and not extra:
-            extra += deobj.decompress(self._fileobj.read(3))
+            data = self._fileobj.read(3)
+            if not data:
+                raise EOFError("Reached EOF inside the member")
+            extra += deobj.decompress(data)
 
         extra += deobj.flush()
         if extra != b"":
@@ -228,7 +895,9 @@ class IdzipReader(IOStreamWrapperMixin):
         self._fileobj.seek(GZIP_CRC32_LEN - len(deobj.unused_data),
                 os.SEEK_CUR)
         isize = _read32(self._fileobj)
-        self._members[-1].set_input_size(isize)
+        if self._members[-1].isize is None:
+            self._members[-1].set_input_size(isize)
+        self._member_end = self._fileobj.tell()
 
     def tell(self):
         return self._pos
@@ -249,6 +918,8 @@ class IdzipReader(IOStreamWrapperMixin):
         if new_pos < 0:
             raise ValueError("Invalid pos: %r" % new_pos)
         self._pos = new_pos
+        if self._stats is not None:
+            self._stats.seeks += 1
         return new_pos
 
     def __repr__(self):
@@ -258,29 +929,145 @@ class IdzipReader(IOStreamWrapperMixin):
             hex(id(self)))
 
 
+def _map_chunk(fn, offset, compressed, lines):
+    """Decompresses a chunk and applies fn to it.
+
+    With lines, fn is applied only to the whole lines
+    and the partial lines at the chunk ends are returned:
+    (head, has_middle, fn_result, tail, tail_offset).
+    """
+    data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+    if not lines:
+        return fn(offset, memoryview(data))
+
+    first = data.find(b"\n")
+    if first == -1:
+        # The chunk is a part of a longer line.
+        return data, False, None, b"", None
+    last = data.rfind(b"\n")
+    has_middle = last > first
+    middle = None
+    if has_middle:
+        middle = fn(offset + first + 1, memoryview(data)[first + 1:last + 1])
+    return (data[:first + 1], has_middle, middle, data[last + 1:],
+            offset + last + 1)
+
+
+class _LineStitcher(object):
+    """Joins the partial lines at the ends of neighbouring chunks.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.next_index = 0
+        self.waiting = {}
+        self.carry = []
+        self.carry_offset = 0
+
+    def add(self, chunk_index, head, tail, tail_offset):
+        """Adds the partial lines of a chunk.
+        Returns the fn results of the completed lines.
+        The tail_offset is None if the whole chunk is the head.
+        """
+        self.waiting[chunk_index] = (head, tail, tail_offset)
+        results = []
+        while self.next_index in self.waiting:
+            head, tail, tail_offset = self.waiting.pop(self.next_index)
+            self.next_index += 1
+            self.carry.append(head)
+            if tail_offset is None:
+                continue
+            results.append(self._flush())
+            self.carry = [tail]
+            self.carry_offset = tail_offset
+        return results
+
+    def finish(self):
+        if any(self.carry):
+            return [self._flush()]
+        return []
+
+    def _flush(self):
+        line = b"".join(self.carry)
+        self.carry = []
+        return self.fn(self.carry_offset, memoryview(line))
+
+
+class ReaderIndex(object):
+    """The parsed members and chunks of a file.
+    """
+    # Rough memory used by one parsed member and one chunk.
+    MEMBER_BYTES = 400
+    CHUNK_BYTES = 120
+
+    def __init__(self, members, chunks, last_zstream_end, complete,
+            first_member_offset=0):
+        self.members = members
+        self.chunks = chunks
+        self.last_zstream_end = last_zstream_end
+        self.complete = complete
+        # Where the first member starts, if it is not complete yet.
+        self.first_member_offset = first_member_offset
+
+    @property
+    def nbytes(self):
+        """The estimated memory used by the index.
+        """
+        return (len(self.members) * self.MEMBER_BYTES +
+                len(self.chunks) * self.CHUNK_BYTES)
+
+
 class _Member(object):
-    def __init__(self, chlen, start_pos, start_chunk_index, sure_size):
+    def __init__(self, chlen, start_pos, start_chunk_index, num_chunks,
+            sure_size, chunk_starts=None):
         self.chlen = chlen
         self.start_pos = start_pos
         self.start_chunk_index = start_chunk_index
+        self.num_chunks = num_chunks
         self.sure_size = sure_size
+        # The uncompressed offsets of variable chunks and the member end.
+        self.chunk_starts = chunk_starts
         self.isize = None
 
+    def locate(self, pos_in_member):
+        """Returns (member_chunk_index, remainder) for the given pos.
+        """
+        if self.chunk_starts is None:
+            return divmod(pos_in_member, self.chlen)
+        starts = self.chunk_starts
+        i = bisect.bisect_right(starts, pos_in_member) - 1
+        return (i, pos_in_member - starts[i])
+
+    def chunk_offset(self, member_chunk_index):
+        """Returns the offset of the chunk from the member start.
+        """
+        if self.chunk_starts is None:
+            return member_chunk_index * self.chlen
+        return self.chunk_starts[member_chunk_index]
+
     def set_input_size(self, isize):
         assert isize >= self.sure_size
         self.isize = isize
 
 
+# The member selected before any member is complete.
+_EMPTY_MEMBER = _Member(compressor.CHUNK_LENGTH, 0, 0, 0, 0)
+_EMPTY_MEMBER.set_input_size(0)
+
+
 def _read_gzip_header(input):
     """Returns a parsed gzip header.
     The position of the input is advanced beyond the header.
-    EOFError is thrown if there is not enough of data for the header.
+    EOFError is thrown if there is not enough of data for the header
+    or if the header is still zeroed by a writer streaming the member.
     """
     header = {
             "extra_field": {}
             }
 
-    magic, flags, mtime = struct.unpack("<3sBIxx", _read_exactly(input, 10))
+    start = _read_exactly(input, 10)
+    if not any(start):
+        raise EOFError("The member header is not written yet")
+    magic, flags, mtime = struct.unpack("<3sBIxx", start)
     if magic != compressor.GZIP_DEFLATE_ID:
         raise IOError("Not a gzip-deflate file.")
 
@@ -289,7 +1076,7 @@ def _read_gzip_header(input):
 
     if compressor.FEXTRA & flags:
         xlen = _read16(input)
-        extra_field = input.read(xlen)
+        extra_field = _read_exactly(input, xlen)
         header["extra_field"] = _split_subfields(extra_field)
 
     if compressor.FNAME & flags:
@@ -305,6 +1092,72 @@ def _read_gzip_header(input):
     return header
 
 
+def _read_trailer_index(input, end):
+    """Returns (covered_start, members) from the trailer index
+    of the file ending at the given end.
+    Each member is (data_offset, chlen, isize, zlengths, lengths),
+    where lengths are the lengths of variable chunks or None.
+    None is returned if there is no trailer index.
+    """
+    locator_size = compressor.LOCATOR_SIZE
+    if end < locator_size:
+        return None
+    input.seek(end - locator_size)
+    locator = _read_empty_member(input).get("RL")
+    if (locator is None or
+            len(locator) != struct.calcsize(compressor.LOCATOR_FORMAT)):
+        return None
+    magic, version, index_length, covered, crc = struct.unpack(
+            compressor.LOCATOR_FORMAT, locator)
+    if magic != compressor.LOCATOR_MAGIC:
+        return None
+    if version not in (compressor.INDEX_VERSION,
+            compressor.INDEX_VERSION_VARIABLE):
+        raise IOError("Unsupported trailer index version: %s" % version)
+
+    index_start = end - locator_size - index_length
+    input.seek(index_start)
+    pieces = []
+    while input.tell() < end - locator_size:
+        pieces.append(_read_empty_member(input)["RI"])
+    index = b"".join(pieces)
+    if zlib.crc32(index) != crc:
+        raise IOError("Corrupted trailer index")
+
+    index = BytesIO(zlib.decompress(index))
+    magic, version, num_members = struct.unpack("<4sHI",
+            _read_exactly(index, 10))
+    if magic != compressor.INDEX_MAGIC:
+        raise IOError("Corrupted trailer index")
+    members = []
+    for i in range(num_members):
+        data_back, chlen, num_chunks, isize = struct.unpack("<QIIQ",
+                _read_exactly(index, 24))
+        flags = 0
+        if version == compressor.INDEX_VERSION_VARIABLE:
+            flags = _read16(index)
+        zlengths = struct.unpack("<%dI" % num_chunks,
+                _read_exactly(index, 4 * num_chunks))
+        lengths = None
+        if flags & compressor.VARIABLE_CHUNKS:
+            lengths = struct.unpack("<%dI" % num_chunks,
+                    _read_exactly(index, 4 * num_chunks))
+        members.append((index_start - data_back, chlen, isize, zlengths,
+            lengths))
+    return index_start - covered, members
+
+
+def _read_empty_member(input):
+    """Reads a gzip member without data.
+    Returns its extra subfields.
+    """
+    header = _read_gzip_header(input)
+    tail = _read_exactly(input, len(compressor.EMPTY_ZSTREAM) + 8)
+    if tail != compressor.EMPTY_ZSTREAM + b"\0" * 8:
+        raise IOError("Expected an empty member")
+    return header["extra_field"]
+
+
 def _read_exactly(input, size):
     data = input.read(size)
     if len(data) != size:
@@ -354,23 +1207,54 @@ def _skip_cstring(input):
 def _parse_dictzip_field(subfield):
     """Returns a dict with:
         chlen ... length of each uncompressed chunk,
-        zlengths ... lengths of compressed chunks.
+        zlengths ... lengths of compressed chunks,
+        isize ... the uncompressed member size or None if unknown,
+        lengths ... lengths of variable uncompressed chunks or None.
 
     The dictzip subfield consists of:
     +---+---+---+---+---+---+==============================================+
     | VER=1 | CHLEN | CHCNT | CHCNT 2-byte lengths of compressed chunks ...|
     +---+---+---+---+---+---+==============================================+
+
+    The extended subfield (VER=2) is described
+    in IdzipWriter._write_extended_field().
     """
     input = BytesIO(subfield)
-    ver, chlen, chunk_count = struct.unpack("<HHH", input.read(6))
-    if ver != 1:
+    ver = _read16(input)
+    if ver == 1:
+        chlen, chunk_count = struct.unpack("<HH", _read_field(input, 4))
+        zlengths = _read_array(input, "H", chunk_count)
+        isize = None
+        lengths = None
+    elif ver == compressor.EXTENDED_VERSION:
+        info_len = compressor.EXTENDED_INFO_LENGTH - 2
+        flags, chlen, chunk_count, isize = struct.unpack("<HIIQ",
+                _read_field(input, info_len))
+        if flags & ~compressor.VARIABLE_CHUNKS:
+            raise IOError("Unsupported dictzip flags: %s" % flags)
+        zlengths = _read_array(input, "I", chunk_count)
+        lengths = None
+        if flags & compressor.VARIABLE_CHUNKS:
+            lengths = _read_array(input, "I", chunk_count)
+    else:
         raise IOError("Unsupported dictzip version: %s" % ver)
 
-    zlengths = []
-    for i in range(chunk_count):
-        zlengths.append(_read16(input))
+    return dict(chlen=chlen, zlengths=zlengths, isize=isize, lengths=lengths)
+
 
-    return dict(chlen=chlen, zlengths=zlengths)
+def _read_array(input, code, count):
+    """Reads count little-endian numbers of the given struct code.
+    """
+    item_format = "<%d%s" % (count, code)
+    data = _read_field(input, struct.calcsize(item_format))
+    return list(struct.unpack(item_format, data))
+
+
+def _read_field(input, size):
+    data = input.read(size)
+    if len(data) != size:
+        raise IOError("Truncated dictzip field")
+    return data
 
 
 IdzipFile = IdzipReader
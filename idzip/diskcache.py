@@ -0,0 +1,288 @@
+"""
+A persistent cache of the decompressed chunks, shared by processes.
+
+A DiskCache given to IdzipReader(disk_cache=...) is checked after
+a miss of the in-memory cache, so a restarted process reads its hot
+chunks from the local disk instead of decompressing them again.
+
+The cache directory holds two files:
+- SLABS_NAME is divided into fixed-size slabs, each holding one chunk.
+  The file is mapped to the memory of each process.
+- INDEX_NAME is an SQLite database mapping (file identity, chunk index)
+  to the slab, the chunk length and its CRC-32, with the last use time
+  for the LRU eviction.
+
+The index is changed in SQLite transactions, so the processes
+sharing the directory do not allocate the same slab. A slab can still be
+overwritten while another process reads it, the CRC-32 then does not match
+and the read is a miss.
+"""
+
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+INDEX_NAME = "index.sqlite"
+SLABS_NAME = "slabs"
+
+# The bytes of one slab. Longer chunks are not cached.
+SLAB_SIZE = 64 * 1024
+MAX_BYTES = 1024 * 1024 * 1024
+
+# Seconds to wait for the index locked by another process.
+LOCK_TIMEOUT = 30
+# The last use time of a chunk is updated at most once per this many seconds.
+TOUCH_SECONDS = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+CREATE TABLE IF NOT EXISTS chunks (
+    file TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    slab INTEGER NOT NULL UNIQUE,
+    length INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (file, chunk));
+CREATE INDEX IF NOT EXISTS chunks_used ON chunks (used);
+CREATE TABLE IF NOT EXISTS free_slabs (slab INTEGER PRIMARY KEY);
+"""
+
+
+def file_identity(name, source=None):
+    """Returns a key of the version of a compressed file or None.
+
+    A local file is identified by its path, inode, size
+    and modification time. Other sources are identified
+    by their name and size.
+    """
+    if not name or not isinstance(name, str):
+        return None
+    if os.path.isfile(name):
+        info = os.stat(name)
+        return "%s:%s:%s:%s" % (os.path.realpath(name), info.st_ino,
+                info.st_size, info.st_mtime_ns)
+    if source is not None:
+        try:
+            return "%s:%s" % (name, source.size())
+        except (IOError, OSError):
+            return None
+    return None
+
+
+class DiskCache(object):
+    def __init__(self, directory, max_bytes=MAX_BYTES, slab_size=SLAB_SIZE):
+        """Opens or creates a cache directory.
+
+        The max_bytes and slab_size must be the same
+        in all processes using the directory.
+        """
+        num_slabs = max_bytes // slab_size
+        if num_slabs <= 0:
+            raise ValueError("Too small max_bytes: %r" % max_bytes)
+        self.directory = directory
+        self.slab_size = slab_size
+        self.num_slabs = num_slabs
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+        # The connections inherited by a forked process
+        # are kept open, closing them would break the parent.
+        self._inherited = []
+        self._slabs = None
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        if self._connection is not None:
+            self._inherited.append(self._connection)
+        self._pid = os.getpid()
+        connection = sqlite3.connect(
+                os.path.join(self.directory, INDEX_NAME),
+                timeout=LOCK_TIMEOUT, isolation_level=None,
+                check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection = connection
+        with self._transaction():
+            for statement in _SCHEMA.split(";"):
+                if statement.strip():
+                    connection.execute(statement)
+            geometry = dict(connection.execute(
+                    "SELECT key, value FROM meta WHERE key IN "
+                    "('slab_size', 'num_slabs')"))
+            if not geometry:
+                connection.executemany(
+                        "INSERT INTO meta (key, value) VALUES (?, ?)",
+                        [("slab_size", self.slab_size),
+                            ("num_slabs", self.num_slabs),
+                            ("next_slab", 0)])
+            elif geometry != {"slab_size": self.slab_size,
+                    "num_slabs": self.num_slabs}:
+                raise ValueError("The cache %r has slab_size=%s and "
+                        "max_bytes=%s" % (self.directory,
+                            geometry["slab_size"],
+                            geometry["slab_size"] * geometry["num_slabs"]))
+            size = self.slab_size * self.num_slabs
+            with open(os.path.join(self.directory, SLABS_NAME), "a+b") as f:
+                if os.fstat(f.fileno()).st_size < size:
+                    f.truncate(size)
+                if self._slabs is None:
+                    self._slabs = mmap.mmap(f.fileno(), size)
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self._open()
+
+    def get(self, file, chunk_index):
+        """Returns the cached chunk or None.
+        """
+        with self._lock:
+            self._check_process()
+            row = self._connection.execute(
+                    "SELECT slab, length, crc, used FROM chunks "
+                    "WHERE file = ? AND chunk = ?",
+                    (file, chunk_index)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            slab, length, crc, used = row
+            start = slab * self.slab_size
+            data = self._slabs[start:start + length]
+            if zlib.crc32(data) != crc:
+                # The slab was reused or not completely written.
+                with self._transaction():
+                    self._release(file, chunk_index, slab, crc)
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - used >= TOUCH_SECONDS:
+                self._connection.execute(
+                        "UPDATE chunks SET used = ? WHERE slab = ?",
+                        (now, slab))
+            self.hits += 1
+            return data
+
+    def contains(self, file, chunk_index):
+        with self._lock:
+            self._check_process()
+            return self._connection.execute(
+                    "SELECT 1 FROM chunks WHERE file = ? AND chunk = ?",
+                    (file, chunk_index)).fetchone() is not None
+
+    def put(self, file, chunk_index, data):
+        if len(data) > self.slab_size:
+            return
+        crc = zlib.crc32(data)
+        with self._lock:
+            self._check_process()
+            connection = self._connection
+            with self._transaction():
+                if connection.execute(
+                        "SELECT 1 FROM chunks WHERE file = ? AND chunk = ?",
+                        (file, chunk_index)).fetchone() is not None:
+                    # Stored by another process.
+                    return
+                slab = self._allocate()
+                start = slab * self.slab_size
+                self._slabs[start:start + len(data)] = data
+                connection.execute("INSERT INTO chunks "
+                        "(file, chunk, slab, length, crc, used) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (file, chunk_index, slab, len(data), crc,
+                            time.time()))
+
+    def _allocate(self):
+        """Returns a free slab, the least recently used chunk
+        is evicted if needed. Called in a transaction.
+        """
+        connection = self._connection
+        row = connection.execute("SELECT slab FROM free_slabs LIMIT 1"
+                ).fetchone()
+        if row is not None:
+            connection.execute("DELETE FROM free_slabs WHERE slab = ?", row)
+            return row[0]
+        next_slab, = connection.execute(
+                "SELECT value FROM meta WHERE key = 'next_slab'").fetchone()
+        if next_slab < self.num_slabs:
+            connection.execute("UPDATE meta SET value = ? "
+                    "WHERE key = 'next_slab'", (next_slab + 1,))
+            return next_slab
+        slab, = connection.execute(
+                "SELECT slab FROM chunks ORDER BY used LIMIT 1").fetchone()
+        connection.execute("DELETE FROM chunks WHERE slab = ?", (slab,))
+        return slab
+
+    def _release(self, file, chunk_index, slab, crc):
+        cursor = self._connection.execute("DELETE FROM chunks "
+                "WHERE file = ? AND chunk = ? AND slab = ? AND crc = ?",
+                (file, chunk_index, slab, crc))
+        if cursor.rowcount:
+            self._connection.execute(
+                    "INSERT INTO free_slabs (slab) VALUES (?)", (slab,))
+
+    def __len__(self):
+        with self._lock:
+            self._check_process()
+            return self._connection.execute(
+                    "SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def view(self, file):
+        """Returns a cache of the chunks of one file,
+        usually identified by file_identity().
+        """
+        return DiskCacheView(self, file)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            if self._slabs is not None:
+                self._slabs.close()
+                self._slabs = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DiskCacheView(object):
+    def __init__(self, cache, file):
+        self._cache = cache
+        self._file = file
+
+    def get(self, chunk_index):
+        return self._cache.get(self._file, chunk_index)
+
+    def put(self, chunk_index, data):
+        self._cache.put(self._file, chunk_index, data)
+
+    def __contains__(self, chunk_index):
+        return self._cache.contains(self._file, chunk_index)
+
+
+class _Transaction(object):
+    """Holds the write lock of the index until the end of the block.
+    """
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self._connection.execute("COMMIT")
+        else:
+            self._connection.execute("ROLLBACK")
@@ -0,0 +1,220 @@
+"""
+A log oriented writer.
+
+Records from many threads are queued and compressed by a background
+thread. Members are sealed when they grow big enough or when
+the oldest record waits too long, instead of on every flush().
+Each appended record gets a future, which is resolved when
+the member holding the record is written and flushed to the output.
+"""
+
+import os
+import threading
+import time
+
+from concurrent.futures import Future
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from idzip.compressor import IdzipWriter, MAX_MEMBER_SIZE
+
+# Members smaller than this are only written when closing.
+MIN_MEMBER_SIZE = 1024 * 1024
+
+# Max seconds a record waits for its member to be sealed,
+# once the member is bigger than the min member size.
+MAX_LATENCY = 1.0
+
+QUEUE_SIZE = 4096
+
+_CLOSE = object()
+
+
+class IdzipLogWriter(object):
+    def __init__(self, output, min_member_size=MIN_MEMBER_SIZE,
+            max_member_size=MAX_MEMBER_SIZE, max_latency=MAX_LATENCY,
+            queue_size=QUEUE_SIZE, fsync=False, mtime=None):
+        if not 0 < min_member_size <= max_member_size:
+            raise ValueError("Invalid member sizes: %r, %r" % (
+                min_member_size, max_member_size))
+        self._writer = IdzipWriter(output, sync_size=max_member_size,
+                mtime=mtime)
+        self.name = self._writer.name
+        self.min_member_size = min_member_size
+        self.max_latency = max_latency
+        self.fsync = fsync
+        self._queue = queue.Queue(queue_size)
+        self._pending = []
+        # The future of the record being written.
+        self._in_flight = None
+        self._oldest = None
+        self._error = None
+        self._closing = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                name="idzip-log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, record):
+        """Queues the record for writing.
+
+        Returns a future with the uncompressed offset of the record.
+        The future is done when the record is durable in the output.
+        Blocks if the queue is full.
+        """
+        future = Future()
+        with self._lock:
+            if self._closing:
+                raise ValueError("Cannot append to a closed log writer")
+            if self._error is not None:
+                raise self._error
+            self._queue.put((bytes(record), future))
+        return future
+
+    def close(self):
+        """Writes all queued records and closes the writer.
+        The last member may be smaller than the min member size.
+        """
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._queue.put(_CLOSE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def closed(self):
+        return self._closing and not self._thread.is_alive()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        try:
+            self._loop()
+        except Exception as e:
+            try:
+                self._fail(e)
+            finally:
+                self._close_owned_output()
+            self._drain_after_failure()
+
+    def _loop(self):
+        writer = self._writer
+        while True:
+            item = self._next_item()
+            while item is not None:
+                if item is _CLOSE:
+                    writer.sync()
+                    self._flush_output()
+                    self._resolve(writer.tell())
+                    writer.close()
+                    return
+
+                record, future = item
+                offset = writer.tell()
+                members_written = writer._members_written
+                self._in_flight = future
+                writer.write(record)
+                self._pending.append((writer.tell(), offset, future))
+                self._in_flight = None
+                if self._oldest is None:
+                    self._oldest = time.time()
+                if writer._members_written != members_written:
+                    # The writer sealed full members.
+                    self._flush_output()
+                    self._resolve(writer.tell() - writer._member_size)
+                # A steady stream of records must not delay the seal.
+                if self._should_seal():
+                    self._seal()
+                # Groups everything already queued into one commit.
+                item = self._get_nowait()
+
+            if self._should_seal():
+                self._seal()
+
+    def _seal(self):
+        self._writer.compress_member()
+        self._flush_output()
+        self._resolve(self._writer.tell())
+
+    def _next_item(self):
+        timeout = None
+        if (self._oldest is not None and
+                self._writer._member_size >= self.min_member_size):
+            timeout = max(0, self._oldest + self.max_latency - time.time())
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _get_nowait(self):
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _should_seal(self):
+        if self._oldest is None:
+            return False
+        if self._writer._member_size < self.min_member_size:
+            return False
+        return time.time() - self._oldest >= self.max_latency
+
+    def _flush_output(self):
+        output = self._writer.output
+        output.flush()
+        if self.fsync:
+            os.fsync(output.fileno())
+
+    def _resolve(self, durable_pos):
+        """Resolves the futures of records ending before the given pos.
+        """
+        done = 0
+        for end, offset, future in self._pending:
+            if end > durable_pos:
+                break
+            future.set_result(offset)
+            done += 1
+        del self._pending[:done]
+        if self._pending:
+            # The rest of the last record waits in the open member.
+            self._oldest = time.time()
+        else:
+            self._oldest = None
+
+    def _fail(self, error):
+        self._error = error
+        if self._in_flight is not None:
+            self._in_flight.set_exception(error)
+            self._in_flight = None
+        for end, offset, future in self._pending:
+            future.set_exception(error)
+        self._pending = []
+
+    def _close_owned_output(self):
+        """Closes the output opened by the writer.
+        The writer is not usable after a failure.
+        """
+        if self._writer._should_close:
+            try:
+                self._writer.output.close()
+            except Exception:
+                # The failure is already reported.
+                pass
+
+    def _drain_after_failure(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                return
+            item[1].set_exception(self._error)
@@ -0,0 +1,59 @@
+"""
+Helpers for running work on a pool of threads or processes.
+"""
+
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+        ThreadPoolExecutor, wait)
+
+
+def make_executor(workers=None, processes=False):
+    """Returns a process or a thread pool executor.
+    """
+    if processes:
+        return ProcessPoolExecutor(workers)
+    return ThreadPoolExecutor(workers)
+
+
+def ordered_map(executor, func, args_list, max_pending):
+    """Yields func(*args) for each args tuple in the given order.
+
+    At most max_pending calls are submitted ahead,
+    so a slow consumer does not buffer all results.
+    """
+    pending = deque()
+    try:
+        for args in args_list:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, *args))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def completed_map(executor, func, args_list, max_pending):
+    """Yields (i, func(*args)) for the i-th args tuple
+    in the order of completion.
+    At most max_pending calls are submitted ahead.
+    """
+    pending = {}
+    try:
+        for i, args in enumerate(args_list):
+            if len(pending) >= max_pending:
+                for result in _pop_completed(pending):
+                    yield result
+            pending[executor.submit(func, *args)] = i
+        while pending:
+            for result in _pop_completed(pending):
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _pop_completed(pending):
+    done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+    return [(pending.pop(future), future.result()) for future in done]
@@ -0,0 +1,137 @@
+"""
+A pool of readers for serving many files.
+
+Only max_handles files are kept open. The parsed indexes of the members
+and chunks are kept separately in a cache bounded by max_index_bytes,
+so a closed file is reopened without parsing its headers again.
+"""
+
+import os
+import threading
+
+from collections import OrderedDict
+
+from idzip import caching
+from idzip.decompressor import IdzipReader
+
+MAX_HANDLES = 128
+MAX_INDEX_BYTES = 64 * 1024 * 1024
+
+
+def _index_nbytes(index):
+    return index.nbytes
+
+
+class _PooledReader(object):
+    """An open reader used by one thread at a time.
+    """
+    def __init__(self, reader, identity):
+        self.reader = reader
+        self.identity = identity
+        self.lock = threading.Lock()
+
+
+class ReaderPool(object):
+    """Reads many files by a bounded number of open readers.
+
+    The chunk_cache is a caching.SharedLRUCache shared by the readers.
+    Each reader has its own chunk cache if it is None.
+    """
+    def __init__(self, max_handles=MAX_HANDLES,
+            max_index_bytes=MAX_INDEX_BYTES, chunk_cache=None):
+        if max_handles <= 0:
+            raise ValueError("Invalid max handles: %r" % max_handles)
+        self.max_handles = max_handles
+        self.chunk_cache = chunk_cache
+        self.indexes = caching.SharedLRUCache(max_index_bytes,
+                sizeof=_index_nbytes)
+        # The number of opened readers.
+        self.opens = 0
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, filename, offset, size=-1):
+        """Reads size bytes at the uncompressed offset of the file.
+        """
+        return self._apply(filename, _read, offset, size)
+
+    def size(self, filename):
+        """Returns the uncompressed size of the file.
+        """
+        return self._apply(filename, _size)
+
+    def _apply(self, filename, func, *args):
+        filename = os.path.realpath(filename)
+        while True:
+            handle = self._get(filename)
+            with handle.lock:
+                # The reader could be evicted before getting the lock.
+                if handle.reader is not None:
+                    return func(handle.reader, *args)
+
+    def _get(self, filename):
+        info = os.stat(filename)
+        identity = (filename, info.st_size, info.st_mtime_ns, info.st_ino)
+        with self._lock:
+            handle = self._handles.get(filename)
+            if handle is not None and handle.identity == identity:
+                self._handles.move_to_end(filename)
+                return handle
+
+        handle = _PooledReader(self._open(filename, identity), identity)
+        with self._lock:
+            evicted = []
+            old = self._handles.pop(filename, None)
+            if old is not None:
+                evicted.append(old)
+            self._handles[filename] = handle
+            while len(self._handles) > self.max_handles:
+                evicted.append(self._handles.popitem(last=False)[1])
+        for old in evicted:
+            self._close(old)
+        return handle
+
+    def _open(self, filename, identity):
+        cache = None
+        if self.chunk_cache is not None:
+            cache = self.chunk_cache.view(identity)
+        reader = IdzipReader(filename, cache=cache,
+                index=self.indexes.get(identity))
+        with self._lock:
+            self.opens += 1
+        return reader
+
+    def _close(self, handle):
+        with handle.lock:
+            reader = handle.reader
+            if reader is None:
+                return
+            handle.reader = None
+            # The index could have grown since it was loaded.
+            self.indexes.put(handle.identity, reader.export_index())
+            reader.close()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def close(self):
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        for handle in handles:
+            self._close(handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _read(reader, offset, size):
+    reader.seek(offset)
+    return reader.read(size)
+
+
+def _size(reader):
+    return reader.seek(0, os.SEEK_END)
@@ -0,0 +1,216 @@
+"""
+Searching for a regular expression in parallel over the chunks.
+
+Each chunk is searched by a worker together with the start
+of the next chunk, so a match crossing a chunk boundary is found
+if it is not longer than the overlap. The matches are reported
+in the order of their uncompressed offsets.
+
+A window starts at the first line start in its chunk and ends
+at the first line start in the next chunk, so ^ and lookbehinds
+are not matched in the middle of a line. A line start is looked for
+in the first overlap bytes of a chunk, the chunk boundary is used
+if a line is longer.
+"""
+
+import functools
+import os
+import re
+import zlib
+
+from collections import namedtuple
+
+from idzip import bloom as idzip_bloom, parallel
+
+# The bytes of the next chunk searched with a chunk.
+OVERLAP = 1024
+
+# The bytes with a special meaning in a regular expression.
+_SPECIAL_CHARS = frozenset(b".^$*+?{}[]\\|()")
+
+# A match or a matching line at the uncompressed offset.
+Match = namedtuple("Match", "offset data")
+
+
+def compile_pattern(pattern, fixed=False):
+    """Returns a compiled bytes regular expression.
+
+    A str pattern is encoded to UTF-8. A fixed pattern is a literal
+    substring. The not compiled patterns use re.MULTILINE,
+    so ^ and $ match at the line boundaries.
+    """
+    if hasattr(pattern, "finditer"):
+        return pattern
+    if not isinstance(pattern, bytes):
+        pattern = pattern.encode("utf-8")
+    if fixed:
+        pattern = re.escape(pattern)
+    return re.compile(pattern, re.MULTILINE)
+
+
+def literal_needle(pattern, fixed=False):
+    """Returns the bytes matched by a literal pattern or None.
+    """
+    if hasattr(pattern, "finditer"):
+        return None
+    if not isinstance(pattern, bytes):
+        pattern = pattern.encode("utf-8")
+    if fixed or not _SPECIAL_CHARS.intersection(pattern):
+        return pattern
+    return None
+
+
+def search(reader, pattern, lines=False, overlap=OVERLAP, workers=None,
+        processes=True, max_pending=None, fixed=False, bloom=None):
+    """Yields a Match for each match of the pattern in the reader.
+
+    With lines, the whole matching lines are yielded instead,
+    each line once. The overlap is not needed then.
+    The overlap is limited by the length of the next chunk.
+
+    A literal pattern is searched only in the chunks admitted
+    by the bloom.ChunkFilters. By default, the filters are loaded
+    from the sidecar of the file, if it exists. False disables them.
+    """
+    regex = compile_pattern(pattern, fixed)
+    needle = literal_needle(pattern, fixed)
+    if bloom is None and needle is not None:
+        bloom = idzip_bloom.load_for(reader)
+        # A stale sidecar is ignored.
+        if bloom is not None and not _covers(bloom, reader):
+            bloom = None
+    if bloom and needle is not None:
+        for match in _search_candidates(reader, regex, needle, bloom, lines,
+                overlap, workers, processes, max_pending):
+            yield match
+        return
+
+    if lines:
+        results = reader.map_chunks(functools.partial(_match_lines, regex),
+                workers, processes=processes, lines=True,
+                max_pending=max_pending)
+        for matches in results:
+            for match in matches:
+                yield match
+        return
+
+    if overlap < 0:
+        raise ValueError("Invalid overlap: %r" % overlap)
+    if max_pending is None:
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+    tasks = _window_tasks(reader, regex, overlap)
+    with parallel.make_executor(workers, processes) as executor:
+        last_end = 0
+        for matches in parallel.ordered_map(executor, _search_window,
+                tasks, max_pending):
+            for match in matches:
+                # The previous window could already match over the start.
+                if match.offset < last_end:
+                    continue
+                last_end = match.offset + len(match.data)
+                yield match
+
+
+def _search_candidates(reader, regex, needle, filters, lines, overlap,
+        workers, processes, max_pending):
+    """Searches only the chunks where the filters admit the needle.
+    """
+    if not _covers(filters, reader):
+        raise IOError("The bloom filters do not match the file: %r"
+                % reader.name)
+    offsets, size = reader._chunk_offsets()
+    candidates = filters.candidates(needle, offsets)
+    overlap = max(overlap, len(needle))
+    if max_pending is None:
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+
+    def tasks():
+        for chunk_index in candidates:
+            next_compressed = None
+            if chunk_index + 1 < len(offsets):
+                next_compressed = reader._compressed_chunk(chunk_index + 1)
+            # The literal needles have no anchors, the candidate chunks
+            # are searched from their boundaries.
+            yield (regex, overlap, offsets[chunk_index],
+                    reader._compressed_chunk(chunk_index), next_compressed,
+                    False)
+
+    with parallel.make_executor(workers, processes) as executor:
+        last_end = 0
+        for matches in parallel.ordered_map(executor, _search_window,
+                tasks(), max_pending):
+            for match in matches:
+                if match.offset < last_end:
+                    continue
+                if lines:
+                    match = Match(*reader._line_at(match.offset, offsets,
+                        size))
+                last_end = match.offset + len(match.data)
+                yield match
+
+
+def _covers(filters, reader):
+    offsets, size = reader._chunk_offsets()
+    return len(filters) == len(offsets) and filters.size == size
+
+
+def _window_tasks(reader, regex, overlap):
+    previous = None
+    for offset, compressed in reader._iter_compressed_chunks():
+        if previous is not None:
+            yield (regex, overlap) + previous + (compressed,)
+        previous = (offset, compressed)
+    if previous is not None:
+        yield (regex, overlap) + previous + (None,)
+
+
+def _search_window(regex, overlap, offset, compressed, next_compressed,
+        aligned=True):
+    """Returns the matches starting in the window of the chunk.
+    Only the overlap bytes of the next chunk are decompressed.
+    Not aligned windows start and end at the chunk boundaries.
+    """
+    data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+    start = 0
+    end = len(data)
+    if aligned and offset > 0:
+        start = _line_start(data, overlap)
+    if next_compressed is not None and overlap > 0:
+        head = zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+                next_compressed, overlap)
+        if aligned:
+            end += _line_start(head, overlap)
+        data += head
+    matches = []
+    # The bytes before the start are seen by lookbehinds
+    # and ^ matches only after a newline.
+    for match in regex.finditer(data, start):
+        if match.start() >= end:
+            break
+        matches.append(Match(offset + match.start(), match.group()))
+    return matches
+
+
+def _line_start(data, limit):
+    """Returns the offset after the first newline
+    in the first limit bytes or 0.
+    """
+    return data.find(b"\n", 0, limit) + 1
+
+
+def _match_lines(regex, offset, data):
+    """Returns the lines with a match in the given whole lines.
+    """
+    data = bytes(data)
+    matches = []
+    pos = 0
+    while pos < len(data):
+        match = regex.search(data, pos)
+        if match is None:
+            break
+        start = data.rfind(b"\n", 0, match.start()) + 1
+        end = data.find(b"\n", match.start())
+        end = len(data) if end == -1 else end + 1
+        matches.append(Match(offset + start, data[start:end]))
+        pos = end
+    return matches
@@ -0,0 +1,395 @@
+"""
+A HTTP server of decompressed byte ranges.
+
+GET /path/to/file.dz with a "Range: bytes=X-Y" header returns
+the bytes X..Y of the uncompressed file. Many ranges can be requested
+in one Range header, they are returned as multipart/byteranges.
+The files are served from one directory. Their readers are kept open
+and share one chunk cache, so a chunk is decompressed once
+for all clients.
+
+GET /_metrics returns the cache and latency metrics.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from urllib.parse import unquote, urlsplit
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlsplit
+
+from idzip import caching
+from idzip.pool import ReaderPool, MAX_HANDLES, MAX_INDEX_BYTES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8742
+CACHE_SIZE = 256 * 1024 * 1024
+WORKERS = 8
+METRICS_PATH = "/_metrics"
+
+# The files and ranges are sent in pieces of this size.
+SEND_SIZE = 1024 * 1024
+
+# Bigger multipart requests are answered by one range
+# covering all the requested ranges.
+MAX_RANGES = 64
+MAX_RANGES_BYTES = 64 * 1024 * 1024
+
+_REASONS = {
+    200: "OK",
+    206: "Partial Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    415: "Unsupported Media Type",
+    416: "Range Not Satisfiable",
+    500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, headers=None):
+        Exception.__init__(self, status)
+        self.status = status
+        self.headers = headers or {}
+
+
+class _BodyError(Exception):
+    """A failure after the response headers were sent."""
+
+
+_RANGE_SPEC = re.compile(r"([0-9]*)-([0-9]*)$")
+
+
+def parse_range(header, size):
+    """Returns a list of (start, end) from the Range header value.
+    The end is inclusive, like in the header.
+    None is returned if no range is satisfiable.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip() != "bytes":
+        raise ValueError("Unsupported range unit: %r" % unit)
+    ranges = []
+    for spec in specs.split(","):
+        match = _RANGE_SPEC.match(spec.strip())
+        if match is None or not any(match.groups()):
+            raise ValueError("Invalid range: %r" % spec)
+        start, end = match.groups()
+        if start:
+            start = int(start)
+            end = int(end) if end else size - 1
+        else:
+            # A suffix range with the last bytes.
+            start = max(0, size - int(end))
+            end = size - 1
+        if start > end and end >= 0 and start < size:
+            raise ValueError("Invalid range: %r" % spec)
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    return ranges or None
+
+
+class ServerMetrics(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def record(self, status, latency, bytes_sent):
+        self.requests += 1
+        if status >= 400:
+            self.errors += 1
+        self.bytes_sent += bytes_sent
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+
+
+class RangeServer(object):
+    def __init__(self, root, host="127.0.0.1", port=DEFAULT_PORT,
+            cache_size=CACHE_SIZE, max_handles=MAX_HANDLES,
+            max_index_bytes=MAX_INDEX_BYTES, workers=WORKERS):
+        self.root = os.path.realpath(root)
+        self.host = host
+        self.port = port
+        self.cache = caching.SharedLRUCache(cache_size)
+        self.pool = ReaderPool(max_handles, max_index_bytes, self.cache)
+        self.metrics = ServerMetrics()
+        self._executor = ThreadPoolExecutor(workers)
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_connection,
+                self.host, self.port)
+        # The real port, if the port 0 was requested.
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close_listener(self):
+        """Stops accepting new connections.
+        """
+        if self._server is not None:
+            self._server.close()
+
+    def close(self):
+        self.close_listener()
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+    def metrics_text(self):
+        """Returns the metrics in the Prometheus text format.
+        """
+        cache = self.cache
+        lookups = cache.hits + cache.misses
+        metrics = self.metrics
+        values = [
+            ("idzip_requests_total", metrics.requests),
+            ("idzip_request_errors_total", metrics.errors),
+            ("idzip_sent_bytes_total", metrics.bytes_sent),
+            ("idzip_request_seconds_sum", metrics.latency_sum),
+            ("idzip_request_seconds_max", metrics.latency_max),
+            ("idzip_cache_hits_total", cache.hits),
+            ("idzip_cache_misses_total", cache.misses),
+            ("idzip_cache_hit_ratio", cache.hits / lookups if lookups else 0),
+            ("idzip_cache_bytes", cache.size),
+            ("idzip_cache_chunks", len(cache)),
+            ("idzip_open_handles", len(self.pool)),
+            ("idzip_handle_opens_total", self.pool.opens),
+            ("idzip_index_bytes", self.pool.indexes.size),
+        ]
+        return "".join("%s %s\n" % value for value in values)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+                keep_alive = _keeps_alive(version, headers)
+                await self._serve_request(method, target, headers, writer,
+                        keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_request(self, method, target, headers, writer,
+            keep_alive):
+        start = time.time()
+        sent = 0
+        try:
+            if method not in ("GET", "HEAD"):
+                raise HttpError(405, {"Allow": "GET, HEAD"})
+            path = unquote(urlsplit(target).path)
+            if path == METRICS_PATH:
+                body = self.metrics_text().encode("ascii")
+                status = 200
+                sent = await _respond(writer, method, status, keep_alive,
+                        {"Content-Type": "text/plain; version=0.0.4"}, [body])
+            else:
+                status, sent = await self._serve_file(method, path,
+                        headers.get("range"), writer, keep_alive)
+        except HttpError as e:
+            status = e.status
+            sent = await _respond(writer, method, status, keep_alive,
+                    e.headers, [])
+        except _BodyError as e:
+            # A second response would be read as a part of the body.
+            logger.error("Failed to send %r", target, exc_info=e.__cause__)
+            self.metrics.record(500, time.time() - start, sent)
+            raise ConnectionAbortedError("Failed to send %r" % target)
+        except Exception:
+            status = 500
+            sent = await _respond(writer, method, status, keep_alive, {}, [])
+        self.metrics.record(status, time.time() - start, sent)
+
+    def _resolve(self, path):
+        filename = os.path.realpath(os.path.join(self.root,
+            path.lstrip("/")))
+        if not filename.startswith(self.root + os.sep):
+            raise HttpError(404)
+        if not os.path.isfile(filename):
+            raise HttpError(404)
+        return filename
+
+    async def _serve_file(self, method, path, range_header, writer,
+            keep_alive):
+        filename = self._resolve(path)
+        try:
+            size = await self._run(self.pool.size, filename)
+        except IOError:
+            raise HttpError(415)
+
+        if range_header is None:
+            headers = {"Content-Length": str(size), "Accept-Ranges": "bytes"}
+            sent = await _respond(writer, method, 200, keep_alive, headers,
+                    None)
+            if method == "GET":
+                sent += await _send_body(self._send_range(writer, filename,
+                    0, size))
+            return 200, sent
+
+        try:
+            ranges = parse_range(range_header, size)
+        except ValueError:
+            raise HttpError(400)
+        if ranges is None:
+            raise HttpError(416, {"Content-Range": "bytes */%s" % size})
+
+        if len(ranges) > 1 and (len(ranges) > MAX_RANGES or
+                sum(last - first + 1 for first, last in ranges) >
+                MAX_RANGES_BYTES):
+            ranges = [(min(first for first, last in ranges),
+                max(last for first, last in ranges))]
+
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            headers = {"Content-Range": "bytes %s-%s/%s" % (first, last, size),
+                    "Content-Length": str(last - first + 1)}
+            sent = await _respond(writer, method, 206, keep_alive, headers,
+                    None)
+            if method == "GET":
+                sent += await _send_body(self._send_range(writer, filename,
+                    first, last - first + 1))
+            return 206, sent
+
+        boundary = uuid.uuid4().hex
+        part_headers = [("--%s\r\nContent-Type: application/octet-stream"
+            "\r\nContent-Range: bytes %s-%s/%s\r\n\r\n" % (
+                boundary, first, last, size)).encode("ascii")
+            for first, last in ranges]
+        end = ("--%s--\r\n" % boundary).encode("ascii")
+        length = len(end) + sum(len(part_header) + last - first + 1 + 2
+                for part_header, (first, last) in zip(part_headers, ranges))
+        headers = {"Content-Type":
+                "multipart/byteranges; boundary=%s" % boundary,
+                "Content-Length": str(length)}
+        sent = await _respond(writer, method, 206, keep_alive, headers, None)
+        if method == "GET":
+            sent += await _send_body(self._send_parts(writer, filename,
+                part_headers, ranges, end))
+        return 206, sent
+
+    async def _send_parts(self, writer, filename, part_headers, ranges, end):
+        sent = 0
+        for part_header, (first, last) in zip(part_headers, ranges):
+            writer.write(part_header)
+            sent += len(part_header)
+            sent += await self._send_range(writer, filename, first,
+                    last - first + 1)
+            writer.write(b"\r\n")
+            sent += 2
+        writer.write(end)
+        await writer.drain()
+        return sent + len(end)
+
+    async def _send_range(self, writer, filename, offset, size):
+        """Sends the uncompressed bytes in pieces of SEND_SIZE.
+        Returns the number of sent bytes.
+        """
+        sent = 0
+        end = offset + size
+        while offset < end:
+            data = await self._run(self.pool.read, filename, offset,
+                    min(SEND_SIZE, end - offset))
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+            offset += len(data)
+            sent += len(data)
+        return sent
+
+
+async def _send_body(sending):
+    """Returns the number of the bytes sent by the coroutine.
+    Its failure is raised as _BodyError.
+    """
+    try:
+        return await sending
+    except ConnectionError:
+        raise
+    except Exception as e:
+        raise _BodyError() from e
+
+
+async def _read_request(reader):
+    """Returns (method, target, version, headers) or None at EOF.
+    """
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, version = line.decode("latin-1").split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length:
+        await reader.readexactly(length)
+    return method, target, version, headers
+
+
+def _keeps_alive(version, headers):
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.1":
+        return connection != "close"
+    return connection == "keep-alive"
+
+
+async def _respond(writer, method, status, keep_alive, headers, body):
+    """Writes the response. The headers are only written if body is None.
+    Returns the number of written body bytes.
+    """
+    headers = dict(headers)
+    if body is not None:
+        headers["Content-Length"] = str(sum(len(part) for part in body))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    lines = ["HTTP/1.1 %s %s" % (status, _REASONS.get(status, ""))]
+    lines.extend("%s: %s" % item for item in headers.items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    sent = 0
+    if body is not None and method != "HEAD":
+        for part in body:
+            writer.write(part)
+            sent += len(part)
+    await writer.drain()
+    return sent
+
+
+def serve(root, host="127.0.0.1", port=DEFAULT_PORT, **kwargs):
+    """Serves the directory until interrupted.
+    """
+    server = RangeServer(root, host, port, **kwargs)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,180 @@
+"""
+Reads many .dz shards as one stream.
+
+The shards are concatenated in the given order. A shard is opened
+when it is first needed and at most max_open shards are kept open.
+"""
+
+import bisect
+import glob
+import os
+
+from idzip import parallel
+from idzip.decompressor import IdzipReader
+from idzip.pool import ReaderPool, MAX_INDEX_BYTES
+
+MAX_OPEN = 64
+
+# readline() searches for the end of line in pieces of this size.
+READLINE_SIZE = 8192
+
+
+class ShardedIdzipReader(object):
+    def __init__(self, shards, max_open=MAX_OPEN,
+            max_index_bytes=MAX_INDEX_BYTES):
+        """Opens an ordered list of shard filenames
+        or a glob pattern matching them. The glob matches are sorted.
+        """
+        if isinstance(shards, str):
+            pattern = shards
+            shards = sorted(glob.glob(pattern))
+            if not shards:
+                raise IOError("No shards match %r" % pattern)
+        self.shards = list(shards)
+        self.name = self.shards[0] if self.shards else ""
+        self.closed = False
+        self._pool = ReaderPool(max_open, max_index_bytes)
+        # The uncompressed start offsets of the shards with known sizes
+        # and the end of the last of them.
+        self._starts = [0]
+        self._pos = 0
+
+    def _add_shard_size(self):
+        """Adds the size of the next shard to the offsets.
+        """
+        i = len(self._starts) - 1
+        self._starts.append(self._starts[i] + self._pool.size(self.shards[i]))
+
+    def _locate(self, pos):
+        """Returns (shard_index, pos_in_shard) or None after the end.
+        """
+        while self._starts[-1] <= pos and len(self._starts) <= len(self.shards):
+            self._add_shard_size()
+        i = bisect.bisect_right(self._starts, pos) - 1
+        if i >= len(self.shards):
+            return None
+        return i, pos - self._starts[i]
+
+    def size(self):
+        """Returns the total uncompressed size.
+        All shard headers are parsed.
+        """
+        while len(self._starts) <= len(self.shards):
+            self._add_shard_size()
+        return self._starts[-1]
+
+    def shard_offsets(self):
+        """Returns the global start offset of each shard.
+        """
+        self.size()
+        return self._starts[:-1]
+
+    def read(self, size=-1):
+        """Reads the given number of bytes across the shards.
+        A negative size reads till the end.
+        """
+        pieces = []
+        while size != 0:
+            location = self._locate(self._pos)
+            if location is None:
+                break
+            shard_index, pos_in_shard = location
+            data = self._pool.read(self.shards[shard_index], pos_in_shard,
+                    size)
+            if not data:
+                break
+            pieces.append(data)
+            self._pos += len(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(pieces)
+
+    def readline(self, size=-1):
+        line = []
+        while size != 0:
+            read_size = READLINE_SIZE
+            if size > 0:
+                read_size = min(read_size, size)
+            data = self.read(read_size)
+            if not data:
+                break
+            eol_pos = data.find(b"\n")
+            if eol_pos != -1:
+                # Returns the bytes after the end of line.
+                self._pos -= len(data) - eol_pos - 1
+                line.append(data[:eol_pos + 1])
+                break
+            line.append(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(line)
+
+    def __iter__(self):
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            new_pos = offset
+        elif whence == os.SEEK_CUR:
+            new_pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            new_pos = self.size() + offset
+        else:
+            raise ValueError("Unknown whence: %r" % whence)
+
+        if new_pos < 0:
+            raise ValueError("Invalid pos: %r" % new_pos)
+        self._pos = new_pos
+        return new_pos
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def map_shards(self, func, workers=None, processes=True):
+        """Yields func(reader) for each shard, in the order of the shards.
+
+        The shards are scanned in parallel by the given number
+        of processes or threads. With processes, func must be
+        picklable, e.g. a module-level function.
+        """
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+        with parallel.make_executor(workers, processes) as executor:
+            for result in parallel.ordered_map(executor, _apply_to_shard,
+                    [(func, shard) for shard in self.shards], max_pending):
+                yield result
+
+    def close(self):
+        self._pool.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return "<idzip %s sharded file of %s shards at %s>" % (
+            "open" if not self.closed else "closed",
+            len(self.shards),
+            hex(id(self)))
+
+
+def _apply_to_shard(func, filename):
+    reader = IdzipReader(filename)
+    try:
+        return func(reader)
+    finally:
+        reader.close()
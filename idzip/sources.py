@@ -0,0 +1,294 @@
+"""
+Byte sources give random access to the compressed bytes.
+
+A source implements:
+    read_at(offset, size) ... returns up to size bytes at the offset,
+    read_many(ranges) ... returns the bytes of many (offset, size) ranges,
+    size() ... returns the total number of bytes,
+    close().
+
+The reader fetches compressed chunks through a source,
+so a .dz file can be read from a local file, an mmap
+or a HTTP server supporting range requests.
+"""
+
+import mmap
+import os
+import threading
+
+from io import UnsupportedOperation
+
+try:
+    from http import client as http_client
+    from urllib.parse import urlsplit
+except ImportError:
+    import httplib as http_client
+    from urlparse import urlsplit
+
+# Ranges separated by a smaller gap are fetched together.
+MAX_GAP = 4096
+
+# A sequential read of the headers fetches at least this many bytes.
+READAHEAD_SIZE = 64 * 1024
+
+
+def coalesce_ranges(ranges, max_gap=0):
+    """Merges near (offset, size) ranges.
+    Returns a list of (offset, size, members) where members
+    are the indexes of the merged input ranges.
+    """
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    merged = []
+    for i in order:
+        offset, size = ranges[i]
+        if merged:
+            last_offset, last_size, members = merged[-1]
+            last_end = last_offset + last_size
+            if offset <= last_end + max_gap:
+                end = max(last_end, offset + size)
+                merged[-1] = (last_offset, end - last_offset, members)
+                members.append(i)
+                continue
+        merged.append((offset, size, [i]))
+    return merged
+
+
+class ByteSource(object):
+    """The base of the byte sources.
+    Subclasses implement read_at() and size().
+    """
+    name = ""
+    max_gap = 0
+
+    def read_at(self, offset, size):
+        raise NotImplementedError
+
+    def size(self):
+        raise NotImplementedError
+
+    def read_many(self, ranges):
+        """Returns the bytes of the given (offset, size) ranges.
+        Near ranges are fetched by one read.
+        """
+        results = [None] * len(ranges)
+        for offset, size, members in coalesce_ranges(ranges, self.max_gap):
+            data = self.read_at(offset, size)
+            for i in members:
+                start = ranges[i][0] - offset
+                results[i] = data[start:start + ranges[i][1]]
+        return results
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FileSource(ByteSource):
+    """Reads a local file or a seekable file object.
+    """
+    def __init__(self, filename=None, fileobj=None):
+        if fileobj is None:
+            fileobj = open(filename, "rb")
+            self._should_close = True
+        else:
+            self._should_close = False
+        self._fileobj = fileobj
+        self.name = getattr(fileobj, "name", filename or "")
+        self._lock = threading.Lock()
+
+    def read_at(self, offset, size):
+        with self._lock:
+            self._fileobj.seek(offset)
+            return self._fileobj.read(size)
+
+    def size(self):
+        with self._lock:
+            pos = self._fileobj.tell()
+            self._fileobj.seek(0, os.SEEK_END)
+            size = self._fileobj.tell()
+            self._fileobj.seek(pos)
+            return size
+
+    def close(self):
+        if self._should_close:
+            self._fileobj.close()
+
+
+class MmapSource(ByteSource):
+    """Reads a memory mapped local file.
+    The reads do not need any system call.
+    """
+    def __init__(self, filename):
+        self.name = filename
+        self._file = open(filename, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._mmap = None
+        if self._size > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+
+    def read_at(self, offset, size):
+        if self._mmap is None:
+            return b""
+        return self._mmap[offset:offset + size]
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+class HttpRangeSource(ByteSource):
+    """Reads a URL by HTTP range requests.
+    The connection is kept alive between the requests.
+    """
+    max_gap = MAX_GAP
+
+    def __init__(self, url, timeout=30, headers=None):
+        parts = urlsplit(url)
+        if parts.scheme == "https":
+            self._connection_class = http_client.HTTPSConnection
+        elif parts.scheme == "http":
+            self._connection_class = http_client.HTTPConnection
+        else:
+            raise ValueError("Unsupported URL: %r" % url)
+        self.name = url
+        self._netloc = parts.netloc
+        self._path = parts.path or "/"
+        if parts.query:
+            self._path += "?" + parts.query
+        self._timeout = timeout
+        self._headers = dict(headers or {})
+        self._connection = None
+        self._size = None
+        self._lock = threading.Lock()
+        # The number of requests sent to the server.
+        self.requests = 0
+
+    def read_at(self, offset, size):
+        if size <= 0 or offset >= self.size():
+            return b""
+        end = min(offset + size, self.size()) - 1
+        status, headers, body = self._request("GET",
+                {"Range": "bytes=%s-%s" % (offset, end)})
+        if status == 206:
+            return body
+        if status == 200:
+            # The server ignored the range.
+            return body[offset:end + 1]
+        raise IOError("HTTP %s for %s" % (status, self.name))
+
+    def size(self):
+        if self._size is None:
+            status, headers, body = self._request("HEAD", {})
+            if status != 200 or headers.get("content-length") is None:
+                raise IOError("HTTP %s for %s" % (status, self.name))
+            self._size = int(headers["content-length"])
+        return self._size
+
+    def _request(self, method, headers):
+        all_headers = dict(self._headers)
+        all_headers.update(headers)
+        with self._lock:
+            for attempt in range(2):
+                if self._connection is None:
+                    self._connection = self._connection_class(self._netloc,
+                            timeout=self._timeout)
+                try:
+                    self.requests += 1
+                    self._connection.request(method, self._path,
+                            headers=all_headers)
+                    response = self._connection.getresponse()
+                    body = response.read()
+                except (http_client.HTTPException, OSError):
+                    # A kept alive connection could be closed by the server.
+                    self._connection.close()
+                    self._connection = None
+                    if attempt:
+                        raise
+                    continue
+                response_headers = dict((key.lower(), value)
+                        for key, value in response.getheaders())
+                if response_headers.get("connection", "").lower() == "close":
+                    self._connection.close()
+                    self._connection = None
+                return response.status, response_headers, body
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class SourceStream(object):
+    """A read-only file object over a byte source.
+
+    Small sequential reads, like reading of gzip headers,
+    are served from a buffer filled by READAHEAD_SIZE reads.
+    """
+    def __init__(self, source, readahead_size=READAHEAD_SIZE):
+        self.source = source
+        self.name = source.name
+        self.closed = False
+        self._readahead_size = readahead_size
+        self._pos = 0
+        self._buffer = b""
+        self._buffer_pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.source.size() - self._pos)
+        start = self._pos - self._buffer_pos
+        if not (0 <= start and start + size <= len(self._buffer)):
+            if size >= self._readahead_size:
+                data = self.source.read_at(self._pos, size)
+                self._pos += len(data)
+                return data
+            self._buffer = self.source.read_at(self._pos,
+                    self._readahead_size)
+            self._buffer_pos = self._pos
+            start = 0
+        data = self._buffer[start:start + size]
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        elif whence == os.SEEK_END:
+            self._pos = self.source.size() + offset
+        else:
+            raise ValueError("Unknown whence: %r" % whence)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def fileno(self):
+        raise UnsupportedOperation("A byte source has no file descriptor")
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.source.close()
@@ -0,0 +1,120 @@
+"""
+Counters of readers and writers.
+
+The counters are collected only if enabled by stats=True,
+a disabled reader or writer just checks for None.
+A snapshot is a dict of numbers, which can be exported
+in the Prometheus text format or to a StatsD-style callback.
+"""
+
+
+class ReaderStats(object):
+    def __init__(self):
+        self.chunks_inflated = 0
+        self.compressed_bytes = 0
+        self.inflated_bytes = 0
+        self.bytes_read = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.seeks = 0
+        self.members_parsed = 0
+        self.zlib_seconds = 0.0
+        self.io_seconds = 0.0
+
+    def snapshot(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "chunks_inflated": self.chunks_inflated,
+            "compressed_bytes": self.compressed_bytes,
+            "inflated_bytes": self.inflated_bytes,
+            "bytes_read": self.bytes_read,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_ratio": self.cache_hits / lookups if lookups else 0.0,
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+            "seeks": self.seeks,
+            "members_parsed": self.members_parsed,
+            "zlib_seconds": self.zlib_seconds,
+            "io_seconds": self.io_seconds,
+        }
+
+
+class WriterStats(object):
+    def __init__(self):
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+        self.deflate_seconds = 0.0
+        # (uncompressed_bytes, compressed_bytes, deflate_seconds)
+        # of each written member.
+        self.members = []
+
+    def add_member(self, uncompressed_bytes, compressed_bytes,
+            deflate_seconds):
+        self.uncompressed_bytes += uncompressed_bytes
+        self.compressed_bytes += compressed_bytes
+        self.deflate_seconds += deflate_seconds
+        self.members.append((uncompressed_bytes, compressed_bytes,
+            deflate_seconds))
+
+    def snapshot(self):
+        """Returns the totals and the lists of the member ratios
+        and deflate speeds.
+        """
+        return {
+            "members_written": len(self.members),
+            "uncompressed_bytes": self.uncompressed_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "ratio": _ratio(self.compressed_bytes, self.uncompressed_bytes),
+            "deflate_seconds": self.deflate_seconds,
+            "compress_mbps": _mbps(self.uncompressed_bytes,
+                self.deflate_seconds),
+            "member_ratios": [_ratio(compressed, uncompressed)
+                for uncompressed, compressed, seconds in self.members],
+            "member_mbps": [_mbps(uncompressed, seconds)
+                for uncompressed, compressed, seconds in self.members],
+        }
+
+
+def _ratio(compressed, uncompressed):
+    return compressed / float(uncompressed) if uncompressed else 0.0
+
+
+def _mbps(size, seconds):
+    return size / seconds / 1e6 if seconds > 0 else 0.0
+
+
+def _numbers(snapshot):
+    """Yields (name, value) of the numbers in the snapshot.
+    The lists are skipped.
+    """
+    for name in sorted(snapshot):
+        value = snapshot[name]
+        if isinstance(value, (int, float)):
+            yield name, value
+
+
+def prometheus_text(snapshot, prefix="idzip_", labels=None):
+    """Returns the numbers of the snapshot in the Prometheus text format.
+    """
+    label_text = ""
+    if labels:
+        label_text = "{%s}" % ",".join('%s="%s"' % (key, _escape(value))
+                for key, value in sorted(labels.items()))
+    return "".join("%s%s%s %s\n" % (prefix, name, label_text, value)
+            for name, value in _numbers(snapshot))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+            "\n", "\\n")
+
+
+def emit_statsd(snapshot, callback, prefix="idzip."):
+    """Calls callback(name, value) for each number of the snapshot,
+    like a gauge of a StatsD client.
+    """
+    for name, value in _numbers(snapshot):
+        callback(prefix + name, value)
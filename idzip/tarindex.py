@@ -0,0 +1,249 @@
+"""
+Random access to the members of .tar.dz archives.
+
+An index of the regular files maps their names to the uncompressed
+offsets and sizes of their data. The index is built in one pass over
+the archive headers or while writing the archive, and it is stored
+in a sidecar file next to the archive.
+
+The sidecar starts with:
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+|     MAGIC     |  VER  |    MEMCNT     |          ISIZE (8 bytes)      |
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+followed by the zlib compressed entries. Each entry has:
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+=========+
+|         OFFSET (8 bytes)      |          SIZE (8 bytes)       |NAMELEN| NAME    |
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+=========+
+where ISIZE is the uncompressed size of the archive
+and NAME is the UTF-8 encoded member name.
+"""
+
+import io
+import os
+import struct
+import tarfile
+import zlib
+
+from collections import OrderedDict
+
+from idzip.decompressor import IdzipReader
+
+SUFFIX = ".tarindex"
+MAGIC = b"IDZT"
+VERSION = 1
+HEADER_FORMAT = "<4sHIQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ENTRY_FORMAT = "<QQH"
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+
+
+def sidecar_name(filename):
+    return filename + SUFFIX
+
+
+class TarIndex(object):
+    def __init__(self, size=0):
+        """Creates an empty index of an archive
+        of the given uncompressed size.
+        """
+        self.size = size
+        # (offset, size) of the data by the member name.
+        self.members = OrderedDict()
+
+    def add(self, name, offset, size):
+        self.members[name] = (offset, size)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __getitem__(self, name):
+        """Returns (offset, size) of the member data.
+        """
+        try:
+            return self.members[name]
+        except KeyError:
+            raise KeyError("filename %r not found" % name)
+
+    def save(self, filename):
+        entries = []
+        for name, (offset, size) in self.members.items():
+            name = name.encode("utf-8")
+            entries.append(struct.pack(ENTRY_FORMAT, offset, size, len(name)))
+            entries.append(name)
+        with open(filename, "wb") as output:
+            output.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION,
+                len(self.members), self.size))
+            output.write(zlib.compress(b"".join(entries)))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as input:
+            header = input.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise IOError("Truncated tar index: %r" % filename)
+            magic, version, count, size = struct.unpack(HEADER_FORMAT, header)
+            if magic != MAGIC or version != VERSION:
+                raise IOError("Not an idzip tar index: %r" % filename)
+            entries = zlib.decompress(input.read())
+        index = cls(size)
+        pos = 0
+        for _ in range(count):
+            offset, member_size, name_len = struct.unpack_from(ENTRY_FORMAT,
+                    entries, pos)
+            pos += ENTRY_SIZE
+            name = entries[pos:pos + name_len].decode("utf-8")
+            pos += name_len
+            index.add(name, offset, member_size)
+        return index
+
+
+def build(reader):
+    """Returns the index of an archive read by the given reader.
+    Only the chunks with the member headers are decompressed.
+    """
+    index = TarIndex()
+    position = reader.tell()
+    try:
+        reader.seek(0)
+        with tarfile.open(fileobj=reader, mode="r:") as tar:
+            for info in tar:
+                if info.isreg():
+                    index.add(info.name, info.offset_data, info.size)
+        index.size = reader.seek(0, os.SEEK_END)
+    finally:
+        reader.seek(position)
+    return index
+
+
+class IndexingTarFile(tarfile.TarFile):
+    """A tar archive writer recording the index of its members.
+
+    With sidecar, close() saves the index to the sidecar filename.
+    The fileobj is usually an IdzipWriter, its tell() returns
+    the uncompressed offset.
+    """
+    def __init__(self, *args, **kwargs):
+        self.sidecar = kwargs.pop("sidecar", None)
+        tarfile.TarFile.__init__(self, *args, **kwargs)
+        self.index = TarIndex()
+
+    def addfile(self, tarinfo, fileobj=None):
+        tarfile.TarFile.addfile(self, tarinfo, fileobj)
+        if tarinfo.isreg():
+            data_size = 0
+            if fileobj is not None:
+                data_size = -(-tarinfo.size // tarfile.BLOCKSIZE
+                        ) * tarfile.BLOCKSIZE
+            self.index.add(tarinfo.name, self.offset - data_size,
+                    tarinfo.size)
+
+    def close(self):
+        closed = self.closed
+        tarfile.TarFile.close(self)
+        if not closed and self.sidecar is not None:
+            self.index.size = self.fileobj.tell()
+            self.index.save(self.sidecar)
+
+
+class IdzipTarFile(object):
+    def __init__(self, filename=None, reader=None, index=None):
+        """Opens a .tar.dz archive by its filename or reader.
+
+        The index is loaded from the sidecar of the archive
+        or built by reading the member headers,
+        if the sidecar is missing or stale.
+        """
+        if reader is None:
+            reader = IdzipReader(filename)
+        self.reader = reader
+        if index is None:
+            index = self._load_index()
+        self.index = index
+
+    def _load_index(self):
+        name = self.reader.name
+        if name and isinstance(name, str) and os.path.exists(
+                sidecar_name(name)):
+            index = TarIndex.load(sidecar_name(name))
+            position = self.reader.tell()
+            size = self.reader.seek(0, os.SEEK_END)
+            self.reader.seek(position)
+            if index.size == size:
+                return index
+        return build(self.reader)
+
+    def getnames(self):
+        """Returns the names of the regular files.
+        """
+        return list(self.index.members)
+
+    def open_member(self, name):
+        """Returns a read-only file object of the member data.
+        Only the chunks spanned by the member are decompressed.
+        """
+        offset, size = self.index[name]
+        return io.BufferedReader(_MemberFile(self.reader, offset, size))
+
+    def extract(self, name):
+        """Returns the data of the member.
+        """
+        offset, size = self.index[name]
+        self.reader.seek(offset)
+        return self.reader.read(size)
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _MemberFile(io.RawIOBase):
+    """A range of the uncompressed data.
+    The reader is shared, so its position is set before each read.
+    """
+    def __init__(self, reader, offset, size):
+        io.RawIOBase.__init__(self)
+        self._reader = reader
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), self._size - self._pos))
+        if size == 0:
+            return 0
+        self._reader.seek(self._offset + self._pos)
+        data = self._reader.read(size)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError("Unknown whence: %r" % whence)
+        if pos < 0:
+            raise ValueError("Invalid pos: %r" % pos)
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
@@ -0,0 +1,191 @@
+"""
+Recording and replaying the chunk accesses of a reader.
+
+A TraceRecorder given to IdzipReader(trace=...) records each chunk
+lookup in _readchunk(). The trace file starts with MAGIC and VER
+and each access adds a record:
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+|       TIME_NS (8 bytes)       |  CHUNK_INDEX  |HIT|  INFLATE_US   |
++---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+---+
+where INFLATE_US is the time of decompressing a missed chunk.
+
+simulate() replays the accesses against the cache policies
+with several capacities, to size a cache from real traffic.
+mixed_workload() generates the accesses of point lookups
+interrupted by full-file scans, to compare the policies without a trace.
+"""
+
+import random
+import struct
+import threading
+import time
+
+from collections import namedtuple
+
+from idzip import caching
+
+MAGIC = b"IDZR"
+VERSION = 1
+HEADER_FORMAT = "<4sH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+_RECORD = struct.Struct("<QIBI")
+RECORD_SIZE = _RECORD.size
+
+# The records are written in batches of this size.
+BUFFER_RECORDS = 4096
+
+# The chunk capacities simulated by default.
+CAPACITIES = (1, 8, 32, 128, 512)
+
+Access = namedtuple("Access", "time_ns chunk_index hit inflate_seconds")
+SimResult = namedtuple("SimResult",
+        "policy capacity hits misses hit_ratio saved_seconds")
+
+
+class TraceRecorder(object):
+    def __init__(self, filename=None, fileobj=None,
+            buffer_records=BUFFER_RECORDS):
+        """Records the accesses to a filename or a binary fileobj.
+        """
+        if fileobj is None:
+            fileobj = open(filename, "wb")
+            self._should_close = True
+        else:
+            self._should_close = False
+        self._fileobj = fileobj
+        self._buffer_size = buffer_records * RECORD_SIZE
+        self._buffer = bytearray(struct.pack(HEADER_FORMAT, MAGIC, VERSION))
+        self._lock = threading.Lock()
+
+    def record(self, chunk_index, hit, inflate_seconds=0.0):
+        record = _RECORD.pack(time.time_ns(), chunk_index, hit,
+                min(0xffffffff, int(inflate_seconds * 1e6)))
+        with self._lock:
+            self._buffer += record
+            if len(self._buffer) >= self._buffer_size:
+                self._flush()
+
+    def _flush(self):
+        self._fileobj.write(self._buffer)
+        self._buffer = bytearray()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+            self._fileobj.flush()
+
+    def close(self):
+        self.flush()
+        if self._should_close:
+            self._fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_trace(filename):
+    """Yields the Access records of a trace file.
+    """
+    with open(filename, "rb") as input:
+        header = input.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or struct.unpack(HEADER_FORMAT,
+                header) != (MAGIC, VERSION):
+            raise IOError("Not an idzip trace: %r" % filename)
+        while True:
+            data = input.read(BUFFER_RECORDS * RECORD_SIZE)
+            # A partially written record is ignored.
+            for time_ns, chunk_index, hit, inflate_us in _RECORD.iter_unpack(
+                    data[:len(data) - len(data) % RECORD_SIZE]):
+                yield Access(time_ns, chunk_index, bool(hit),
+                        inflate_us / 1e6)
+            if len(data) < BUFFER_RECORDS * RECORD_SIZE:
+                return
+
+
+# The simulated caches store True, so a byte-bounded cache
+# counts the chunks.
+def _one(value):
+    return 1
+
+
+# Cache factories by the policy name. The fixed size policies
+# are simulated once.
+POLICIES = {
+    "zero": (lambda capacity: caching.ZeroCache(), False),
+    "one": (lambda capacity: caching.OneItemCache(), False),
+    "lucky": (caching.LuckyCache, True),
+    "lru": (caching.LRUCache, True),
+    "2q": (lambda capacity: caching.TwoQueueCache(capacity, sizeof=_one),
+        True),
+}
+
+
+def simulate(accesses, policies=None, capacities=CAPACITIES):
+    """Returns a SimResult for each policy and capacity.
+
+    The saved seconds are estimated from the inflate times
+    of the traced misses: of the same chunk if known,
+    or their mean otherwise.
+    """
+    accesses = list(accesses)
+    if policies is None:
+        policies = sorted(POLICIES)
+    inflate_times = {}
+    for access in accesses:
+        if not access.hit:
+            inflate_times.setdefault(access.chunk_index, []).append(
+                    access.inflate_seconds)
+    all_times = [t for times in inflate_times.values() for t in times]
+    mean_time = sum(all_times) / len(all_times) if all_times else 0.0
+    costs = dict((chunk_index, sum(times) / len(times))
+            for chunk_index, times in inflate_times.items())
+
+    results = []
+    for policy in policies:
+        factory, sized = POLICIES[policy]
+        for capacity in (capacities if sized else [None]):
+            cache = factory(capacity)
+            hits = 0
+            saved = 0.0
+            for access in accesses:
+                chunk_index = access.chunk_index
+                if cache.get(chunk_index) is not None:
+                    hits += 1
+                    saved += costs.get(chunk_index, mean_time)
+                else:
+                    cache.put(chunk_index, True)
+            misses = len(accesses) - hits
+            results.append(SimResult(policy, capacity, hits, misses,
+                hits / float(len(accesses)) if accesses else 0.0, saved))
+    return results
+
+
+def mixed_workload(num_chunks=4096, hot_chunks=64, lookups=20000,
+        scan_every=5000, cold_ratio=0.1, inflate_seconds=0.0005, seed=None):
+    """Returns the accesses of point lookups interrupted by scans.
+
+    A lookup reads one of the hot chunks, or a random chunk
+    with the cold_ratio probability. After each scan_every lookups,
+    all chunks are read in order. The hot chunks are spread
+    over the whole file.
+    """
+    rng = random.Random(seed)
+    hot = rng.sample(range(num_chunks), min(hot_chunks, num_chunks))
+    accesses = []
+
+    def access(chunk_index):
+        accesses.append(Access(len(accesses), chunk_index, False,
+            inflate_seconds))
+
+    for i in range(lookups):
+        if rng.random() < cold_ratio:
+            access(rng.randrange(num_chunks))
+        else:
+            access(rng.choice(hot))
+        if scan_every and (i + 1) % scan_every == 0:
+            for chunk_index in range(num_chunks):
+                access(chunk_index)
+    return accesses
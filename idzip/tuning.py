@@ -0,0 +1,125 @@
+"""
+Measures how the chunk length affects a given input.
+
+Short chunks are faster to read at random positions,
+long chunks give a better compression ratio.
+"""
+
+import io
+import os
+import random
+import time
+
+from idzip import caching
+from idzip.compressor import IdzipWriter, CHUNK_LENGTH
+from idzip.decompressor import IdzipReader
+
+CHUNK_LENGTHS = [8192, 16384, 32768, CHUNK_LENGTH]
+
+SAMPLE_SIZE = 16 * 1024 * 1024
+SAMPLE_PIECES = 16
+
+NUM_READS = 1000
+READ_SIZE = 100
+
+# The compressed chunks memoized by measure_memo().
+MEMO_SIZE = 16
+
+
+class TuningResult(object):
+    def __init__(self, chunk_length, ratio, compress_mbps, read_latency):
+        self.chunk_length = chunk_length
+        # The compressed size divided by the input size.
+        self.ratio = ratio
+        self.compress_mbps = compress_mbps
+        # Mean seconds to read READ_SIZE bytes at a random position.
+        self.read_latency = read_latency
+
+    def __repr__(self):
+        return "<TuningResult chunk_length=%s ratio=%.3f %.1f MB/s %.3f ms>" % (
+            self.chunk_length, self.ratio, self.compress_mbps,
+            self.read_latency * 1000)
+
+
+class MemoResult(object):
+    def __init__(self, chunk_cache_size, seconds, compress_mbps, hits,
+            misses):
+        self.chunk_cache_size = chunk_cache_size
+        self.seconds = seconds
+        self.compress_mbps = compress_mbps
+        self.hits = hits
+        self.misses = misses
+
+    def __repr__(self):
+        return ("<MemoResult chunk_cache_size=%s %.1f MB/s hits=%s misses=%s>"
+                % (self.chunk_cache_size, self.compress_mbps, self.hits,
+                    self.misses))
+
+
+def read_sample(input, sample_size=SAMPLE_SIZE, pieces=SAMPLE_PIECES):
+    """Reads evenly spaced pieces of a seekable input.
+    The whole input is returned if it is smaller than the sample size.
+    """
+    input.seek(0, os.SEEK_END)
+    in_size = input.tell()
+    input.seek(0)
+    if in_size <= sample_size:
+        return input.read()
+
+    piece_size = sample_size // pieces
+    step = in_size // pieces
+    sample = []
+    for i in range(pieces):
+        input.seek(i * step)
+        sample.append(input.read(piece_size))
+    return b"".join(sample)
+
+
+def tune(sample, chunk_lengths=CHUNK_LENGTHS, num_reads=NUM_READS,
+        read_size=READ_SIZE, seed=0):
+    """Compresses the sample with each chunk length.
+    Returns a list of TuningResult.
+    """
+    results = []
+    for chunk_length in chunk_lengths:
+        output = io.BytesIO()
+        writer = IdzipWriter(output, mtime=0, chunk_length=chunk_length)
+        start = time.perf_counter()
+        writer.write(sample)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        ratio = len(output.getvalue()) / max(1, len(sample))
+        compress_mbps = len(sample) / max(elapsed, 1e-9) / 1e6
+
+        output.seek(0)
+        reader = IdzipReader(fileobj=output, cache=caching.ZeroCache())
+        rand = random.Random(seed)
+        max_pos = max(0, len(sample) - read_size)
+        start = time.perf_counter()
+        for i in range(num_reads):
+            reader.seek(rand.randint(0, max_pos))
+            reader.read(read_size)
+        read_latency = (time.perf_counter() - start) / max(1, num_reads)
+        results.append(TuningResult(chunk_length, ratio, compress_mbps,
+            read_latency))
+    return results
+
+
+def measure_memo(sample, chunk_cache_size=MEMO_SIZE,
+        chunk_length=CHUNK_LENGTH):
+    """Compresses the sample without and with the memo of compressed chunks.
+    Returns a list of two MemoResult.
+    The memo only helps inputs with repeated chunks.
+    """
+    results = []
+    for size in [0, chunk_cache_size]:
+        writer = IdzipWriter(io.BytesIO(), mtime=0, chunk_length=chunk_length,
+                chunk_cache_size=size)
+        start = time.perf_counter()
+        writer.write(sample)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        results.append(MemoResult(size, elapsed,
+            len(sample) / max(elapsed, 1e-9) / 1e6,
+            writer.chunk_cache_hits, writer.chunk_cache_misses))
+    return results
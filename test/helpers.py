@@ -0,0 +1,40 @@
+import io
+
+from idzip import compressor, decompressor
+
+
+def compress(data, chunk_length=1000, **kwargs):
+    """Returns the writer and the compressed data.
+    The short chunks make small test files with many chunks.
+    """
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, chunk_length=chunk_length,
+            **kwargs)
+    writer.write(data)
+    writer.close()
+    return writer, output.getvalue()
+
+
+def open_reader(data, reader_class=decompressor.IdzipReader, **kwargs):
+    """Returns a reader of the compressed data.
+    The kwargs are passed to compress().
+    """
+    writer, compressed = compress(data, **kwargs)
+    return reader_class(fileobj=io.BytesIO(compressed))
+
+
+class CountingReader(decompressor.IdzipReader):
+    """Records the indexes of the decompressed chunks in self.inflated.
+    The chunks fetched for a search are decompressed by its workers.
+    """
+    def __init__(self, *args, **kwargs):
+        self.inflated = []
+        decompressor.IdzipReader.__init__(self, *args, **kwargs)
+
+    def _uncached_readchunk(self, chunk_index):
+        self.inflated.append(chunk_index)
+        return decompressor.IdzipReader._uncached_readchunk(self, chunk_index)
+
+    def _compressed_chunk(self, chunk_index):
+        self.inflated.append(chunk_index)
+        return decompressor.IdzipReader._compressed_chunk(self, chunk_index)
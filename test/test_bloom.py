@@ -0,0 +1,109 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from nose.tools import eq_
+
+from idzip import bloom, compressor, decompressor
+from .helpers import CountingReader
+
+
+def _log_data():
+    lines = []
+    for i in range(3000):
+        lines.append(b"%08d INFO request served in %d ms\n" % (i, i % 97))
+    lines[1234] = b"00001234 ERROR disk quota exceeded\n"
+    return b"".join(lines)
+
+
+def test_filters():
+    filters = bloom.ChunkFilters(64)
+    filters.add_chunk(b"the first chunk ab")
+    filters.add_chunk(b"cd and the second chunk")
+    filters.add_chunk(b"xyz")
+    filters.finish()
+    eq_(len(filters), 3)
+    offsets = [0, 18, 41]
+    eq_(filters.candidates(b"second", offsets), [1])
+    # The needle crosses the chunk boundary.
+    eq_(filters.candidates(b"abcd", offsets), [0])
+    eq_(filters.candidates(b"chunkxyz", offsets), [1])
+    eq_(filters.candidates(b"no", offsets), [0, 1, 2])
+
+    expected = bloom.build_filter(b"some data to hash", 64)
+    numpy = bloom.numpy
+    bloom.numpy = None
+    try:
+        eq_(bloom.build_filter(b"some data to hash", 64), expected)
+        eq_(filters.candidates(b"abcd", offsets), [0])
+    finally:
+        bloom.numpy = numpy
+
+
+def test_writer_sidecar():
+    data = _log_data()
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "app.log.dz")
+        writer = compressor.IdzipWriter(filename, chunk_length=2048,
+                sync_size=30000, bloom=True)
+        writer.write(data)
+        writer.close()
+        sidecar = bloom.ChunkFilters.load(filename + bloom.SUFFIX)
+        eq_(sidecar.size, len(data))
+        eq_(sidecar.filter_size, 2048 // bloom.FILTER_RATIO)
+
+        reader = CountingReader(filename)
+        matches = list(reader.search(b"ERROR disk", processes=False))
+        eq_(matches, [(data.index(b"ERROR disk"), b"ERROR disk")])
+        assert len(reader.inflated) <= 4, reader.inflated
+        eq_(list(reader.search(b"quota", lines=True, processes=False)),
+                [(data.index(b"00001234"),
+                    b"00001234 ERROR disk quota exceeded\n")])
+
+        # The full scan finds the same.
+        del reader.inflated[:]
+        eq_(list(reader.search(b"ERROR disk", processes=False, bloom=False)),
+                matches)
+        assert len(reader.inflated) > 40
+
+        # A regular expression is searched in all chunks.
+        pattern = b"served in 9[0-9] ms\n"
+        eq_(len(list(reader.search(pattern, processes=False))),
+                len(re.findall(pattern, data)))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_index_command():
+    data = _log_data()
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "app.log.dz")
+        writer = compressor.IdzipWriter(filename, chunk_length=4096)
+        writer.write(data)
+        writer.close()
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([sys.executable, "-m", "idzip.command",
+            "index", "--bloom", filename], cwd=root)
+        filters = bloom.ChunkFilters.load(filename + bloom.SUFFIX)
+        eq_(len(filters), (len(data) + 4095) // 4096)
+
+        reader = decompressor.IdzipReader(filename)
+        offsets = [offset for offset, chunk in reader.iter_chunks()]
+        candidates = filters.candidates(b"00001234 ERROR", offsets)
+        assert data.index(b"00001234") // 4096 in candidates
+        # The previous chunk can hold the start of the needle.
+        assert len(candidates) <= 2, candidates
+        # A stale sidecar is ignored.
+        writer = compressor.IdzipWriter(filename, chunk_length=4096)
+        writer.write(data + b"00009999 ERROR new\n")
+        writer.close()
+        reader = decompressor.IdzipReader(filename)
+        eq_([match.offset for match in reader.search(b"ERROR",
+            processes=False)], [data.index(b"ERROR"), len(data) + 9])
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,48 @@
+import gzip
+import io
+import random
+
+from nose.tools import eq_
+
+from idzip import compressor
+
+
+def duplicate_heavy_data(copies=8, seed=0):
+    """Concatenated copies of the same text, like the README test data."""
+    rand = random.Random(seed)
+    words = [b"windmill", b"knight", b"squire", b"La Mancha", b"\n"]
+    text = bytearray()
+    while len(text) < 2 * compressor.CHUNK_LENGTH:
+        text += rand.choice(words) + b" "
+    # A multiple of the chunk length repeats the chunks exactly.
+    text = bytes(text[:2 * compressor.CHUNK_LENGTH])
+    return text * copies
+
+
+def _compress(data, **kwargs):
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, mtime=0, **kwargs)
+    writer.write(data)
+    writer.close()
+    return writer, output.getvalue()
+
+
+def test_memo_hits():
+    data = duplicate_heavy_data()
+    writer, memoized = _compress(data, chunk_cache_size=4)
+    eq_(writer.chunk_cache_misses, 2)
+    eq_(writer.chunk_cache_hits, 14)
+    eq_(gzip.decompress(memoized), data)
+
+    writer, plain = _compress(data)
+    eq_(writer.chunk_cache_hits, 0)
+    eq_(plain, memoized)
+
+
+def test_memo_is_bounded():
+    data = duplicate_heavy_data()
+    writer, memoized = _compress(data, chunk_cache_size=1)
+    eq_(writer.chunk_cache_hits, 0)
+    eq_(len(writer._chunk_cache), 1)
+    eq_(gzip.decompress(memoized), data)
+
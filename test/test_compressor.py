@@ -6,7 +6,7 @@ import struct
 import os
 from io import BytesIO
 
-from idzip import compressor
+from idzip import compressor, decompressor
 from . import asserting
 
 def test_reserved():
@@ -159,3 +159,16 @@ def _eq_zstream(expected, produced):
     got = deobj.decompress(produced.read())
     produced.seek(-len(deobj.unused_data), os.SEEK_CUR)
     asserting.eq_bytes(expected_data, got)
+
+
+def test_compress_chunk_length():
+    input = open("test/data/medium.txt", "rb")
+    in_size = _inputsize(input)
+    output = BytesIO()
+    compressor.compress(input, in_size, output, "medium.txt", 0,
+            chunk_length=10000)
+    input.seek(0)
+    output.seek(0)
+    reader = decompressor.IdzipFile(fileobj=output)
+    eq_(reader._members[0].chlen, 10000)
+    asserting.eq_files(input, reader)
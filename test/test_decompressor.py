@@ -141,3 +141,23 @@ class EqReader:
         filesize = self.expected_input.tell()
         self.expected_input.seek(self.input.tell())
         return filesize
+
+
+def test_parse_extended_dictzip_field():
+    chlen = 1 << 20
+    zlengths = [450000, 0x12345, 99]
+    isize = 5 * 2 ** 32
+    field = struct.pack("<HHIIQ", 2, 0, chlen, len(zlengths), isize)
+    field += struct.pack("<3I", *zlengths)
+
+    dictzip_field = decompressor._parse_dictzip_field(field)
+    eq_(dictzip_field["chlen"], chlen)
+    eq_(dictzip_field["zlengths"], zlengths)
+    eq_(dictzip_field["isize"], isize)
+
+    for field in [field[:-1], struct.pack("<HH", 3, 0)]:
+        try:
+            decompressor._parse_dictzip_field(field)
+            assert False
+        except IOError as expected:
+            pass
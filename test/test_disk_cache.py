@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from idzip import caching, compressor, diskcache
+from idzip.decompressor import IdzipReader
+from .test_writer import sample_data
+
+
+def test_persistence():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = diskcache.DiskCache(directory, max_bytes=1000, slab_size=100)
+        cache.put("a", 1, b"one")
+        cache.put("b", 1, b"other")
+        # Too long for a slab.
+        cache.put("a", 2, b"x" * 101)
+        eq_(cache.get("a", 2), None)
+        cache.close()
+
+        cache = diskcache.DiskCache(directory, max_bytes=1000, slab_size=100)
+        eq_(cache.get("a", 1), b"one")
+        eq_(cache.get("b", 1), b"other")
+        eq_(cache.get("b", 2), None)
+        eq_((cache.hits, cache.misses), (2, 1))
+        view = cache.view("a")
+        assert 1 in view
+        assert 2 not in view
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_lru_eviction():
+    directory = tempfile.mkdtemp()
+    touch_seconds = diskcache.TOUCH_SECONDS
+    diskcache.TOUCH_SECONDS = 0
+    try:
+        cache = diskcache.DiskCache(directory, max_bytes=300, slab_size=100)
+        for i in range(3):
+            cache.put("f", i, b"%d" % i)
+        eq_(cache.get("f", 0), b"0")
+        cache.put("f", 3, b"3")
+        eq_(len(cache), 3)
+        eq_(cache.get("f", 1), None)
+        eq_([cache.get("f", i) for i in [0, 2, 3]], [b"0", b"2", b"3"])
+        cache.close()
+    finally:
+        diskcache.TOUCH_SECONDS = touch_seconds
+        shutil.rmtree(directory)
+
+
+def test_corrupted_slab():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = diskcache.DiskCache(directory, max_bytes=300, slab_size=100)
+        cache.put("f", 0, b"data")
+        with open(os.path.join(directory, diskcache.SLABS_NAME),
+                "r+b") as output:
+            output.write(b"DATA")
+        eq_(cache.get("f", 0), None)
+        eq_(len(cache), 0)
+        # The slab is reused.
+        cache.put("f", 1, b"new")
+        eq_(cache.get("f", 1), b"new")
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_different_size():
+    directory = tempfile.mkdtemp()
+    try:
+        diskcache.DiskCache(directory, max_bytes=300, slab_size=100).close()
+        try:
+            diskcache.DiskCache(directory, max_bytes=400, slab_size=100)
+            assert False, "the size change should be refused"
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(directory)
+
+
+def _put_chunks(cache):
+    for i in range(5):
+        cache.put("f", i, b"chunk %d" % i)
+
+
+def test_shared_by_processes():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = diskcache.DiskCache(directory, max_bytes=1000, slab_size=100)
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=_put_chunks, args=(cache,))
+        process.start()
+        process.join()
+        eq_(process.exitcode, 0)
+        eq_([cache.get("f", i) for i in range(5)],
+                [b"chunk %d" % i for i in range(5)])
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def _write(filename, data):
+    writer = compressor.IdzipWriter(filename, chunk_length=1000)
+    writer.write(data)
+    writer.close()
+
+
+def _read_all(filename, cache_directory):
+    cache = diskcache.DiskCache(cache_directory)
+    reader = IdzipReader(filename, cache=caching.OneItemCache(), stats=True,
+            disk_cache=cache)
+    data = reader.read()
+    reader.close()
+    cache.close()
+    return data, reader.stats()
+
+
+def test_warm_restart():
+    directory = tempfile.mkdtemp()
+    try:
+        data = sample_data(20000)
+        filename = os.path.join(directory, "data.dz")
+        _write(filename, data)
+        cache_directory = os.path.join(directory, "cache")
+
+        read, cold = _read_all(filename, cache_directory)
+        eq_(read, data)
+        eq_(cold["chunks_inflated"], 20)
+        eq_(cold["disk_misses"], 20)
+        read, warm = _read_all(filename, cache_directory)
+        eq_(read, data)
+        eq_(warm["chunks_inflated"], 0)
+        eq_(warm["disk_hits"], 20)
+
+        # The chunks of a changed file are not reused.
+        _write(filename, data[::-1])
+        os.utime(filename, ns=(0, 0))
+        read, changed = _read_all(filename, cache_directory)
+        eq_(read, data[::-1])
+        eq_(changed["chunks_inflated"], 20)
+    finally:
+        shutil.rmtree(directory)
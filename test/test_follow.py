@@ -0,0 +1,131 @@
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_
+
+from idzip import compressor, decompressor
+from .test_writer import sample_data
+
+
+def _members(data, member_size, **kwargs):
+    """Returns the compressed bytes of each member."""
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, sync_size=member_size,
+            chunk_length=1000, **kwargs)
+    members = []
+    for start in range(0, len(data), member_size):
+        member_pos = output.tell()
+        writer.write(data[start:start + member_size])
+        writer.flush()
+        members.append(output.getvalue()[member_pos:])
+    writer.close()
+    return members
+
+
+def test_refresh_ignores_partial_member():
+    data = sample_data(5000)
+    for version in [1, 2]:
+        members = _members(data, 2000, version=version)
+        complete = members[0]
+        for cut in [1, 10, 30, len(members[1]) // 2, len(members[1]) - 3]:
+            input = io.BytesIO(complete + members[1][:cut])
+            reader = decompressor.IdzipReader(fileobj=input)
+            eq_(reader.read(), data[:2000])
+            eq_(reader.refresh(), 0)
+            eq_(len(reader._members), 1)
+
+            # The writer finishes the member and writes one more.
+            input.seek(0, os.SEEK_END)
+            input.write(members[1][cut:] + members[2])
+            eq_(reader.refresh(), 2)
+            eq_(reader.tell(), 2000)
+            eq_(reader.read(), data[2000:])
+            eq_(reader.refresh(), 0)
+
+
+def test_tail():
+    data = sample_data(9000)
+    members = _members(data, 1500)
+    root = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(root, "log.dz")
+        output = open(filename, "wb")
+        output.write(members[0])
+        output.flush()
+        reader = decompressor.IdzipReader(filename)
+        got = []
+
+        def append():
+            for member in members[1:]:
+                # Each member is written in two parts.
+                output.write(member[:20])
+                output.flush()
+                output.write(member[20:])
+                output.flush()
+            output.close()
+
+        for data_block in reader.tail(poll_interval=0.01, timeout=0.5):
+            got.append(data_block)
+            if len(got) == 1:
+                thread = threading.Thread(target=append)
+                thread.start()
+        thread.join()
+        eq_(b"".join(got), data)
+
+        reader.seek(3000)
+        async def collect():
+            blocks = []
+            async for block in reader.atail(poll_interval=0.01, timeout=0.1):
+                blocks.append(block)
+            return b"".join(blocks)
+        eq_(asyncio.run(collect()), data[3000:])
+        reader.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_partial_first_member():
+    data = sample_data(5000)
+    for version in [1, 2]:
+        members = _members(data, 2000, version=version)
+        for cut in [len(members[0]) // 2, len(members[0]) - 3]:
+            input = io.BytesIO(members[0][:cut])
+            reader = decompressor.IdzipReader(fileobj=input)
+            eq_(reader.read(), b"")
+            eq_(reader.seek(0, os.SEEK_END), 0)
+            eq_(list(reader.tail(poll_interval=0.01, timeout=0)), [])
+            eq_(reader.refresh(), 0)
+
+            # A reader reopened from the index of no members.
+            reopened = decompressor.IdzipReader(fileobj=input,
+                    index=reader.export_index())
+            eq_(reopened.read(), b"")
+
+            input.seek(0, os.SEEK_END)
+            input.write(members[0][cut:] + members[1])
+            eq_(reader.refresh(), 2)
+            eq_(reader.read(), data[:4000])
+            eq_(reopened.refresh(), 2)
+            eq_(reopened.read(), data[:4000])
+
+
+class WalkCountingReader(decompressor.IdzipReader):
+    walks = 0
+
+    def _reach_member_end(self):
+        if self._member_end is None:
+            self.walks += 1
+        decompressor.IdzipReader._reach_member_end(self)
+
+
+def test_member_end_walked_once():
+    data = sample_data(5000)
+    input = io.BytesIO(b"".join(_members(data, 1000)))
+    reader = WalkCountingReader(fileobj=input, use_trailer_index=False)
+    eq_(reader.refresh(), 4)
+    eq_(reader.walks, 5)
+    eq_(reader.read(), data)
@@ -0,0 +1,146 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_
+
+from idzip import decompressor
+from idzip.logwriter import IdzipLogWriter
+
+
+def _records(thread_id, count):
+    return [("thread %s record %s\n" % (thread_id, i)).encode("ascii")
+            for i in range(count)]
+
+
+def test_concurrent_appends():
+    output = io.BytesIO()
+    writer = IdzipLogWriter(output, min_member_size=2000,
+            max_member_size=10000, max_latency=0.01)
+    futures = {}
+
+    def produce(thread_id):
+        for record in _records(thread_id, 500):
+            futures[record] = writer.append(record)
+
+    threads = [threading.Thread(target=produce, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+
+    data = gzip.decompress(output.getvalue())
+    eq_(len(futures), 2000)
+    for record, future in futures.items():
+        offset = future.result(0)
+        eq_(data[offset:offset + len(record)], record)
+
+    output.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output)
+    eq_(reader.read(), data)
+    sizes = [member.isize for member in reader._members]
+    assert max(sizes) <= 10000
+    assert min(sizes[:-1]) >= 2000
+
+
+def test_latency_seal():
+    output = io.BytesIO()
+    writer = IdzipLogWriter(output, min_member_size=10,
+            max_latency=0.01)
+    future = writer.append(b"a record bigger than the minimum\n")
+    eq_(future.result(5), 0)
+    assert len(output.getvalue()) > 0
+    second = writer.append(b"small")
+    writer.close()
+    eq_(second.result(0), 33)
+    eq_(gzip.decompress(output.getvalue()),
+            b"a record bigger than the minimum\nsmall")
+
+
+def test_min_member_size():
+    output = io.BytesIO()
+    writer = IdzipLogWriter(output, min_member_size=1000, max_latency=0)
+    future = writer.append(b"tiny")
+    assert not future.done()
+    eq_(output.getvalue(), b"")
+    writer.close()
+    eq_(future.result(0), 0)
+    eq_(gzip.decompress(output.getvalue()), b"tiny")
+
+    try:
+        writer.append(b"late")
+    except ValueError:
+        pass
+    else:
+        assert False, "Appended to a closed writer."
+
+
+def test_latency_under_steady_appends():
+    output = io.BytesIO()
+    writer = IdzipLogWriter(output, min_member_size=1000,
+            max_latency=0.05, queue_size=16)
+    record = b"x" * 100000
+    first = writer.append(record)
+    stop = threading.Event()
+
+    def produce():
+        while not stop.is_set():
+            writer.append(record)
+
+    threads = [threading.Thread(target=produce) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        eq_(first.result(3), 0)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+
+class FailingOutput(io.BytesIO):
+    def write(self, data):
+        raise IOError("disk full")
+
+
+def test_write_failure():
+    # The member is sealed while writing the record.
+    writer = IdzipLogWriter(FailingOutput(), min_member_size=10,
+            max_member_size=50000)
+    future = writer.append(b"x" * 100000)
+    try:
+        future.result(5)
+    except IOError as e:
+        eq_(str(e), "disk full")
+    else:
+        assert False, "The failure was not reported."
+    try:
+        writer.close()
+    except IOError:
+        pass
+
+
+def test_failure_closes_owned_output():
+    directory = tempfile.mkdtemp()
+    try:
+        writer = IdzipLogWriter(os.path.join(directory, "app.log.dz"),
+                min_member_size=10, max_member_size=50000)
+        writer._writer.output.close()
+        output = writer._writer.output = FailingOutput()
+        future = writer.append(b"x" * 100000)
+        try:
+            future.result(5)
+        except IOError:
+            pass
+        try:
+            writer.close()
+        except IOError:
+            pass
+        assert output.closed
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,56 @@
+from nose.tools import eq_
+
+from .helpers import open_reader
+from .test_writer import sample_data
+
+
+def chunk_summary(offset, data):
+    return offset, bytes(data)
+
+
+def _line_data():
+    lines = []
+    for i in range(300):
+        # Some lines are longer than a chunk.
+        lines.append(b"line %d " % i + b"z" * (i * 37 % 2500) + b"\n")
+    return b"".join(lines) + b"no newline at the end"
+
+
+def test_iter_chunks():
+    data = sample_data(10500)
+    reader = open_reader(data, sync_size=3000)
+    reader.seek(77)
+    chunks = list(reader.iter_chunks())
+    eq_(reader.tell(), 77)
+    eq_([offset for offset, chunk in chunks], list(range(0, 10500, 1000)))
+    assert isinstance(chunks[0][1], memoryview)
+    eq_(b"".join(chunk for offset, chunk in chunks), data)
+
+
+def test_map_chunks():
+    data = sample_data(10500)
+    reader = open_reader(data, sync_size=3000)
+    expected = [(offset, data[offset:offset + 1000])
+            for offset in range(0, 10500, 1000)]
+    eq_(list(reader.map_chunks(chunk_summary, workers=3)), expected)
+    eq_(list(reader.map_chunks(chunk_summary, workers=2, processes=True)),
+            expected)
+    eq_(sorted(reader.map_chunks(chunk_summary, workers=3, ordered=False,
+        max_pending=2)), expected)
+
+
+def test_map_chunks_lines():
+    data = _line_data()
+    reader = open_reader(data, sync_size=7000)
+    for kwargs in [dict(workers=3), dict(workers=2, processes=True),
+            dict(workers=4, ordered=False, max_pending=3)]:
+        pieces = list(reader.map_chunks(chunk_summary, lines=True, **kwargs))
+        if not kwargs.get("ordered", True):
+            pieces.sort()
+        offset = 0
+        for piece_offset, piece in pieces:
+            eq_(piece_offset, offset)
+            eq_(piece, data[offset:offset + len(piece)])
+            assert piece.endswith(b"\n") or offset + len(piece) == len(data)
+            offset += len(piece)
+        eq_(offset, len(data))
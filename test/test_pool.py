@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_
+
+from idzip import caching, compressor, decompressor, pool
+from .test_writer import sample_data
+
+
+def _write_files(root, count, size):
+    files = {}
+    for i in range(count):
+        data = sample_data(size, seed=i)
+        filename = os.path.join(root, "%s.dz" % i)
+        with open(filename, "wb") as output:
+            writer = compressor.IdzipWriter(output, chunk_length=1024,
+                    sync_size=3000)
+            writer.write(data)
+            writer.close()
+        files[filename] = data
+    return files
+
+
+def test_export_index():
+    data = sample_data(10000)
+    root = tempfile.mkdtemp()
+    try:
+        filename = list(_write_files(root, 1, 10000))[0]
+        reader = decompressor.IdzipReader(filename)
+        reader.seek(5000)
+        eq_(reader.read(10), data[5000:5010])
+        index = reader.export_index()
+        assert index.nbytes > 0
+        reader.close()
+
+        reopened = decompressor.IdzipReader(filename, index=index)
+        eq_(len(reopened._members), len(index.members))
+        eq_(reopened.read(), data)
+        # The snapshot is not changed by the reader.
+        assert len(reopened._chunks) > len(index.chunks)
+        reopened.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_reader_pool():
+    root = tempfile.mkdtemp()
+    try:
+        files = _write_files(root, 6, 10000)
+        readers = pool.ReaderPool(max_handles=2, max_index_bytes=1 << 20,
+                chunk_cache=caching.SharedLRUCache(1 << 20))
+        for round in range(3):
+            for filename, data in sorted(files.items()):
+                eq_(readers.read(filename, 4000 + round, 100),
+                        data[4000 + round:4100 + round])
+                eq_(readers.size(filename), len(data))
+        eq_(len(readers), 2)
+        eq_(readers.opens, 18)
+        eq_(len(readers.indexes), 6)
+
+        # A changed file is reopened with a new index.
+        filename = sorted(files)[0]
+        data = _write_files(root, 1, 5000)[filename]
+        os.utime(filename, (0, 0))
+        eq_(readers.read(filename, 0), data)
+        readers.close()
+        eq_(len(readers), 0)
+    finally:
+        shutil.rmtree(root)
+
+
+def test_reader_pool_threads():
+    root = tempfile.mkdtemp()
+    try:
+        files = _write_files(root, 8, 10000)
+        readers = pool.ReaderPool(max_handles=3)
+        names = sorted(files)
+        errors = []
+
+        def run(seed):
+            try:
+                for i in range(200):
+                    filename = names[(seed + i * 7) % len(names)]
+                    offset = (seed * 131 + i * 977) % 9900
+                    eq_(readers.read(filename, offset, 100),
+                            files[filename][offset:offset + 100])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(seed,))
+                for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(errors, [])
+        readers.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_reopen_incomplete_file():
+    root = tempfile.mkdtemp()
+    try:
+        files = _write_files(root, 2, 10000)
+        partial, other = sorted(files)
+        with open(partial, "rb") as input:
+            compressed = input.read()
+        with open(partial, "wb") as output:
+            # The first member is still being written.
+            output.write(compressed[:100])
+        readers = pool.ReaderPool(max_handles=1)
+        eq_(readers.read(partial, 0), b"")
+        eq_(readers.read(other, 0, 10), files[other][:10])
+        # Reopened from the cached index without members.
+        eq_(readers.read(partial, 0), b"")
+        eq_(readers.opens, 3)
+        readers.close()
+    finally:
+        shutil.rmtree(root)
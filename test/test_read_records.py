@@ -0,0 +1,68 @@
+import io
+import random
+import struct
+
+from nose.tools import eq_
+
+from idzip import compressor, decompressor
+
+
+def _write_records(count, record_size, chunk_length):
+    records = [bytes(bytearray((i * 7 + j) % 256 for j in range(record_size)))
+            for i in range(count)]
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, chunk_length=chunk_length,
+            sync_size=10 * chunk_length + 3)
+    writer.write(b"".join(records))
+    writer.close()
+    output.seek(0)
+    return records, decompressor.IdzipReader(fileobj=output)
+
+
+def _check_records(numpy_module):
+    saved = decompressor.numpy
+    decompressor.numpy = numpy_module
+    try:
+        # Some records span chunks and members.
+        records, reader = _write_records(5000, 12, 1000)
+        rand = random.Random(0)
+        indices = [rand.randrange(len(records)) for i in range(700)]
+        indices += [0, len(records) - 1, 83, 83]
+        reader.seek(17)
+        got = reader.read_records(12, indices)
+        eq_(reader.tell(), 17)
+        eq_([bytes(bytearray(record)) for record in got],
+                [records[i] for i in indices])
+        eq_(len(reader.read_records(12, [])), 0)
+
+        for bad_indices, error in [([len(records)], IndexError),
+                ([-1], ValueError)]:
+            try:
+                reader.read_records(12, bad_indices)
+            except error:
+                pass
+            else:
+                assert False, "Accepted %r" % bad_indices
+    finally:
+        decompressor.numpy = saved
+
+
+def test_read_records_without_numpy():
+    _check_records(None)
+
+
+def test_read_records_with_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return
+    _check_records(numpy)
+
+    records, reader = _write_records(3000, 8, 4096)
+    dtype = numpy.dtype([("id", "<u4"), ("value", "<f4")])
+    got = reader.read_records(8, numpy.array([5, 2999, 5]), dtype=dtype)
+    eq_(got.shape, (3,))
+    expected = struct.unpack("<If", records[2999])
+    eq_(int(got["id"][1]), expected[0])
+    eq_(float(got["value"][1]), expected[1])
+    eq_(int(got["id"][0]), int(got["id"][2]))
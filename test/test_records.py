@@ -0,0 +1,104 @@
+import gzip
+import io
+import random
+
+from nose.tools import eq_
+
+from idzip import compressor, decompressor
+
+
+class CountingCache(object):
+    """Counts the decompressed chunks."""
+    def __init__(self):
+        self.decompressed = 0
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        self.decompressed += 1
+
+
+def _records(count, seed=0):
+    rand = random.Random(seed)
+    return [("record %s %s\n" % (i, "x" * rand.randint(0, 300))).encode()
+            for i in range(count)]
+
+
+def _write(data, write_size, **kwargs):
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, **kwargs)
+    for start in range(0, len(data), write_size):
+        writer.write(data[start:start + write_size])
+    writer.close()
+    output.seek(0)
+    return output
+
+
+def test_record_delimiter():
+    records = _records(2000)
+    data = b"".join(records)
+    for write_size in [1, 100, 5000, len(data)]:
+        output = _write(data, write_size, chunk_length=4096,
+                record_delimiter=b"\n")
+        eq_(gzip.decompress(output.getvalue()), data)
+        reader = decompressor.IdzipReader(fileobj=output)
+        eq_(reader.read(), data)
+        member = reader._members[0]
+        lengths = [end - start for start, end in
+                zip(member.chunk_starts, member.chunk_starts[1:])]
+        assert max(lengths) <= 4096
+        assert sum(lengths) == len(data)
+
+    # Each record is read from one chunk.
+    cache = CountingCache()
+    output.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output, cache=cache)
+    pos = 0
+    for record in records:
+        cache.decompressed = 0
+        reader.seek(pos)
+        eq_(reader.read(len(record)), record)
+        eq_(cache.decompressed, 1)
+        pos += len(record)
+
+
+def test_long_records_and_members():
+    data = b"short\n" + b"y" * 10000 + b"\nend"
+    output = _write(data, 333, chunk_length=4096, record_delimiter=b"\n",
+            sync_size=7000)
+    eq_(gzip.decompress(output.getvalue()), data)
+    reader = decompressor.IdzipReader(fileobj=output)
+    reader.seek(4000)
+    eq_(reader.read(5000), data[4000:9000])
+    reader.seek(6990)
+    eq_(reader.read(), data[6990:])
+    eq_(reader.seek(0, 2), len(data))
+
+
+def test_record_delimiter_trailer_index():
+    data = b"".join(_records(3000, seed=1))
+    output = _write(data, 10000, chunk_length=2000, record_delimiter=b"\n",
+            sync_size=100000, trailer_index=True)
+    reader = decompressor.IdzipReader(fileobj=output)
+    assert reader._index_complete
+    reader.seek(123456)
+    eq_(reader.read(1000), data[123456:124456])
+    eq_(reader.readline(), data[124456:data.index(b"\n", 124456) + 1])
+
+
+def test_record_size():
+    data = bytes(bytearray(range(256))) * 1000
+    output = _write(data, 1000, chunk_length=4096, record_size=100)
+    reader = decompressor.IdzipReader(fileobj=output)
+    eq_(reader._members[0].chlen, 4000)
+    reader.seek(3900)
+    eq_(reader.read(100), data[3900:4000])
+
+    try:
+        compressor.IdzipWriter(io.BytesIO(), chunk_length=4096,
+                record_size=5000)
+    except ValueError:
+        pass
+    else:
+        assert False, "Accepted a record longer than a chunk"
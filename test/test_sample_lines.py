@@ -0,0 +1,67 @@
+from nose.tools import eq_
+
+from idzip import decompressor
+from .helpers import CountingReader, open_reader
+
+
+def _reader(data):
+    return open_reader(data, CountingReader, sync_size=20000)
+
+
+def _lines(count):
+    lines = []
+    for i in range(count):
+        # Every 10th line is long, some are longer than a chunk.
+        length = 1500 if i % 10 == 0 else 20
+        lines.append(b"%06d " % i + b"x" * length + b"\n")
+    return lines
+
+
+def test_sample_lines():
+    lines = _lines(2000)
+    data = b"".join(lines)
+    reader = _reader(data)
+    sample = reader.sample_lines(50, seed=1)
+    eq_(len(sample), 50)
+    eq_(sample, sorted(sample))
+    for offset, line in sample:
+        assert line in lines
+        eq_(data[offset:offset + len(line)], line)
+    # The chunks are decompressed once per round of drawing.
+    assert len(reader.inflated) < 1.5 * len(set(reader.inflated))
+    assert len(set(reader.inflated)) < 200
+
+    eq_(reader.sample_lines(50, seed=1), sample)
+    assert reader.sample_lines(50, seed=2) != sample
+
+
+def test_unbiased():
+    lines = _lines(2000)
+    reader = _reader(b"".join(lines))
+    # The long lines have 88% of the bytes and 10% of the lines.
+    biased = reader.sample_lines(200, seed=3)
+    long_biased = sum(1 for offset, line in biased if len(line) > 100)
+    assert long_biased > 120, long_biased
+    unbiased = reader.sample_lines(200, seed=3, unbiased=True)
+    eq_(len(unbiased), 200)
+    long_unbiased = sum(1 for offset, line in unbiased if len(line) > 100)
+    assert long_unbiased < 50, long_unbiased
+
+
+def test_small_file():
+    reader = _reader(b"one\ntwo\nthree")
+    eq_(reader.sample_lines(10, seed=0), [(0, b"one\n"), (4, b"two\n"),
+        (8, b"three")])
+    eq_(reader.sample_lines(0), [])
+    eq_(_reader(b"").sample_lines(3), [])
+
+
+def test_more_than_all_lines():
+    lines = _lines(1000)
+    reader = _reader(b"".join(lines))
+    sample = reader.sample_lines(2000, seed=4)
+    assert 900 < len(sample) <= 1000, len(sample)
+    eq_(len(set(offset for offset, line in sample)), len(sample))
+    # The drawing stops before using all rounds.
+    assert (len(reader.inflated) <
+            decompressor.SAMPLE_ROUNDS // 2 * len(set(reader.inflated)))
@@ -0,0 +1,94 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from nose.tools import eq_
+
+from idzip import compressor, searching
+from .helpers import open_reader
+from .test_writer import sample_data
+
+
+def _expected(pattern, data):
+    regex = searching.compile_pattern(pattern)
+    return [(match.start(), match.group()) for match in regex.finditer(data)]
+
+
+def test_search():
+    data = sample_data(30000)
+    reader = open_reader(data, sync_size=7000)
+    for pattern in [b"member chunk", b"gzip\n", b"\n \n", b"^idzip"]:
+        matches = list(reader.search(pattern, workers=2, processes=False))
+        eq_(matches, _expected(pattern, data))
+        assert all(isinstance(match, searching.Match) for match in matches)
+
+
+def test_search_processes():
+    data = sample_data(20000, seed=3)
+    reader = open_reader(data)
+    pattern = re.compile(b"dictzip (gzip|chunk)")
+    eq_(list(reader.search(pattern, workers=2)), _expected(pattern, data))
+
+
+def test_overlap():
+    data = b"x" * 997 + b"needle" + b"x" * 2000
+    reader = open_reader(data)
+    eq_(list(reader.search(b"needle", processes=False)), [(997, b"needle")])
+    eq_(list(reader.search(b"needle", overlap=2, processes=False)), [])
+    # A match seen by two windows is reported once.
+    reader = open_reader(b"y" * 990 + b"x" * 20 + b"y" * 2000)
+    eq_(list(reader.search(b"x+", processes=False)), [(990, b"x" * 20)])
+
+
+def test_search_lines():
+    lines = []
+    for i in range(200):
+        lines.append(b"line %d " % i + b"a" * (i * 41 % 1800) + b"\n")
+    data = b"".join(lines) + b"last line 7"
+    reader = open_reader(data, sync_size=5000)
+    matches = list(reader.search(b"7 ", lines=True, workers=2,
+        processes=False))
+    expected = []
+    offset = 0
+    for line in data.splitlines(True):
+        if b"7 " in line:
+            expected.append((offset, line))
+        offset += len(line)
+    eq_(matches, expected)
+    eq_(list(reader.search(b"last", lines=True, processes=False)),
+            [(len(data) - 11, b"last line 7")])
+
+
+def test_grep_command():
+    data = b"first line\nsecond needle line\nthird line\n" * 3
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "data.dz")
+    try:
+        with open(filename, "wb") as output:
+            writer = compressor.IdzipWriter(output, chunk_length=16)
+            writer.write(data)
+            writer.close()
+        command = [sys.executable, "-m", "idzip.command", "grep", "-b",
+                "-F", "needle", filename]
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(command, cwd=root)
+        eq_(output, b"11:second needle line\n52:second needle line\n"
+                b"93:second needle line\n")
+        process = subprocess.Popen(command[:-2] + ["missing", filename],
+                cwd=root, stdout=subprocess.PIPE)
+        eq_(process.communicate()[0], b"")
+        eq_(process.returncode, 1)
+    finally:
+        os.unlink(filename)
+        os.rmdir(directory)
+
+
+def test_windows_start_at_lines():
+    # The second chunk starts in the middle of a line.
+    data = b"a" * 1000 + b"b\n" + b"b line\n" + b"c" * 1500 + b"\nb end\n"
+    reader = open_reader(data)
+    for pattern in [b"^b", b"(?<=a)b", b"(?<!a)b\\b", b"^c+$"]:
+        eq_(list(reader.search(pattern, processes=False)),
+                _expected(pattern, data))
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import eq_
+
+try:
+    from http import client as http_client
+except ImportError:
+    import httplib as http_client
+
+from idzip import compressor, server
+from .test_writer import sample_data
+
+
+def _write_file(directory, name, data):
+    with open(os.path.join(directory, name), "wb") as output:
+        writer = compressor.IdzipWriter(output, chunk_length=4096)
+        writer.write(data)
+        writer.close()
+
+
+class RunningServer(object):
+    """Runs a RangeServer in a background event loop."""
+    def __init__(self, root, **kwargs):
+        self.server = server.RangeServer(root, port=0, **kwargs)
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.server.start())
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+        started.wait()
+
+    def connect(self):
+        return http_client.HTTPConnection("127.0.0.1", self.server.port,
+                timeout=10)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close_listener)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks,
+                    return_exceptions=True))
+        self.loop.close()
+        self.server.close()
+
+
+def _get(connection, path, headers=None):
+    connection.request("GET", path, headers=headers or {})
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_parse_range():
+    eq_(server.parse_range("bytes=0-9", 100), [(0, 9)])
+    eq_(server.parse_range("bytes=90-", 100), [(90, 99)])
+    eq_(server.parse_range("bytes=-5", 100), [(95, 99)])
+    eq_(server.parse_range("bytes=95-200, 0-0", 100), [(95, 99), (0, 0)])
+    eq_(server.parse_range("bytes=100-", 100), None)
+    for header in ["items=0-1", "bytes=5", "bytes=9-2", "bytes=a-b",
+            "bytes=5--3", "bytes=-", "bytes=+1-2", "bytes=1-2-3"]:
+        try:
+            server.parse_range(header, 100)
+        except ValueError:
+            pass
+        else:
+            assert False, "Accepted range %r" % header
+
+
+def test_serve_ranges():
+    root = tempfile.mkdtemp()
+    data = sample_data(50000)
+    other = sample_data(9000, seed=1)
+    try:
+        _write_file(root, "data.txt.dz", data)
+        os.mkdir(os.path.join(root, "sub"))
+        _write_file(os.path.join(root, "sub"), "other.dz", other)
+        running = RunningServer(root, cache_size=1 << 20)
+        try:
+            connection = running.connect()
+            # The requests share one kept alive connection.
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=10000-10099"})
+            eq_(response.status, 206)
+            eq_(response.getheader("Content-Range"), "bytes 10000-10099/50000")
+            eq_(body, data[10000:10100])
+
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=-10"})
+            eq_(body, data[-10:])
+
+            response, body = _get(connection, "/sub/other.dz")
+            eq_(response.status, 200)
+            eq_(body, other)
+
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=0-4,40000-40009"})
+            eq_(response.status, 206)
+            content_type = response.getheader("Content-Type")
+            assert content_type.startswith("multipart/byteranges")
+            assert b"Content-Range: bytes 0-4/50000\r\n\r\n" + data[:5] in body
+            assert (b"Content-Range: bytes 40000-40009/50000\r\n\r\n" +
+                    data[40000:40010]) in body
+
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=60000-"})
+            eq_(response.status, 416)
+            eq_(response.getheader("Content-Range"), "bytes */50000")
+
+            for path in ["/missing.dz", "/../etc/passwd", "/sub"]:
+                response, body = _get(connection, path)
+                eq_(response.status, 404)
+
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=10000-10099"})
+            eq_(body, data[10000:10100])
+
+            response, body = _get(connection, server.METRICS_PATH)
+            eq_(response.status, 200)
+            metrics = dict(line.split(" ") for line in
+                    body.decode("ascii").splitlines())
+            eq_(metrics["idzip_open_handles"], "2")
+            assert float(metrics["idzip_cache_hits_total"]) > 0
+            assert int(metrics["idzip_requests_total"]) >= 9
+            connection.close()
+        finally:
+            running.stop()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_reopen_changed_file():
+    root = tempfile.mkdtemp()
+    try:
+        _write_file(root, "data.dz", b"first version")
+        running = RunningServer(root, max_handles=1)
+        try:
+            connection = running.connect()
+            eq_(_get(connection, "/data.dz")[1], b"first version")
+            _write_file(root, "data.dz", b"the second version")
+            os.utime(os.path.join(root, "data.dz"), (0, 0))
+            eq_(_get(connection, "/data.dz")[1], b"the second version")
+            eq_(len(running.server.pool), 1)
+            connection.close()
+        finally:
+            running.stop()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_bounded_ranges():
+    root = tempfile.mkdtemp()
+    data = sample_data(50000)
+    send_size = server.SEND_SIZE
+    server.SEND_SIZE = 1000
+    try:
+        _write_file(root, "data.txt.dz", data)
+        running = RunningServer(root, cache_size=1 << 20)
+        try:
+            connection = running.connect()
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=1234-45677"})
+            eq_(response.status, 206)
+            eq_(body, data[1234:45678])
+
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=0-4,40000-40009"})
+            eq_(int(response.getheader("Content-Length")), len(body))
+            assert data[40000:40010] in body
+
+            # Too many ranges are answered by one covering range.
+            specs = ",".join("%s-%s" % (i, i) for i in
+                    range(100, 100 + 2 * (server.MAX_RANGES + 1), 2))
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=" + specs})
+            eq_(response.status, 206)
+            last = 100 + 2 * server.MAX_RANGES
+            eq_(response.getheader("Content-Range"),
+                    "bytes 100-%s/50000" % last)
+            eq_(body, data[100:last + 1])
+            connection.close()
+        finally:
+            running.stop()
+    finally:
+        server.SEND_SIZE = send_size
+        shutil.rmtree(root)
+
+
+def test_failure_after_headers():
+    root = tempfile.mkdtemp()
+    data = sample_data(50000)
+    send_size = server.SEND_SIZE
+    server.SEND_SIZE = 1000
+    try:
+        _write_file(root, "data.txt.dz", data)
+        running = RunningServer(root, cache_size=1 << 20)
+        try:
+            connection = running.connect()
+            response, body = _get(connection, "/data.txt.dz",
+                    {"Range": "bytes=5--3"})
+            eq_(response.status, 400)
+
+            pool_read = running.server.pool.read
+
+            def failing_read(filename, offset, size=-1):
+                if offset >= 2000:
+                    raise IOError("Broken file")
+                return pool_read(filename, offset, size)
+
+            running.server.pool.read = failing_read
+            connection.request("GET", "/data.txt.dz")
+            response = connection.getresponse()
+            eq_(response.status, 200)
+            try:
+                response.read()
+            except http_client.IncompleteRead as e:
+                eq_(e.partial, data[:2000])
+            else:
+                assert False, "The connection was not closed"
+            connection.close()
+            eq_(running.server.metrics.errors, 2)
+        finally:
+            running.stop()
+    finally:
+        server.SEND_SIZE = send_size
+        shutil.rmtree(root)
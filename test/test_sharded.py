@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import eq_
+
+from idzip import compressor, sharded
+from .test_writer import sample_data
+
+
+def count_lines(reader):
+    return reader.read().count(b"\n")
+
+
+def _write_shards(root, sizes):
+    data = []
+    for i, size in enumerate(sizes):
+        shard = sample_data(size, seed=i)
+        with open(os.path.join(root, "part-%04d.dz" % i), "wb") as output:
+            writer = compressor.IdzipWriter(output, chunk_length=1000,
+                    sync_size=3000)
+            writer.write(shard)
+            writer.close()
+        data.append(shard)
+    return data
+
+
+def test_sharded_read():
+    root = tempfile.mkdtemp()
+    try:
+        shards = _write_shards(root, [5000, 0, 1234, 7000, 1])
+        data = b"".join(shards)
+        reader = sharded.ShardedIdzipReader(os.path.join(root, "part-*.dz"),
+                max_open=2)
+        eq_(len(reader.shards), 5)
+        for pos, size in [(0, 10), (4995, 10), (4990, 3000), (6234, 7001),
+                (0, len(data) + 5), (len(data), 1), (len(data) + 3, 1)]:
+            reader.seek(pos)
+            eq_(reader.read(size), data[pos:pos + size])
+            eq_(reader.tell(), min(pos + size, max(pos, len(data))))
+        eq_(reader.shard_offsets(), [0, 5000, 5000, 6234, 13234])
+        eq_(reader.seek(-5, os.SEEK_END), len(data) - 5)
+        eq_(reader.read(), data[-5:])
+        assert len(reader._pool) <= 2
+        reader.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_sharded_readline():
+    root = tempfile.mkdtemp()
+    try:
+        shards = _write_shards(root, [20000, 3000, 50000])
+        data = b"".join(shards)
+        filenames = sorted(os.path.join(root, name)
+                for name in os.listdir(root))
+        with sharded.ShardedIdzipReader(filenames) as reader:
+            eq_(list(reader), data.splitlines(True))
+            reader.seek(19990)
+            eq_(reader.readline(5), data[19990:19995])
+    finally:
+        shutil.rmtree(root)
+
+
+def test_map_shards():
+    root = tempfile.mkdtemp()
+    try:
+        shards = _write_shards(root, [5000, 8000, 100, 30000])
+        expected = [shard.count(b"\n") for shard in shards]
+        reader = sharded.ShardedIdzipReader(os.path.join(root, "*.dz"))
+        eq_(list(reader.map_shards(count_lines, workers=2)), expected)
+        eq_(list(reader.map_shards(count_lines, workers=3, processes=False)),
+                expected)
+        reader.close()
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,137 @@
+import io
+import os
+import re
+import tempfile
+import threading
+
+from nose.tools import eq_
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from idzip import caching, compressor, decompressor, sources
+from .test_writer import sample_data
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves the server.data bytes with single range requests."""
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        data = self.server.data
+        match = re.match(r"bytes=(\d+)-(\d+)$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(data) - 1)
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range",
+                    "bytes %s-%s/%s" % (start, end, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(data):
+    server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.data = data
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _compress(data, **kwargs):
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, **kwargs)
+    writer.write(data)
+    writer.close()
+    return output.getvalue()
+
+
+def test_coalesce_ranges():
+    ranges = [(100, 10), (0, 50), (50, 20), (200, 5)]
+    eq_(sources.coalesce_ranges(ranges),
+            [(0, 70, [1, 2]), (100, 10, [0]), (200, 5, [3])])
+    eq_(sources.coalesce_ranges(ranges, max_gap=30),
+            [(0, 110, [1, 2, 0]), (200, 5, [3])])
+
+
+def test_local_sources():
+    data = sample_data(10 * 4096)
+    compressed = _compress(data, chunk_length=4096)
+    fd, filename = tempfile.mkstemp(suffix=".dz")
+    os.write(fd, compressed)
+    os.close(fd)
+    try:
+        for source in [sources.FileSource(filename),
+                sources.MmapSource(filename)]:
+            with source:
+                eq_(source.size(), len(compressed))
+                eq_(source.read_at(5, 10), compressed[5:15])
+                eq_(source.read_many([(20, 5), (0, 3)]),
+                        [compressed[20:25], compressed[:3]])
+                reader = decompressor.IdzipReader(source=source)
+                reader.seek(3 * 4096 - 10)
+                eq_(reader.read(5 * 4096), data[3 * 4096 - 10:][:5 * 4096])
+                reader.close()
+            # The reader closes its source.
+            if isinstance(source, sources.MmapSource):
+                eq_(source._mmap, None)
+    finally:
+        os.remove(filename)
+
+
+def test_prefetch_does_not_count_lookups():
+    data = sample_data(10 * 4096)
+    for cache in [caching.SharedLRUCache(1 << 20),
+            caching.TwoQueueCache(1 << 20)]:
+        reader = decompressor.IdzipReader(
+                fileobj=io.BytesIO(_compress(data, chunk_length=4096)),
+                cache=cache.view("data"))
+        for hits in [0, 6]:
+            reader.seek(2 * 4096)
+            eq_(reader.read(6 * 4096), data[2 * 4096:8 * 4096])
+            eq_((cache.hits, cache.misses), (hits, 6))
+
+
+def test_http_source():
+    data = sample_data(20 * 4096)
+    compressed = _compress(data, chunk_length=4096, sync_size=8 * 4096,
+            trailer_index=True)
+    server = serve(compressed)
+    try:
+        url = "http://127.0.0.1:%s/data.dz" % server.server_port
+        source = sources.HttpRangeSource(url)
+        eq_(source.size(), len(compressed))
+        eq_(source.read_at(10, 20), compressed[10:30])
+
+        reader = decompressor.IdzipReader(source=source)
+        eq_(reader.seek(0, os.SEEK_END), len(data))
+        opened = source.requests
+
+        # The chunks of a read are fetched by one request.
+        reader.seek(4096 + 100)
+        eq_(reader.read(5 * 4096), data[4096 + 100:][:5 * 4096])
+        eq_(source.requests, opened + 1)
+        reader.seek(0)
+        eq_(reader.read(), data)
+        source.close()
+    finally:
+        server.shutdown()
+        server.server_close()
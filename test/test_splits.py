@@ -0,0 +1,85 @@
+import io
+import pickle
+
+from nose.tools import eq_
+
+from idzip import decompressor
+from .helpers import CountingReader, compress, open_reader
+
+
+def _line_data():
+    lines = []
+    for i in range(400):
+        # Some lines are longer than a chunk.
+        lines.append(b"line %d " % i + b"y" * (i * 53 % 2200) + b"\n")
+    return b"".join(lines) + b"no newline at the end"
+
+
+def _read_split(compressed, split):
+    # A worker opens the file by itself.
+    start, end = split
+    reader = decompressor.IdzipReader(fileobj=io.BytesIO(compressed))
+    reader.seek(start)
+    return reader.read(end - start)
+
+
+def test_line_splits():
+    data = _line_data()
+    writer, compressed = compress(data, sync_size=7000)
+    reader = decompressor.IdzipReader(fileobj=io.BytesIO(compressed))
+    reader.seek(123)
+    splits = reader.splits(8)
+    eq_(reader.tell(), 123)
+    eq_(len(splits), 8)
+    eq_(splits[0][0], 0)
+    eq_(splits[-1][1], len(data))
+    for (start, end), (next_start, next_end) in zip(splits, splits[1:]):
+        eq_(end, next_start)
+        eq_(data[next_start - 1:next_start], b"\n")
+    for start, end in splits:
+        assert abs((end - start) - len(data) / 8.0) < 0.3 * len(data) / 8.0
+
+    splits = pickle.loads(pickle.dumps(splits))
+    eq_(b"".join(_read_split(compressed, split) for split in splits), data)
+
+
+def test_chunk_splits():
+    data = _line_data()
+    reader = open_reader(data)
+    splits = reader.splits(5, align=None)
+    eq_(len(splits), 5)
+    chunk_offsets = set(offset for offset, chunk in reader.iter_chunks())
+    for start, end in splits:
+        assert start in chunk_offsets
+
+
+def test_few_splits():
+    data = b"a single line without a newline" * 100
+    reader = open_reader(data)
+    eq_(reader.splits(4), [(0, len(data))])
+    eq_(reader.splits(1), [(0, len(data))])
+
+    reader = open_reader(b"")
+    eq_(reader.splits(3), [])
+
+    for args in [(0,), (2, "word")]:
+        try:
+            reader.splits(*args)
+        except ValueError:
+            pass
+        else:
+            assert False, "Accepted %r" % (args,)
+
+
+def test_splits_at_line_starts():
+    # Each chunk ends with a newline.
+    data = (b"x" * 999 + b"\n") * 8
+    reader = open_reader(data, CountingReader)
+    eq_(reader.splits(4), [(0, 2000), (2000, 4000), (4000, 6000),
+        (6000, 8000)])
+    # Only the chunk before each boundary is decompressed.
+    eq_(reader.inflated, [1, 3, 5])
+
+    reader = open_reader((b"y" * 299 + b"\n") * 30, CountingReader)
+    eq_(reader.splits(3), [(0, 3000), (3000, 6000), (6000, 9000)])
+    eq_(reader.inflated, [2, 5])
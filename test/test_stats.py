@@ -0,0 +1,64 @@
+import io
+
+from nose.tools import eq_
+
+from idzip import caching, decompressor, stats
+from .helpers import compress
+from .test_writer import sample_data
+
+
+def _write(data, **kwargs):
+    return compress(data, sync_size=10000, **kwargs)
+
+
+def test_reader_stats():
+    data = sample_data(25000)
+    writer, compressed = _write(data)
+    reader = decompressor.IdzipReader(fileobj=io.BytesIO(compressed),
+            cache=caching.OneItemCache(), stats=True)
+    reader.seek(1500)
+    eq_(reader.read(100), data[1500:1600])
+    eq_(reader.read(100), data[1600:1700])
+    reader.seek(24000)
+    eq_(reader.read(), data[24000:])
+
+    snapshot = reader.stats()
+    eq_(snapshot["seeks"], 2)
+    eq_(snapshot["bytes_read"], 1200)
+    eq_(snapshot["chunks_inflated"], 2)
+    eq_(snapshot["inflated_bytes"], 2000)
+    assert 0 < snapshot["compressed_bytes"] < 2000
+    eq_(snapshot["cache_hits"], 1)
+    # The members were parsed up to the end.
+    eq_(snapshot["members_parsed"], 3)
+    assert 0 < snapshot["cache_hit_ratio"] < 1
+    assert snapshot["zlib_seconds"] > 0
+
+    reader = decompressor.IdzipReader(fileobj=io.BytesIO(compressed))
+    eq_(reader.stats(), None)
+
+
+def test_writer_stats():
+    data = sample_data(25000)
+    writer, compressed = _write(data, stats=True)
+    snapshot = writer.stats()
+    eq_(snapshot["members_written"], 3)
+    eq_(snapshot["uncompressed_bytes"], len(data))
+    assert snapshot["compressed_bytes"] < len(compressed)
+    assert 0 < snapshot["ratio"] < 1
+    eq_(len(snapshot["member_ratios"]), 3)
+    assert snapshot["compress_mbps"] > 0
+    eq_(_write(data)[0].stats(), None)
+
+
+def test_export():
+    snapshot = {"bytes_read": 10, "cache_hit_ratio": 0.5, "list": [1, 2]}
+    eq_(stats.prometheus_text(snapshot),
+            "idzip_bytes_read 10\nidzip_cache_hit_ratio 0.5\n")
+    eq_(stats.prometheus_text(snapshot, labels={"file": 'a"b'}),
+            'idzip_bytes_read{file="a\\"b"} 10\n'
+            'idzip_cache_hit_ratio{file="a\\"b"} 0.5\n')
+    sent = []
+    stats.emit_statsd(snapshot, lambda name, value: sent.append((name, value)),
+            prefix="dict.")
+    eq_(sent, [("dict.bytes_read", 10), ("dict.cache_hit_ratio", 0.5)])
@@ -0,0 +1,110 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from nose.tools import eq_
+
+from idzip import compressor, decompressor, tarindex
+from .helpers import CountingReader
+from .test_writer import sample_data
+
+
+FILES = [
+    ("empty.txt", b""),
+    ("dir/small.txt", b"small file\n"),
+    ("dir/big.bin", sample_data(70000, seed=1)),
+    ("a" * 120 + "/long name.txt", sample_data(3000, seed=2)),
+]
+
+
+def _add_files(tar):
+    for name, data in FILES:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    info = tarfile.TarInfo("dir")
+    info.type = tarfile.DIRTYPE
+    tar.addfile(info)
+
+
+def test_build_and_extract():
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "archive.tar.dz")
+        writer = compressor.IdzipWriter(filename, chunk_length=4096)
+        with tarfile.open(fileobj=writer, mode="w") as tar:
+            _add_files(tar)
+        writer.close()
+
+        index = tarindex.build(decompressor.IdzipReader(filename))
+        eq_(list(index.members), [name for name, data in FILES])
+
+        reader = CountingReader(filename)
+        with tarindex.IdzipTarFile(reader=reader, index=index) as archive:
+            eq_(archive.getnames(), [name for name, data in FILES])
+            del reader.inflated[:]
+            eq_(archive.extract("dir/small.txt"), b"small file\n")
+            eq_(len(reader.inflated), 1)
+            for name, data in FILES:
+                eq_(archive.extract(name), data)
+                member = archive.open_member(name)
+                eq_(member.read(10), data[:10])
+                member.seek(-min(5, len(data)), os.SEEK_END)
+                eq_(member.read(), data[len(data) - 5:])
+            try:
+                archive.extract("missing")
+            except KeyError:
+                pass
+            else:
+                assert False, "Extracted a missing member"
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_index_while_writing():
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "archive.tar.dz")
+        writer = compressor.IdzipWriter(filename, chunk_length=4096)
+        tar = tarindex.IndexingTarFile(fileobj=writer, mode="w",
+                sidecar=tarindex.sidecar_name(filename))
+        _add_files(tar)
+        tar.close()
+        writer.close()
+
+        index = tarindex.TarIndex.load(tarindex.sidecar_name(filename))
+        built = tarindex.build(decompressor.IdzipReader(filename))
+        eq_(index.members, built.members)
+        eq_(index.size, built.size)
+
+        reader = CountingReader(filename)
+        archive = tarindex.IdzipTarFile(reader=reader)
+        # The sidecar is used, no header is read.
+        eq_(reader.inflated, [])
+        eq_(archive.extract("dir/big.bin"), FILES[2][1])
+        archive.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_index_command():
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "archive.tar.dz")
+        writer = compressor.IdzipWriter(filename)
+        with tarfile.open(fileobj=writer, mode="w") as tar:
+            _add_files(tar)
+        writer.close()
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([sys.executable, "-m", "idzip.command",
+            "index", "--tar", filename], cwd=root)
+        index = tarindex.TarIndex.load(tarindex.sidecar_name(filename))
+        eq_(len(index), len(FILES))
+        with tarindex.IdzipTarFile(filename) as archive:
+            eq_(archive.extract(FILES[3][0]), FILES[3][1])
+    finally:
+        shutil.rmtree(directory)
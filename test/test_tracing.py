@@ -0,0 +1,78 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+
+from nose.tools import eq_
+
+from idzip import caching, compressor, decompressor, tracing
+from .test_writer import sample_data
+
+
+def _trace(reads):
+    data = sample_data(20000)
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, chunk_length=1000)
+    writer.write(data)
+    writer.close()
+    output.seek(0)
+    trace = io.BytesIO()
+    recorder = tracing.TraceRecorder(fileobj=trace, buffer_records=3)
+    reader = decompressor.IdzipReader(fileobj=output,
+            cache=caching.OneItemCache(), trace=recorder)
+    for offset in reads:
+        reader.seek(offset)
+        eq_(reader.read(10), data[offset:offset + 10])
+    recorder.close()
+    return trace.getvalue()
+
+
+def test_record_and_read():
+    trace = _trace([100, 200, 5000, 5100, 100])
+    eq_((len(trace) - tracing.HEADER_SIZE) % tracing.RECORD_SIZE, 0)
+    fd, filename = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as output:
+            # A partially written record is ignored.
+            output.write(trace + b"\0\0")
+        accesses = list(tracing.read_trace(filename))
+    finally:
+        os.unlink(filename)
+    eq_([(access.chunk_index, access.hit) for access in accesses],
+            [(0, False), (0, True), (5, False), (5, True), (0, False)])
+    assert all(access.inflate_seconds > 0 for access in accesses
+            if not access.hit)
+    eq_(sorted(accesses), accesses)
+
+
+def test_simulate():
+    accesses = [tracing.Access(i, chunk_index, False, 0.001)
+            for i, chunk_index in enumerate([1, 2, 1, 2, 1, 2, 3])]
+    results = dict(((result.policy, result.capacity), result)
+            for result in tracing.simulate(accesses, capacities=[1, 2]))
+    eq_(results["zero", None].hits, 0)
+    eq_(results["one", None].hits, 0)
+    eq_(results["lru", 1].hits, 0)
+    eq_(results["lru", 2].hits, 4)
+    eq_(results["lru", 2].misses, 3)
+    assert abs(results["lru", 2].saved_seconds - 0.004) < 1e-9
+    assert abs(results["lru", 2].hit_ratio - 4 / 7.0) < 1e-9
+    eq_(results["lucky", 2].hits + results["lucky", 2].misses, 7)
+
+
+def test_cache_sim_command():
+    fd, filename = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as output:
+            output.write(_trace([100, 5000, 100, 5000, 100]))
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        report = subprocess.check_output([sys.executable, "-m",
+            "idzip.command", "cache-sim", "-c", "2", "-p", "one,lru",
+            filename], cwd=root).decode("ascii")
+    finally:
+        os.unlink(filename)
+    lines = report.splitlines()
+    assert lines[0].endswith("5 accesses, traced hit ratio 0.000"), lines[0]
+    eq_(lines[2].split()[:3], ["one", "-", "0.000"])
+    eq_(lines[3].split()[:3], ["lru", "2", "0.600"])
@@ -0,0 +1,80 @@
+import gzip
+import io
+
+from nose.tools import eq_
+
+from idzip import compressor, decompressor
+from .test_writer import sample_data
+
+
+class CountingInput(io.BytesIO):
+    """Counts the reads done by the reader."""
+    def __init__(self, data):
+        io.BytesIO.__init__(self, data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return io.BytesIO.read(self, size)
+
+
+def _write(data, **kwargs):
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, trailer_index=True, **kwargs)
+    writer.write(data)
+    writer.close()
+    writer.close()
+    return output.getvalue()
+
+
+def test_trailer_index():
+    data = sample_data(20 * 5000 + 3)
+    compressed = _write(data, chunk_length=5000, sync_size=3 * 5000)
+    eq_(gzip.decompress(compressed), data)
+
+    indexed = decompressor.IdzipReader(fileobj=io.BytesIO(compressed))
+    assert indexed._index_complete
+    walked = decompressor.IdzipReader(fileobj=io.BytesIO(compressed),
+            use_trailer_index=False)
+    eq_(walked.read(), data)
+    eq_(indexed._chunks, walked._chunks[:len(indexed._chunks)])
+    eq_(len(indexed._members), 7)
+    eq_([m.isize for m in indexed._members],
+            [m.isize for m in walked._members[:7]])
+
+    indexed.seek(17 * 5000 - 2)
+    eq_(indexed.read(5), data[17 * 5000 - 2:][:5])
+    eq_(indexed.seek(0, io.SEEK_END), len(data))
+    eq_(indexed.read(), b"")
+    indexed.seek(0)
+    eq_(indexed.read(), data)
+
+
+def test_open_reads():
+    data = sample_data(40 * 1000)
+    compressed = _write(data, chunk_length=1000, sync_size=2000)
+    input = CountingInput(compressed)
+    reader = decompressor.IdzipReader(fileobj=input)
+    reads_to_open = input.reads
+    eq_(reader.seek(0, io.SEEK_END), len(data))
+    eq_(input.reads, reads_to_open)
+
+    input = CountingInput(compressed)
+    reader = decompressor.IdzipReader(fileobj=input, use_trailer_index=False)
+    eq_(reader.seek(0, io.SEEK_END), len(data))
+    assert input.reads > 10 * reads_to_open
+
+
+def test_empty_and_concatenated():
+    compressed = _write(b"")
+    eq_(gzip.decompress(compressed), b"")
+    reader = decompressor.IdzipReader(fileobj=io.BytesIO(compressed))
+    assert reader._index_complete
+    eq_(reader.read(), b"")
+
+    # The index of the second file does not cover the first file.
+    first = _write(b"first ")
+    second = _write(b"second")
+    reader = decompressor.IdzipReader(fileobj=io.BytesIO(first + second))
+    assert not reader._index_complete
+    eq_(reader.read(), b"first second")
@@ -0,0 +1,39 @@
+import io
+
+from nose.tools import eq_
+
+from idzip import tuning
+from .test_chunk_memo import duplicate_heavy_data
+from .test_writer import sample_data
+
+
+def test_read_sample():
+    data = sample_data(10000)
+    eq_(tuning.read_sample(io.BytesIO(data), 20000), data)
+
+    sample = tuning.read_sample(io.BytesIO(data), 1000, pieces=4)
+    eq_(sample, data[:250] + data[2500:2750] + data[5000:5250]
+            + data[7500:7750])
+
+
+def test_tune():
+    data = sample_data(100000)
+    results = tuning.tune(data, [4096, 16384], num_reads=10)
+    eq_([result.chunk_length for result in results], [4096, 16384])
+    for result in results:
+        assert 0 < result.ratio < 1
+        assert result.compress_mbps > 0
+        assert result.read_latency > 0
+    assert results[0].ratio >= results[1].ratio
+
+
+def test_measure_memo():
+    data = duplicate_heavy_data()
+    plain, memoized = tuning.measure_memo(data, 4)
+    eq_(plain.chunk_cache_size, 0)
+    eq_(plain.hits, 0)
+    eq_(memoized.chunk_cache_size, 4)
+    eq_(memoized.misses, 2)
+    eq_(memoized.hits, 14)
+    assert plain.compress_mbps > 0
+    assert memoized.seconds > 0
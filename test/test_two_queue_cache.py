@@ -0,0 +1,60 @@
+from nose.tools import eq_
+
+from idzip import caching, tracing
+
+
+def test_byte_bound():
+    cache = caching.TwoQueueCache(100)
+    for i in range(20):
+        cache.put(i, b"x" * 30)
+        assert cache.size <= 100
+    eq_(len(cache), 3)
+    # A value larger than the cache is not stored.
+    cache.put("big", b"x" * 101)
+    eq_(cache.get("big"), None)
+
+
+def test_promotion():
+    cache = caching.TwoQueueCache(4, sizeof=len, in_ratio=0.5)
+    cache.put(1, b"a")
+    for key in range(2, 6):
+        cache.put(key, b"b")
+    # The key 1 was evicted from the recent chunks and remembered.
+    eq_(cache.get(1), None)
+    cache.put(1, b"a")
+    for key in range(6, 20):
+        cache.put(key, b"c")
+    eq_(cache.get(1), b"a")
+
+
+def test_scan_resistance():
+    cache = caching.TwoQueueCache(16, sizeof=len)
+    hot = list(range(8))
+    # The hot chunks are read again after leaving the recent chunks.
+    for i in range(5):
+        for key in hot + list(range(10 + 10 * i, 18 + 10 * i)):
+            if cache.get(key) is None:
+                cache.put(key, b"h")
+    # A sequential sweep over many other chunks.
+    for key in range(100, 1100):
+        if cache.get(key) is None:
+            cache.put(key, b"s")
+    eq_([cache.get(key) for key in hot], [b"h"] * len(hot))
+
+
+def test_counters_and_view():
+    cache = caching.TwoQueueCache(100)
+    view = cache.view("a")
+    view.put(1, b"data")
+    eq_(view.get(1), b"data")
+    eq_(cache.view("b").get(1), None)
+    eq_((cache.hits, cache.misses), (1, 1))
+
+
+def test_mixed_workload():
+    accesses = tracing.mixed_workload(num_chunks=1000, hot_chunks=32,
+            lookups=4000, scan_every=1000, seed=1)
+    eq_(len(accesses), 4000 + 4 * 1000)
+    results = dict(((result.policy, result.capacity), result)
+            for result in tracing.simulate(accesses, ["lru", "2q"], [64]))
+    assert results["2q", 64].hits > results["lru", 64].hits
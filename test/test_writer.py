@@ -0,0 +1,289 @@
+import gzip
+import io
+import random
+import warnings
+
+from nose.tools import eq_
+
+from idzip import compressor, decompressor
+
+
+def sample_data(size, seed=0):
+    rand = random.Random(seed)
+    words = [b"idzip", b"dictzip", b"gzip", b"member", b"chunk", b"\n"]
+    data = bytearray()
+    while len(data) < size:
+        data += rand.choice(words) + b" "
+    return bytes(data[:size])
+
+
+class UnseekableOutput(object):
+    """A write-only stream like a pipe."""
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.closed = False
+
+    def write(self, b):
+        return self.buffer.write(b)
+
+    def tell(self):
+        return self.buffer.tell()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _write(data, write_size, output=None, **kwargs):
+    if output is None:
+        output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, **kwargs)
+    for start in range(0, len(data), write_size):
+        writer.write(data[start:start + write_size])
+    writer.close()
+    return output
+
+
+def test_write_sizes():
+    data = sample_data(3 * compressor.CHUNK_LENGTH + 123)
+    for write_size in [1, 7, 4096, compressor.CHUNK_LENGTH, len(data)]:
+        output = _write(data, write_size)
+        eq_(gzip.decompress(output.getvalue()), data)
+
+
+def test_write_buffer_types():
+    data = sample_data(2 * compressor.CHUNK_LENGTH + 5)
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output)
+    eq_(writer.write(bytearray(data[:10])), 10)
+    eq_(writer.write(memoryview(data)[10:]), len(data) - 10)
+    writer.close()
+    eq_(gzip.decompress(output.getvalue()), data)
+
+
+def test_member_sizes():
+    data = sample_data(5 * compressor.CHUNK_LENGTH)
+    sync_size = compressor.CHUNK_LENGTH + 1000
+    output = _write(data, 10000, sync_size=sync_size)
+    output.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output)
+    eq_(reader.read(), data)
+    sizes = [member.isize for member in reader._members]
+    eq_(sizes, [sync_size] * 4 + [len(data) - 4 * sync_size])
+
+
+def test_unseekable_output():
+    data = sample_data(2 * compressor.CHUNK_LENGTH + 77)
+    output = _write(data, 1000, output=UnseekableOutput())
+    eq_(gzip.decompress(output.buffer.getvalue()), data)
+
+    output.buffer.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output.buffer)
+    reader.seek(compressor.CHUNK_LENGTH - 10)
+    eq_(reader.read(20), data[compressor.CHUNK_LENGTH - 10:][:20])
+
+
+def test_empty_and_flushed():
+    output = _write(b"", 1)
+    eq_(gzip.decompress(output.getvalue()), b"")
+
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output)
+    writer.write(b"first")
+    writer.flush()
+    writer.flush()
+    writer.write(b" second")
+    writer.close()
+    eq_(gzip.decompress(output.getvalue()), b"first second")
+    output.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output)
+    eq_(reader.read(), b"first second")
+    eq_(len(reader._members), 2)
+
+
+def _write_members(data, member_size, **kwargs):
+    """Returns the writer, the output and the level and XFL of each member."""
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, sync_size=member_size, **kwargs)
+    levels = []
+    xfls = []
+    for start in range(0, len(data), member_size):
+        levels.append(writer.compression_level)
+        member_pos = output.tell()
+        writer.write(data[start:start + member_size])
+        xfls.append(output.getvalue()[member_pos + 8])
+    writer.close()
+    return writer, output, levels, xfls
+
+
+def test_fixed_level():
+    data = sample_data(2 * compressor.CHUNK_LENGTH)
+    writer, output, levels, xfls = _write_members(
+            data, compressor.CHUNK_LENGTH, compression_level=1)
+    eq_(levels, [1, 1])
+    eq_(xfls, [4, 4])
+    assert writer.deflate_mbps > 0
+    eq_(gzip.decompress(output.getvalue()), data)
+
+
+def test_adaptive_level():
+    data = sample_data(6 * compressor.CHUNK_LENGTH)
+    # Unreachable speed lowers the level down to the floor.
+    writer, output, levels, xfls = _write_members(
+            data, compressor.CHUNK_LENGTH, target_mbps=1e9,
+            min_level=6)
+    eq_(levels, [9, 8, 7, 6, 6, 6])
+    eq_(xfls, [2, 0, 0, 0, 0, 0])
+    eq_(gzip.decompress(output.getvalue()), data)
+
+    # A trivial speed raises the level up to the ceiling.
+    writer, output, levels, xfls = _write_members(
+            data, compressor.CHUNK_LENGTH, target_mbps=1e-9,
+            compression_level=1, max_level=3)
+    eq_(levels, [1, 2, 3, 3, 3, 3])
+    eq_(xfls, [4, 0, 0, 0, 0, 0])
+    eq_(gzip.decompress(output.getvalue()), data)
+
+
+def test_stored_chunks():
+    rand = random.Random(1)
+    noise = bytes(bytearray(rand.getrandbits(8)
+            for i in range(2 * compressor.CHUNK_LENGTH)))
+    text = sample_data(compressor.CHUNK_LENGTH)
+    data = noise + text + noise[:100]
+
+    output = _write(data, 5000)
+    eq_(gzip.decompress(output.getvalue()), data)
+    output.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output)
+    zlengths = [zlen for offset, zlen in reader._chunks]
+    eq_(zlengths[:2], [compressor.CHUNK_LENGTH + 5] * 2)
+    assert zlengths[2] < compressor.CHUNK_LENGTH // 2
+    eq_(zlengths[3], 105)
+    reader.seek(compressor.CHUNK_LENGTH - 3)
+    eq_(reader.read(6), data[compressor.CHUNK_LENGTH - 3:][:6])
+
+    writer = compressor.IdzipWriter(io.BytesIO(),
+            store_incompressible=False)
+    writer.write(data)
+    writer.close()
+    eq_(writer.stored_chunks, 0)
+
+
+def test_chunk_length():
+    data = sample_data(5 * 8192 + 17)
+    output = _write(data, 3000, chunk_length=8192)
+    eq_(gzip.decompress(output.getvalue()), data)
+    output.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output)
+    eq_(reader._members[0].chlen, 8192)
+    reader.seek(2 * 8192 - 5)
+    eq_(reader.read(10), data[2 * 8192 - 5:][:10])
+    eq_(len(reader._chunks), 6)
+
+    for chunk_length in [0, compressor.MAX_CHUNK_LENGTH + 1]:
+        try:
+            compressor.IdzipWriter(io.BytesIO(), chunk_length=chunk_length)
+        except ValueError:
+            pass
+        else:
+            assert False, "Accepted chunk length %s" % chunk_length
+
+
+def test_max_chunk_length():
+    rand = random.Random(2)
+    noise = bytes(bytearray(rand.getrandbits(8)
+            for i in range(2 * compressor.MAX_CHUNK_LENGTH)))
+    for store_incompressible in [True, False]:
+        output = _write(noise, len(noise),
+                chunk_length=compressor.MAX_CHUNK_LENGTH,
+                store_incompressible=store_incompressible)
+        eq_(gzip.decompress(output.getvalue()), noise)
+        output.seek(0)
+        reader = decompressor.IdzipReader(fileobj=output)
+        eq_(reader.read(), noise)
+        assert max(zlen for offset, zlen in reader._chunks) <= 0xffff
+
+
+def test_extended_version():
+    data = sample_data(10 * 100000 + 11)
+    output = _write(data, 30000, chunk_length=100000, version=2,
+            sync_size=3 * 100000 + 5)
+    eq_(gzip.decompress(output.getvalue()), data)
+    output.seek(0)
+    reader = decompressor.IdzipReader(fileobj=output)
+    eq_(reader._members[0].chlen, 100000)
+    # The extended field stores the member size in the header.
+    eq_(reader._members[0].isize, 3 * 100000 + 5)
+    reader.seek(7 * 100000 - 3)
+    eq_(reader.read(10), data[7 * 100000 - 3:][:10])
+    eq_(reader.read(), data[7 * 100000 + 7:])
+
+    eq_(compressor.max_member_size(1 << 20, version=2),
+            compressor.MAX_NUM_CHUNKS_EXTENDED << 20)
+    assert (compressor.max_member_size(1 << 20, version=2) >
+            8 * compressor.MAX_MEMBER_SIZE)
+
+
+def test_default_member_limit():
+    writer = compressor.IdzipWriter(io.BytesIO())
+    eq_(writer._member_limit(), compressor.MAX_MEMBER_SIZE)
+    writer = compressor.IdzipWriter(io.BytesIO(), version=2)
+    eq_(writer.chunk_length, compressor.EXTENDED_CHUNK_LENGTH)
+    eq_(writer._member_limit(), compressor.max_member_size(
+        compressor.EXTENDED_CHUNK_LENGTH, version=2))
+    writer = compressor.IdzipWriter(io.BytesIO(), version=2,
+            chunk_length=1 << 20, sync_size=1000)
+    eq_(writer._member_limit(), 1000)
+
+
+def test_deprecated_buffer():
+    output = io.BytesIO()
+    writer = compressor.IdzipWriter(output, chunk_length=1000)
+    writer.write(b"x" * 2500)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        writer.reset_buffer()
+        eq_(writer.input_buffer.getvalue(), b"x" * 500)
+        eq_(writer.input_buffer.tell(), 500)
+    eq_([warning.category for warning in caught], [DeprecationWarning] * 3)
+    writer.close()
+    eq_(gzip.decompress(output.getvalue()), b"x" * 2500)
+    assert compressor.WRITE_BLOCK_SIZE > 0
+
+
+def test_streamed_member():
+    data = sample_data(200000)
+    max_buffered = compressor.MAX_BUFFERED_MEMBER
+    compressor.MAX_BUFFERED_MEMBER = 5000
+    try:
+        for kwargs in [{}, {"version": 2},
+                {"record_delimiter": b"\n", "trailer_index": True}]:
+            output = io.BytesIO()
+            writer = compressor.IdzipWriter(output, chunk_length=1000,
+                    sync_size=120000, **kwargs)
+            writer.write(data[:50000])
+            # The long member is written without its header.
+            assert len(writer._member_data) == 0
+            assert output.tell() > 5000
+            reader = decompressor.IdzipReader(
+                    fileobj=io.BytesIO(output.getvalue()))
+            eq_(reader.read(), b"")
+
+            writer.write(data[50000:])
+            writer.close()
+            eq_(gzip.decompress(output.getvalue()), data)
+            output.seek(0)
+            reader = decompressor.IdzipReader(fileobj=output)
+            reader.seek(123456)
+            eq_(reader.read(100), data[123456:123556])
+            eq_(len(reader._members), 2)
+
+        # An unseekable output gets the headers before the data.
+        output = _write(data, 30000, output=UnseekableOutput(),
+                chunk_length=1000)
+        eq_(gzip.decompress(output.buffer.getvalue()), data)
+    finally:
+        compressor.MAX_BUFFERED_MEMBER = max_buffered